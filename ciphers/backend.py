@@ -0,0 +1,150 @@
+# Linear algebra backends for the ciphers and the trail search:
+# - "sage": Sage matrices and vectors over GF(2) and Sage's SBox (the default)
+# - "numpy": GF2Matrix, GF2Vector and LUTSBox from ciphers.gf2, which do not need a Sage session
+# Both kinds of matrices share the same methods (products, inverse, slicing, ...), so only the
+# constructors are listed here. Structured matrices (see ciphers.structured) work on top of both. Backend modules are imported on first use.
+
+import sys
+
+
+class SageBackend:
+    name = "sage"
+
+    def block_diagonal_matrix(self, matrices):
+        from sage.matrix.special import block_diagonal_matrix
+        return block_diagonal_matrix(list(matrices))
+
+    def vector(self, bits):
+        from sage.modules.free_module_element import vector
+        from sage.rings.finite_rings.finite_field_constructor import GF
+        return vector(GF(2), list(bits))
+
+    def vector_from_int(self, x, n):
+        """
+        The vector of the n bits of x, most significant bit first
+        """
+        from sboxU import tobin
+        return self.vector(tobin(x, n))
+
+    def matrix_from_linear_lut(self, lut):
+        from sboxU import linear_function_lut_to_matrix
+        return linear_function_lut_to_matrix(lut)
+
+    def permutation_matrix(self, permutation):
+        """
+        The matrix P such that (P x)[i] = x[permutation[i]]
+        """
+        from sage.matrix.constructor import Matrix
+        from sage.rings.finite_rings.finite_field_constructor import GF
+        n = len(permutation)
+        return Matrix(GF(2), n, n, {(i, j): 1 for i, j in enumerate(permutation)})
+
+    def sbox(self, lut):
+        from sage.crypto.sbox import SBox
+        return SBox(lut)
+
+    def convert(self, value):
+        """
+        Converts a matrix, vector or S-box of any backend to this backend (other values are returned as is)
+        """
+        if hasattr(value, "to_backend"):
+            return value.to_backend(self)
+        if getattr(value, "BACKEND", None) == "numpy":
+            return value.to_sage()
+        return value
+
+
+class NumpyBackend:
+    name = "numpy"
+
+    def block_diagonal_matrix(self, matrices):
+        from ciphers.gf2 import block_diagonal_matrix
+        return block_diagonal_matrix(list(matrices))
+
+    def vector(self, bits):
+        from ciphers.gf2 import GF2Vector
+        return GF2Vector.from_bits([int(b) for b in bits])
+
+    def vector_from_int(self, x, n):
+        from ciphers.gf2 import GF2Vector
+        return GF2Vector.from_int(x, n)
+
+    def matrix_from_linear_lut(self, lut):
+        from ciphers.gf2 import GF2Matrix
+        return GF2Matrix.from_linear_lut(lut)
+
+    def permutation_matrix(self, permutation):
+        from ciphers.gf2 import GF2Matrix
+        return GF2Matrix.from_permutation(permutation)
+
+    def sbox(self, lut):
+        from ciphers.gf2 import LUTSBox
+        return LUTSBox(lut)
+
+    def convert(self, value):
+        """
+        Converts a matrix, vector or S-box of any backend to this backend (other values are returned as is)
+        """
+        from ciphers.gf2 import GF2Matrix, GF2Vector, LUTSBox
+        if hasattr(value, "to_backend"):
+            return value.to_backend(self)
+        if getattr(value, "BACKEND", None) == "numpy":
+            return value
+        if hasattr(value, "nrows"):
+            return GF2Matrix.from_sage(value)
+        if hasattr(value, "input_size"):
+            return LUTSBox.from_sage(value)
+        if is_sage_vector(value):
+            return GF2Vector.from_bits([int(x) for x in value])
+        return value
+
+
+def is_sage_vector(value):
+    """
+    Returns whether value is a Sage vector (Sage integers also have base_ring and list, so the
+    type is checked), without importing Sage
+    """
+    element = sys.modules.get("sage.structure.element")
+    return element is not None and isinstance(value, element.Vector)
+
+
+BACKENDS = {backend.name: backend for backend in [SageBackend(), NumpyBackend()]}
+
+
+def get_backend(backend):
+    """
+    Returns the backend with the given name (backend objects are returned as is)
+    """
+    if isinstance(backend, str):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown backend {backend!r}, expected one of {sorted(BACKENDS)}")
+        return BACKENDS[backend]
+    return backend
+
+
+def backend_of(value):
+    """
+    Returns the backend of a matrix, vector or S-box
+    """
+    return BACKENDS[getattr(value, "BACKEND", "sage")]
+
+
+def matrix_bits(M):
+    """
+    Entries of a matrix of any backend as a 2D NumPy array
+    """
+    return get_backend("numpy").convert(M).bits()
+
+
+def vector_to_int(v):
+    """
+    The integer of the bits of a vector of any backend, the first bit being the most significant one
+    """
+    return int("".join(str(int(b)) for b in v), 2) if len(v) else 0
+
+
+def affine_key(M, c):
+    """
+    Hashable key of the affine map x -> M x + c, with M and c of any backend
+    """
+    return (matrix_bits(M).tobytes(), vector_to_int(c))
@@ -1,8 +1,14 @@
 from abc import ABC, abstractmethod
-from sage.matrix.special import block_diagonal_matrix
-from sage.modules.free_module_element import vector
-from sage.crypto.sbox import SBox
-from sage.rings.integer_ring import ZZ
+from copy import copy
+from functools import cached_property
+from ciphers.backend import backend_of, get_backend
+from ciphers.structured import (BlockDiagonalMatrix, PermutationMatrix, ProductMatrix, inverse_permutation,
+                                permutation_indices, permute_vector)
+
+
+def _zero_vector(state):
+    from sage.modules.free_module_element import vector
+    return vector(state.base_ring(), len(state))
 
 
 class Cipher(ABC):
@@ -10,28 +16,103 @@ class Cipher(ABC):
 
     def __init__(self, S, L, nbr_sboxes, name):
         self.S = S
-        self.S_inverse = S.inverse()
-        # make sure that bit order is not messed up
-        S_hat = SBox([ZZ((S(ZZ(x).digits(2, padto=len(S)))), 2) for x in range(2**len(S))])
-        self.S_ = [S_hat.component_function(1 << i).algebraic_normal_form() for i in range(len(S))]
-        self.S_inverse_ = [S_hat.inverse().component_function(1 << i).algebraic_normal_form()
-                           for i in range(len(S))]
         self.nbr_sboxes = nbr_sboxes
         self.L = L
-        self.L_inverse = L.inverse()
+        # bit permutation layers are evaluated by shuffling indices instead of a matrix product
+        self.L_permutation = permutation_indices(L)
+        self.L_inverse_permutation = inverse_permutation(self.L_permutation) if self.L_permutation is not None else None
         self.name = name
 
+    @cached_property
+    def S_inverse(self):
+        # only inverted when used (and shared with the cipher returned by inverse())
+        return self.S.inverse()
+
+    @cached_property
+    def L_inverse(self):
+        # only inverted when used (and shared with the cipher returned by inverse())
+        return self.L.inverse()
+
+    @cached_property
+    def S_(self):
+        # algebraic normal forms of the coordinates of S (only computed when used, as this requires Sage,
+        # and shared with the inverse cipher)
+        inverse = self.__dict__.get("_inverse")
+        if inverse is not None and "S_inverse_" in inverse.__dict__:
+            return inverse.S_inverse_
+        return self._anf(self.S)
+
+    @cached_property
+    def S_inverse_(self):
+        inverse = self.__dict__.get("_inverse")
+        if inverse is not None and "S_" in inverse.__dict__:
+            return inverse.S_
+        return self._anf(self.S_inverse)
+
+    @staticmethod
+    def _anf(S):
+        from sage.crypto.sbox import SBox
+        from sage.rings.integer_ring import ZZ
+        S = get_backend("sage").convert(S)
+        # make sure that bit order is not messed up
+        S_hat = SBox([ZZ((S(ZZ(x).digits(2, padto=len(S)))), 2) for x in range(2**len(S))])
+        return [S_hat.component_function(1 << i).algebraic_normal_form() for i in range(len(S))]
+
+    def to_backend(self, backend):
+        """
+        Returns a copy of the cipher whose S-boxes, matrices and vectors use the given backend
+        (see ciphers.backend). This allows to set up ciphers with Sage, and then to run the trail
+        search on the numpy backend in processes which do not import Sage.
+        """
+        backend = get_backend(backend)
+        converted = copy(self)
+        for name, value in vars(self).items():
+            if name in ("S_", "S_inverse_", "_inverse"):
+                delattr(converted, name)  # Sage polynomials, recomputed on demand, and the inverse of the original cipher
+            else:
+                setattr(converted, name, backend.convert(value))
+        return converted
+
     def __repr__(self):
         return self.name
 
+    def __reduce__(self):
+        # pickled as its compact form, see ciphers/serialization.py
+        from ciphers.serialization import compact, restore
+        return (restore, (compact(self),))
+
+    def __copy__(self):
+        copied = type(self).__new__(type(self))
+        copied.__dict__.update(self.__dict__)
+        return copied
+
     def inverse(self):
+        """
+        Returns the inverse cipher, which is only built once: cipher.inverse().inverse() is cipher,
+        and both share their matrices (see also Trail.inverse for their trails)
+        """
+        inverse = self.__dict__.get("_inverse")
+        if inverse is None:
+            inverse = self._new_inverse()
+            self._share_inverses(inverse)
+        return inverse
+
+    def _new_inverse(self):
         return Cipher(self.S_inverse, self.L_inverse, self.nbr_sboxes, self.name + " (inverse)")
 
+    def _share_inverses(self, inverse):
+        # the inverse of the inverse cipher is known, do not compute it again
+        inverse.S_inverse = self.S
+        inverse.L = self.L_inverse
+        inverse.__dict__["L_inverse"] = self.L
+        self._inverse = inverse
+        inverse._inverse = self
+
     def sbox_layer(self, state, nbr_sboxes=None):
         # slow but allows evaluation of polynomials
         if nbr_sboxes is None:
             nbr_sboxes = self.nbr_sboxes
-        s_ = vector(state.base_ring(), len(state))
+        s_ = _zero_vector(state)
         b = len(self.S)
         for j in range(nbr_sboxes): # iterate sboxes
             x = state[b*j:b*(j+1)]
@@ -42,7 +123,7 @@ class Cipher(ABC):
     def sbox_layer_inverse(self, state, nbr_sboxes=None):
         if nbr_sboxes is None:
             nbr_sboxes = self.nbr_sboxes
-        s_ = vector(state.base_ring(), len(state))
+        s_ = _zero_vector(state)
         b = len(self.S)
         for j in range(nbr_sboxes): # iterate sboxes
             x = state[b*j:b*(j+1)]
@@ -54,7 +135,7 @@ class Cipher(ABC):
         # a bit faster but only GF(2)
         if nbr_sboxes is None:
             nbr_sboxes = self.nbr_sboxes
-        s_ = vector(state.base_ring(), len(state))
+        s_ = _zero_vector(state)
         b = len(self.S)
         for j in range(nbr_sboxes): # iterate sboxes
             s_[b*j:b*(j+1)] = self.S(state[b*j:b*(j+1)])
@@ -64,7 +145,7 @@ class Cipher(ABC):
         # a bit faster but only GF(2)
         if nbr_sboxes is None:
             nbr_sboxes = self.nbr_sboxes
-        s_ = vector(state.base_ring(), len(state))
+        s_ = _zero_vector(state)
         b = len(self.S)
         for j in range(nbr_sboxes): # iterate sboxes
             s_[b*j:b*(j+1)] = self.S_inverse(state[b*j:b*(j+1)])
@@ -72,9 +153,13 @@ class Cipher(ABC):
 
 
     def linear_layer(self, state):
+        if self.L_permutation is not None:
+            return permute_vector(state, self.L_permutation)
         return self.L*state
 
     def linear_layer_inverse(self, state):
+        if self.L_inverse_permutation is not None:
+            return permute_vector(state, self.L_inverse_permutation)
         return self.L_inverse*state
 
 class AESLikeCipher(Cipher):
@@ -82,21 +167,42 @@ class AESLikeCipher(Cipher):
     def __init__(self, S, mc_binary_matrix, sc_binary_matrix, nbr_sboxes, nbr_superboxes, name, sc_first=False):
         self.nbr_superboxes = nbr_superboxes
         self.mc_binary_matrix = mc_binary_matrix # only one superbox
-        self.mc_inverse_binary_matrix = mc_binary_matrix.inverse()
-        self.mc_layer_binary_matrix = block_diagonal_matrix(*[mc_binary_matrix for _ in range(nbr_superboxes)])
-        self.mc_layer_binary_matrix_inverse = self.mc_layer_binary_matrix.inverse()
+        # the layers are kept structured (see ciphers/structured.py): they are never multiplied
+        # out, and their inverses are only computed when used
+        self.mc_layer_binary_matrix = BlockDiagonalMatrix([mc_binary_matrix for _ in range(nbr_superboxes)])
+        self.mc_permutation = permutation_indices(mc_binary_matrix)
+        self.sc_permutation = permutation_indices(sc_binary_matrix)
+        if self.sc_permutation is not None:
+            sc_binary_matrix = PermutationMatrix(self.sc_permutation, backend_of(sc_binary_matrix))
         self.sc_binary_matrix = sc_binary_matrix
-        self.sc_inverse_binary_matrix = sc_binary_matrix.inverse()
+        self.sc_inverse_permutation = inverse_permutation(self.sc_permutation) if self.sc_permutation is not None else None
         self.sc_first = sc_first
-        L = self.mc_layer_binary_matrix*self.sc_binary_matrix if sc_first \
-            else self.sc_binary_matrix*self.mc_layer_binary_matrix
+        L = ProductMatrix([self.mc_layer_binary_matrix, self.sc_binary_matrix]) if sc_first \
+            else ProductMatrix([self.sc_binary_matrix, self.mc_layer_binary_matrix])
         super().__init__(S, L, nbr_sboxes, name)
 
-    def inverse(self):
-        return AESLikeCipher(
+    @cached_property
+    def mc_inverse_binary_matrix(self):
+        return self.mc_binary_matrix.inverse()
+
+    @cached_property
+    def mc_layer_binary_matrix_inverse(self):
+        return self.mc_layer_binary_matrix.inverse()
+
+    @cached_property
+    def sc_inverse_binary_matrix(self):
+        return self.sc_binary_matrix.inverse()
+
+    def _new_inverse(self):
+        inverse = AESLikeCipher(
             self.S_inverse, self.mc_inverse_binary_matrix, self.sc_inverse_binary_matrix,
             self.nbr_sboxes, self.nbr_superboxes, self.name + " (inverse)", not self.sc_first
         )
+        inverse.mc_layer_binary_matrix = self.mc_layer_binary_matrix_inverse
+        inverse.__dict__["mc_inverse_binary_matrix"] = self.mc_binary_matrix
+        inverse.__dict__["mc_layer_binary_matrix_inverse"] = self.mc_layer_binary_matrix
+        inverse.__dict__["sc_inverse_binary_matrix"] = self.sc_binary_matrix
+        return inverse
 
     def superbox(self, state):
         nbr_sboxes_per_superbox = self.nbr_sboxes // self.nbr_superboxes
@@ -105,12 +211,24 @@ class AESLikeCipher(Cipher):
         state = self.sbox_layer(state, nbr_sboxes=nbr_sboxes_per_superbox)
         return state
 
+    def superbox_table(self, directory="."):
+        """
+        Look up table of the superbox (up to 32 bits), built once with NumPy and memory-mapped
+        from directory, see ciphers/superbox.py
+        """
+        from ciphers.superbox import superbox_table
+        return superbox_table(self, directory)
+
     def mc(self, state):
         return self.mc_layer_binary_matrix * state
     def mc_inverse(self, state):
         return self.mc_layer_binary_matrix_inverse * state
     def sc(self, state):
+        if self.sc_permutation is not None:
+            return permute_vector(state, self.sc_permutation)
         return self.sc_binary_matrix * state
     def sc_inverse(self, state):
+        if self.sc_inverse_permutation is not None:
+            return permute_vector(state, self.sc_inverse_permutation)
         return self.sc_inverse_binary_matrix * state
 
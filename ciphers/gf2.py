@@ -0,0 +1,418 @@
+# Dense linear algebra over GF(2) with NumPy, as a lightweight alternative to
+# Sage matrices and vectors over GF(2) which does not need a Sage session.
+#
+# Rows are packed into little-endian 64-bit words: column j of a row is bit
+# j % 64 of word j // 64. Padding bits are always 0, so that equality and
+# hashing can work on the words directly. Indexing and bit order follow Sage
+# (index 0 is the first coordinate, S-box inputs and outputs are big-endian).
+
+import numpy as np
+
+_WORD = np.dtype("<u8")
+
+
+def _nwords(ncols):
+    return (ncols + 63) // 64
+
+
+def _pack(bits):
+    """
+    Pack a 2D array of bits into rows of 64-bit words
+    """
+    bits = np.asarray(bits, dtype=np.uint8).reshape(len(bits), -1) & 1
+    nrows, ncols = bits.shape
+    padded = np.zeros((nrows, 64 * _nwords(ncols)), dtype=np.uint8)
+    padded[:, :ncols] = bits
+    return np.packbits(padded, axis=1, bitorder="little").view(_WORD)
+
+
+def _unpack(words, ncols):
+    """
+    Unpack rows of 64-bit words into a 2D array of bits
+    """
+    words = np.ascontiguousarray(words, dtype=_WORD)
+    return np.unpackbits(words.view(np.uint8), axis=1, bitorder="little")[:, :ncols]
+
+
+def _int_to_bits(x, n):
+    return [(x >> (n - 1 - i)) & 1 for i in range(n)]
+
+
+class GF2Vector:
+    """
+    Vector over GF(2) of length n, stored as packed 64-bit words
+    """
+    BACKEND = "numpy"
+
+    def __init__(self, n, words=None):
+        self._n = n
+        self._words = np.zeros(_nwords(n), dtype=_WORD) if words is None else words
+
+    @staticmethod
+    def from_bits(bits):
+        bits = np.asarray(list(bits) if not isinstance(bits, np.ndarray) else bits, dtype=np.uint8)
+        return GF2Vector(len(bits), _pack(bits.reshape(1, -1))[0])
+
+    @staticmethod
+    def from_int(x, n):
+        """
+        The vector of the n bits of x, most significant bit first (as sboxU's tobin)
+        """
+        return GF2Vector.from_bits(_int_to_bits(x, n))
+
+    def bits(self):
+        return _unpack(self._words.reshape(1, -1), self._n)[0]
+
+    def numpy(self):
+        return self.bits()
+
+    def list(self):
+        return [int(b) for b in self.bits()]
+
+    def to_int(self):
+        return int("".join(map(str, self.list())) or "0", 2)
+
+    def to_sage(self):
+        from sage.modules.free_module_element import vector
+        from sage.rings.finite_rings.finite_field_constructor import GF
+        return vector(GF(2), self.list())
+
+    def permuted(self, permutation):
+        """
+        Return the vector whose i-th coordinate is the coordinate permutation[i] of this vector
+        """
+        return GF2Vector.from_bits(self.bits()[list(permutation)])
+
+    def hamming_weight(self):
+        return int(np.unpackbits(self._words.view(np.uint8)).sum())
+
+    def is_zero(self):
+        return not self._words.any()
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        return iter(self.list())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return GF2Vector.from_bits(self.bits()[key])
+        if key < 0:
+            key += self._n
+        return int((self._words[key // 64] >> np.uint64(key % 64)) & np.uint64(1))
+
+    def __add__(self, other):
+        if len(other) != self._n:
+            raise ArithmeticError("vectors must have the same length")
+        return GF2Vector(self._n, self._words ^ other._words)
+
+    __sub__ = __add__
+
+    def __eq__(self, other):
+        if not isinstance(other, GF2Vector):
+            return NotImplemented
+        return self._n == other._n and np.array_equal(self._words, other._words)
+
+    def __hash__(self):
+        return hash((self._n, self._words.tobytes()))
+
+    def __repr__(self):
+        return "(" + ", ".join(map(str, self.list())) + ")"
+
+
+def concatenate(vectors):
+    """
+    Concatenation of several GF2Vectors
+    """
+    vectors = list(vectors)
+    if not vectors:
+        return GF2Vector(0)
+    return GF2Vector.from_bits(np.concatenate([v.bits() for v in vectors]))
+
+
+class GF2Matrix:
+    """
+    Matrix over GF(2), stored as rows of packed 64-bit words. The methods follow
+    the names of Sage matrices, so that code written for Sage matrices over GF(2)
+    (products, inverse, slicing, equality, hashing, ...) also works with GF2Matrix.
+    Matrices are treated as values: they cannot be modified in place, and can
+    always be hashed.
+    """
+    BACKEND = "numpy"
+
+    def __init__(self, nrows, ncols, words=None):
+        self._nrows = nrows
+        self._ncols = ncols
+        self._words = np.zeros((nrows, _nwords(ncols)), dtype=_WORD) if words is None else words
+
+    @staticmethod
+    def from_bits(bits):
+        """
+        The matrix with the given rows of bits (a 2D array or a list of lists)
+        """
+        bits = np.asarray(bits, dtype=np.uint8)
+        if bits.ndim != 2:
+            bits = bits.reshape(len(bits), -1)
+        return GF2Matrix(bits.shape[0], bits.shape[1], _pack(bits))
+
+    @staticmethod
+    def identity(n):
+        return GF2Matrix.from_bits(np.eye(n, dtype=np.uint8))
+
+    @staticmethod
+    def from_permutation(permutation):
+        """
+        The matrix P such that (P x)[i] = x[permutation[i]]
+        """
+        n = len(permutation)
+        bits = np.zeros((n, n), dtype=np.uint8)
+        bits[np.arange(n), list(permutation)] = 1
+        return GF2Matrix.from_bits(bits)
+
+    @staticmethod
+    def from_linear_lut(lut):
+        """
+        The matrix of a linear function given by its look up table, with the bit
+        order of sboxU's linear_function_lut_to_matrix
+        """
+        n = (len(lut) - 1).bit_length()
+        bits = [[(lut[1 << (n - 1 - j)] >> (n - 1 - i)) & 1 for j in range(n)] for i in range(n)]
+        return GF2Matrix.from_bits(np.array(bits, dtype=np.uint8).reshape(n, n))
+
+    @staticmethod
+    def from_sage(M):
+        return GF2Matrix.from_bits(np.array([[int(x) for x in row] for row in M.rows()], dtype=np.uint8).reshape(M.nrows(), M.ncols()))
+
+    def to_sage(self):
+        from sage.matrix.constructor import Matrix
+        from sage.rings.finite_rings.finite_field_constructor import GF
+        return Matrix(GF(2), self._nrows, self._ncols, self.list())
+
+    def bits(self):
+        return _unpack(self._words, self._ncols)
+
+    def numpy(self):
+        return self.bits()
+
+    def nrows(self):
+        return self._nrows
+
+    def ncols(self):
+        return self._ncols
+
+    def dimensions(self):
+        return (self._nrows, self._ncols)
+
+    def is_square(self):
+        return self._nrows == self._ncols
+
+    def is_zero(self):
+        return not self._words.any()
+
+    def is_one(self):
+        return self.is_square() and self == GF2Matrix.identity(self._nrows)
+
+    def list(self):
+        return [int(b) for b in self.bits().reshape(-1)]
+
+    def rows(self):
+        return [GF2Vector(self._ncols, self._words[i].copy()) for i in range(self._nrows)]
+
+    def columns(self):
+        return self.transpose().rows()
+
+    def nonzero_positions(self):
+        return [(int(r), int(c)) for r, c in zip(*np.nonzero(self.bits()))]
+
+    def density(self):
+        return self.bits().sum() / (self._nrows * self._ncols)
+
+    def set_immutable(self):
+        # GF2Matrix objects are never modified in place, this is only here for compatibility with Sage
+        pass
+
+    def transpose(self):
+        return GF2Matrix.from_bits(self.bits().T)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, cols = key
+            if isinstance(rows, slice) or isinstance(cols, slice):
+                rows = rows if isinstance(rows, slice) else slice(rows, rows + 1)
+                cols = cols if isinstance(cols, slice) else slice(cols, cols + 1)
+                # Only unpack the selected rows
+                return GF2Matrix.from_bits(_unpack(self._words[rows], self._ncols)[:, cols])
+            return int((self._words[rows, cols // 64] >> np.uint64(cols % 64)) & np.uint64(1))
+        return GF2Vector(self._ncols, self._words[key].copy())
+
+    def matrix_from_rows_and_columns(self, rows, columns):
+        return GF2Matrix.from_bits(_unpack(self._words[list(rows)], self._ncols)[:, list(columns)])
+
+    def __add__(self, other):
+        if self.dimensions() != other.dimensions():
+            raise ArithmeticError("matrices must have the same dimensions")
+        return GF2Matrix(self._nrows, self._ncols, self._words ^ other._words)
+
+    __sub__ = __add__
+
+    def _mul_words(self, words):
+        """
+        Returns the words of self * X, where X has the given rows of words. Uses the
+        method of the four Russians with 8 columns of self at a time.
+        """
+        result = np.zeros((self._nrows, words.shape[1]), dtype=_WORD)
+        column_bytes = self._words.view(np.uint8)
+        for c in range((self._ncols + 7) // 8):
+            chunk = words[8*c:8*(c+1)]
+            table = np.zeros((1 << len(chunk), words.shape[1]), dtype=_WORD)
+            for b in range(len(chunk)):
+                table[1 << b:1 << (b + 1)] = table[:1 << b] ^ chunk[b]
+            result ^= table[column_bytes[:, c] & ((1 << len(chunk)) - 1)]
+        return result
+
+    def __mul__(self, other):
+        if isinstance(other, GF2Matrix):
+            if self._ncols != other._nrows:
+                raise ArithmeticError("dimension mismatch")
+            return GF2Matrix(self._nrows, other._ncols, self._mul_words(other._words))
+        if isinstance(other, GF2Vector):
+            if self._ncols != len(other):
+                raise ArithmeticError("dimension mismatch")
+            bits = self.bits()
+            return GF2Vector.from_bits(bits[:, other.bits().astype(bool)].sum(axis=1) & 1)
+        return NotImplemented
+
+    def _echelon(self, augment=None):
+        """
+        Gauss-Jordan elimination of the rows of self (augmented by the given words,
+        if any). Returns the reduced words, the augmented part and the pivot columns.
+        """
+        words = self._words.copy()
+        extra = None if augment is None else augment.copy()
+        pivots = []
+        r = 0
+        for c in range(self._ncols):
+            if r == self._nrows:
+                break
+            column = (words[:, c // 64] >> np.uint64(c % 64)) & np.uint64(1)
+            candidates = np.nonzero(column[r:])[0]
+            if len(candidates) == 0:
+                continue
+            p = r + candidates[0]
+            if p != r:
+                words[[r, p]] = words[[p, r]]
+                if extra is not None:
+                    extra[[r, p]] = extra[[p, r]]
+                column[[r, p]] = column[[p, r]]
+            mask = column.astype(bool)
+            mask[r] = False
+            words[mask] ^= words[r]
+            if extra is not None:
+                extra[mask] ^= extra[r]
+            pivots.append(c)
+            r += 1
+        return words, extra, pivots
+
+    def rank(self):
+        return len(self._echelon()[2])
+
+    def is_invertible(self):
+        return self.is_square() and self.rank() == self._nrows
+
+    def inverse(self):
+        if not self.is_square():
+            raise ArithmeticError("self must be a square matrix")
+        _, inverse, pivots = self._echelon(GF2Matrix.identity(self._nrows)._words)
+        if len(pivots) != self._nrows:
+            raise ZeroDivisionError("input matrix must be nonsingular")
+        return GF2Matrix(self._nrows, self._ncols, inverse)
+
+    __invert__ = inverse
+
+    def __eq__(self, other):
+        if not isinstance(other, GF2Matrix):
+            return NotImplemented
+        return self.dimensions() == other.dimensions() and np.array_equal(self._words, other._words)
+
+    def __hash__(self):
+        return hash((self._nrows, self._ncols, self._words.tobytes()))
+
+    def __repr__(self):
+        return "\n".join("[" + " ".join(map(str, row)) + "]" for row in self.bits().tolist())
+
+
+def block_diagonal_matrix(*matrices):
+    """
+    Block diagonal matrix of the given GF2Matrix objects (which may also be given as a single list)
+    """
+    if len(matrices) == 1 and isinstance(matrices[0], (list, tuple)):
+        matrices = matrices[0]
+    nrows = sum(M.nrows() for M in matrices)
+    ncols = sum(M.ncols() for M in matrices)
+    bits = np.zeros((nrows, ncols), dtype=np.uint8)
+    r = c = 0
+    for M in matrices:
+        bits[r:r + M.nrows(), c:c + M.ncols()] = M.bits()
+        r += M.nrows()
+        c += M.ncols()
+    return GF2Matrix.from_bits(bits)
+
+
+class LUTSBox:
+    """
+    S-box given by its look up table, with the interface of Sage's SBox that is used
+    by Cipher (inputs and outputs given as vectors are big-endian, as in Sage)
+    """
+    BACKEND = "numpy"
+
+    def __init__(self, lut):
+        self._lut = [int(y) for y in lut]
+        self._m = (len(self._lut) - 1).bit_length()
+
+    @staticmethod
+    def from_sage(S):
+        return LUTSBox(list(S))
+
+    def to_sage(self):
+        from sage.crypto.sbox import SBox
+        return SBox(self._lut)
+
+    def input_size(self):
+        return self._m
+
+    def output_size(self):
+        return self._m
+
+    def inverse(self):
+        inverse = [0] * len(self._lut)
+        for x, y in enumerate(self._lut):
+            inverse[y] = x
+        return LUTSBox(inverse)
+
+    def __len__(self):
+        # as for Sage's SBox, this is the number of input bits
+        return self._m
+
+    def __iter__(self):
+        return iter(self._lut)
+
+    def __getitem__(self, x):
+        return self._lut[x]
+
+    def __call__(self, x):
+        if isinstance(x, GF2Vector):
+            return GF2Vector.from_int(self._lut[x.to_int()], self._m)
+        if isinstance(x, (list, tuple)):
+            y = self._lut[int("".join(str(int(b)) for b in x), 2)]
+            return _int_to_bits(y, self._m)
+        return self._lut[x]
+
+    def __eq__(self, other):
+        return isinstance(other, LUTSBox) and self._lut == other._lut
+
+    def __hash__(self):
+        return hash(tuple(self._lut))
+
+    def __repr__(self):
+        return "(" + ", ".join(map(str, self._lut)) + ")"
@@ -20,6 +20,9 @@ from sage.misc.superseded import experimental
 from sage.structure.sage_object import SageObject
 
 import sys
+from collections.abc import Mapping
+
+from ciphers.structured import permutation_indices
 
 
 def branch_number(mtr):
@@ -135,6 +138,19 @@ class LinearLayer(SageObject):
         return "LinearLayer of dimension %d x %d represented as\n%s" \
                % (self.dimensions() + (self.matrix().__repr__(),))
 
+    def __reduce__(self):
+        # the classes of linear layers are created by new(), they are pickled as their compact form
+        # (see ciphers/serialization.py)
+        from ciphers.serialization import compact, restore
+        return (restore, (compact(self),))
+
+    def _compact_args(self):
+        K = self.base_ring()
+        if K.degree() == 1:
+            return __name__, "_linear_layer_from_binary", [self.binary_matrix()]
+        return __name__, "_linear_layer_from_entries", [
+            K, self.nrows(), self.ncols(), [x.integer_representation() for x in self.list()]]
+
     def matrix(self):
         """
         Return the matrix representing this linear layer
@@ -305,6 +321,11 @@ class AESLikeLinearLayer(LinearLayer, Matrix_gf2e_dense):
 
         return ll
 
+    def _compact_args(self):
+        K = self.base_ring()
+        return __name__, "_aes_like_linear_layer", [
+            K, permutation_indices(self._sc), self._mc.nrows(), [x.integer_representation() for x in self._mc.list()]]
+
     def __repr__(self):
        # convert ShuffleCells permutation matrix to a permutation object
         perm_sc = Permutation(map(lambda x: 1+list(x).index(1), self._sc.columns()))
@@ -412,21 +433,63 @@ _AES_field = GF(2**8, name="x", modulus=_AES_irreducible_polynomial, repr="int")
 AES_ShiftRows = Left_ShiftRows
 AES_MixColumns = Matrix(_AES_field, 4, 4,
     map(_AES_field.fetch_int, [2, 3, 1, 1, 1, 2, 3, 1, 1, 1, 2, 3, 3, 1, 1, 2]))
-AES = AESLikeLinearLayer.new(AES_ShiftRows, AES_MixColumns)
+
+
+def _linear_layer_from_binary(M):
+    return LinearLayer.new(M)
+
+
+def _linear_layer_from_entries(K, nrows, ncols, entries):
+    return LinearLayer.new(Matrix(K, nrows, ncols, [K.fetch_int(x) for x in entries]))
+
+
+def _aes_like_linear_layer(K, sc, nrows_mc, mc):
+    sc = Matrix(K, len(sc), len(sc), {(i, j): 1 for i, j in enumerate(sc)})
+    return AESLikeLinearLayer.new(sc, Matrix(K, nrows_mc, len(mc) // nrows_mc, [K.fetch_int(x) for x in mc]))
+
+
+# The linear layers below are only built when they are first accessed, e.g.
+# with ``from ciphers.linearlayer import AES`` (see ``__getattr__``), so that
+# importing this module stays cheap.
+_lazy_linearlayers = {}
+
+
+def _lazy_linearlayer(f):
+    _lazy_linearlayers[f.__name__.lstrip("_")] = f
+    return f
+
+
+@_lazy_linearlayer
+def _AES():
+    return AESLikeLinearLayer.new(AES_ShiftRows, AES_MixColumns)
+
 
 Midori_ShuffelCells = Permutation([1, 11, 6, 16, 15, 5, 12, 2,
                                    10, 4, 13, 7, 8, 14, 3, 9])
 Midori_MixColumns = Matrix(GF(2**4, repr="int"),
     [[0, 1, 1, 1], [1, 0, 1, 1], [1, 1, 0, 1], [1, 1, 1, 0]])
-Midori = AESLikeLinearLayer.new(Midori_ShuffelCells, Midori_MixColumns)
+
+
+@_lazy_linearlayer
+def _Midori():
+    return AESLikeLinearLayer.new(Midori_ShuffelCells, Midori_MixColumns)
+
 
 SKINNY_ShiftRows = Right_ShiftRows
 SKINNY_4_MixColumns = Matrix(GF(2**4, repr="int"),
     [[1, 0, 1, 1], [1, 0, 0, 0], [0, 1, 1, 0], [1, 0, 1, 0]])
 SKINNY_8_MixColumns = Matrix(GF(2**8, repr="int"),
     [[1, 0, 1, 1], [1, 0, 0, 0], [0, 1, 1, 0], [1, 0, 1, 0]])
-SKINNY_4 = AESLikeLinearLayer.new(SKINNY_ShiftRows, SKINNY_4_MixColumns)
-SKINNY_8 = AESLikeLinearLayer.new(SKINNY_ShiftRows, SKINNY_8_MixColumns)
+
+
+@_lazy_linearlayer
+def _SKINNY_4():
+    return AESLikeLinearLayer.new(SKINNY_ShiftRows, SKINNY_4_MixColumns)
+
+
+@_lazy_linearlayer
+def _SKINNY_8():
+    return AESLikeLinearLayer.new(SKINNY_ShiftRows, SKINNY_8_MixColumns)
 
 
 def smallscale_present_linearlayer(nsboxes=16):
@@ -453,32 +516,67 @@ def smallscale_present_linearlayer(nsboxes=16):
     return LinearLayer.new(m)
 
 
-PRESENT = smallscale_present_linearlayer(nsboxes=16)
+@_lazy_linearlayer
+def _PRESENT():
+    return smallscale_present_linearlayer(nsboxes=16)
 
 
-GIFT64 = LinearLayer.new(Matrix(GF(2), Permutation([
-    1, 18, 35, 52, 49, 2, 19, 36, 33, 50, 3, 20, 17, 34, 51, 4,
-    5, 22, 39, 56, 53, 6, 23, 40, 37, 54, 7, 24, 21, 38, 55, 8,
-    9, 26, 43, 60, 57, 10, 27, 44, 41, 58, 11, 28, 25, 42, 59, 12,
-    13, 30, 47, 64, 61, 14, 31, 48, 45, 62, 15, 32, 29, 46, 63, 16
-    ]).to_matrix()))
+@_lazy_linearlayer
+def _GIFT64():
+    return LinearLayer.new(Matrix(GF(2), Permutation([
+        1, 18, 35, 52, 49, 2, 19, 36, 33, 50, 3, 20, 17, 34, 51, 4,
+        5, 22, 39, 56, 53, 6, 23, 40, 37, 54, 7, 24, 21, 38, 55, 8,
+        9, 26, 43, 60, 57, 10, 27, 44, 41, 58, 11, 28, 25, 42, 59, 12,
+        13, 30, 47, 64, 61, 14, 31, 48, 45, 62, 15, 32, 29, 46, 63, 16
+        ]).to_matrix()))
 
-GIFT128 = LinearLayer.new(Matrix(GF(2), Permutation([
-    1, 34, 67, 100, 97, 2, 35, 68, 65, 98, 3, 36, 33, 66, 99, 4,
-    5, 38, 71, 104, 101, 6, 39, 72, 69, 102, 7, 40, 37, 70, 103, 8,
-    9, 42, 75, 108, 105, 10, 43, 76, 73, 106, 11, 44, 41, 74, 107, 12,
-    13, 46, 79, 112, 109, 14, 47, 80, 77, 110, 15, 48, 45, 78, 111, 16,
-    17, 50, 83, 116, 113, 18, 51, 84, 81, 114, 19, 52, 49, 82, 115, 20,
-    21, 54, 87, 120, 117, 22, 55, 88, 85, 118, 23, 56, 53, 86, 119, 24,
-    25, 58, 91, 124, 121, 26, 59, 92, 89, 122, 27, 60, 57, 90, 123, 28,
-    29, 62, 95, 128, 125, 30, 63, 96, 93, 126, 31, 64, 61, 94, 127, 32
-    ]).to_matrix()))
 
+@_lazy_linearlayer
+def _GIFT128():
+    return LinearLayer.new(Matrix(GF(2), Permutation([
+        1, 34, 67, 100, 97, 2, 35, 68, 65, 98, 3, 36, 33, 66, 99, 4,
+        5, 38, 71, 104, 101, 6, 39, 72, 69, 102, 7, 40, 37, 70, 103, 8,
+        9, 42, 75, 108, 105, 10, 43, 76, 73, 106, 11, 44, 41, 74, 107, 12,
+        13, 46, 79, 112, 109, 14, 47, 80, 77, 110, 15, 48, 45, 78, 111, 16,
+        17, 50, 83, 116, 113, 18, 51, 84, 81, 114, 19, 52, 49, 82, 115, 20,
+        21, 54, 87, 120, 117, 22, 55, 88, 85, 118, 23, 56, 53, 86, 119, 24,
+        25, 58, 91, 124, 121, 26, 59, 92, 89, 122, 27, 60, 57, 90, 123, 28,
+        29, 62, 95, 128, 125, 30, 63, 96, 93, 126, 31, 64, 61, 94, 127, 32
+        ]).to_matrix()))
+
+
+def __getattr__(name):
+    """
+    Build the lazy linear layers on first access and keep them as module
+    attributes afterwards
+    """
+    if name in _lazy_linearlayers:
+        value = _lazy_linearlayers[name]()
+        setattr(sys.modules[__name__], name, value)
+        return value
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-# Dictionary of all available linear layers
-linearlayers = {}
-for k in dir(sys.modules[__name__]):
-    v = getattr(sys.modules[__name__], k)
-    if isinstance(v, (LinearLayer, AESLikeLinearLayer)):
-        linearlayers[k] = v
 
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_linearlayers))
+
+
+class LinearLayerRegistry(Mapping):
+    """
+    Dictionary of all available linear layers, which are only built when they
+    are looked up
+    """
+    def __getitem__(self, name):
+        if name not in _lazy_linearlayers:
+            raise KeyError(name)
+        return getattr(sys.modules[__name__], name)
+
+    def __iter__(self):
+        return iter(sorted(_lazy_linearlayers))
+
+    def __len__(self):
+        return len(_lazy_linearlayers)
+
+
+# Dictionary of all available linear layers
+linearlayers = LinearLayerRegistry()
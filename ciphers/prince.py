@@ -1,8 +1,8 @@
 from sage.crypto.sboxes import PRINCE as S
 from ciphers.cipher import AESLikeCipher
+from ciphers.structured import BlockDiagonalMatrix
 from sage.all import *
 from sage.matrix.constructor import Matrix as matrix
-from sage.matrix.special import block_diagonal_matrix
 from sage.rings.finite_rings.finite_field_constructor import GF
 from ciphers.linearlayer import ff_matrix_to_binary
 from ciphers.linearlayer import Left_ShiftRows
@@ -34,7 +34,7 @@ class Prince(AESLikeCipher):
                                             M2, M3, M0, M1,
                                             M3, M0, M1, M2,
                                             M0, M1, M2, M3])
-        M_ = block_diagonal_matrix([M0_HAT, M1_HAT, M1_HAT, M0_HAT])
+        M_ = BlockDiagonalMatrix([M0_HAT, M1_HAT, M1_HAT, M0_HAT])
         SR = Left_ShiftRows
         SR = ff_matrix_to_binary(Matrix(GF(2**4), 16, 16,
                                         list(map(GF(2**4).fetch_int,
@@ -45,4 +45,3 @@ class Prince(AESLikeCipher):
             super().__init__(S, M1_HAT, SR, 16, 4, "Prince")
         # Prince has two different MC matrices so manual adjustement is needed
         self.mc_layer_binary_matrix = M_
-        self.mc_layer_binary_matrix_inverse = M_.inverse()
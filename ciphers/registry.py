@@ -0,0 +1,54 @@
+import importlib
+from collections.abc import Mapping
+
+# The ciphers of algorithm_1.sage, by name (Cipher.name): module, class and arguments. Like the
+# linear layers of ciphers.linearlayer, they are only built when they are looked up.
+_CIPHERS = {
+    "AES": ("ciphers.aes", "AES", ()),
+    "Ascon": ("ciphers.ascon", "Ascon", ()),
+    "Boomslang": ("ciphers.boomslang", "Boomslang", ()),
+    "Craft": ("ciphers.craft", "Craft", ()),
+    "GIFT-64": ("ciphers.gift", "Gift", (64,)),
+    "GIFT-128": ("ciphers.gift", "Gift", (128,)),
+    "iScream": ("ciphers.iscream", "iScream", ()),
+    "Kuznechik": ("ciphers.kuznechik", "Kuznechik", ()),
+    "LED": ("ciphers.led", "LED", ()),
+    "Mantis": ("ciphers.mantis", "Mantis", ()),
+    "Midori64": ("ciphers.midori", "Midori", ()),
+    "Pride": ("ciphers.pride", "Pride", ()),
+    "Prince": ("ciphers.prince", "Prince", ()),
+    "PRESENT": ("ciphers.present", "Present", ()),
+    "RECTANGLE": ("ciphers.rectangle", "Rectangle", ()),
+    "Scream": ("ciphers.scream", "Scream", ()),
+    "SKINNY-64": ("ciphers.skinny", "Skinny", (64,)),
+    "SKINNY-128": ("ciphers.skinny", "Skinny", (128,)),
+    "Streebog": ("ciphers.streebog", "Streebog", ()),
+    **{f"Keccak[{b}]": ("ciphers.keccak", "Keccak", (b,)) for b in [25, 50, 100, 200, 400, 800, 1600]},
+}
+
+
+class CipherRegistry(Mapping):
+    """
+    Dictionary of all available ciphers, which are built when they are first looked up and kept
+    afterwards
+    """
+    def __init__(self):
+        self._built = {}
+
+    def __getitem__(self, name):
+        if name not in _CIPHERS:
+            raise KeyError(name)
+        if name not in self._built:
+            module, cls, args = _CIPHERS[name]
+            self._built[name] = getattr(importlib.import_module(module), cls)(*args)
+        return self._built[name]
+
+    def __iter__(self):
+        return iter(_CIPHERS)
+
+    def __len__(self):
+        return len(_CIPHERS)
+
+
+# Dictionary of all available ciphers
+ciphers = CipherRegistry()
@@ -0,0 +1,185 @@
+# Compact forms of ciphers, linear layers, matrices, vectors and S-boxes, to send them to other
+# processes. Dense matrices and vectors (of any backend) are stored as the packed 64-bit words of
+# GF2Matrix and GF2Vector, structured matrices as their factors (identical blocks only once), S-boxes
+# as their look up tables and linear layers as their entries. Cached values which are cheap to
+# recompute or specific to Sage (ANFs of the S-boxes, dense forms and inverses of structured
+# matrices, the inverse cipher) are left out. Restoring a form only unpacks these words, instead of
+# running the constructor of the cipher.
+#
+# Forms are tagged with FORMAT_VERSION, and Cipher and LinearLayer objects are pickled as their
+# compact form. Big matrices can also be put in shared memory (see SharedArrays): the form then only
+# holds the name of the block, and the matrices restored on the numpy backend are read-only views of
+# the shared pages.
+
+import importlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ciphers.backend import backend_of, get_backend, is_sage_vector
+from ciphers.cipher import Cipher
+from ciphers.structured import BlockDiagonalMatrix, PermutationMatrix, ProductMatrix
+
+FORMAT_VERSION = 1  # to be increased if the forms change
+_SKIPPED = ("S_", "S_inverse_", "_inverse")  # attributes of ciphers which are not stored
+_attached = {}  # name -> SharedMemory, blocks opened by this process
+
+
+class SharedArray:
+    """
+    Reference to an array stored in a shared memory block of SharedArrays
+    """
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def array(self):
+        """
+        Returns the array as a read-only view of the shared memory block (opened on first use)
+        """
+        if self.name not in _attached:
+            try:
+                block = shared_memory.SharedMemory(name=self.name, track=False)
+            except TypeError:
+                # before Python 3.13 (the block is then registered again with the resource tracker
+                # shared by the processes of a pool, which is harmless)
+                block = shared_memory.SharedMemory(name=self.name)
+            _attached[self.name] = block
+        array = np.ndarray(self.shape, dtype=self.dtype, buffer=_attached[self.name].buf)
+        array.flags.writeable = False
+        return array
+
+
+class SharedArrays:
+    """
+    Shared memory blocks holding the arrays of at least min_bytes bytes of compact forms. The
+    blocks belong to the process which creates them, and are released by close (or at the end of
+    a with statement), once the processes using them are done.
+    """
+    def __init__(self, min_bytes=1 << 16):
+        self.min_bytes = min_bytes
+        self.blocks = []
+
+    def put(self, array):
+        """
+        Copies array into a new shared memory block, and returns its SharedArray
+        """
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        self.blocks.append(block)
+        return SharedArray(block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _words(words, shared):
+    if shared is not None and words.nbytes >= shared.min_bytes:
+        return shared.put(words)
+    return words.tobytes()
+
+
+def _array(data, shape):
+    if isinstance(data, SharedArray):
+        return data.array()
+    return np.frombuffer(data, dtype="<u8").reshape(shape)
+
+
+def _compact(value, shared, seen):
+    if isinstance(value, BlockDiagonalMatrix):
+        blocks = []
+        for block in value.blocks:
+            if id(block) not in seen:
+                seen[id(block)] = _compact(block, shared, seen)
+            blocks.append(seen[id(block)])
+        return ("block_diagonal", blocks)
+    if isinstance(value, PermutationMatrix):
+        return ("permutation", value.BACKEND, list(value.indices))
+    if isinstance(value, ProductMatrix):
+        return ("product", [_compact(factor, shared, seen) for factor in value.factors])
+    if hasattr(value, "_compact_args"):
+        # objects which give the function rebuilding them and its arguments (e.g. linear layers)
+        module, name, args = value._compact_args()
+        return ("call", module, name, [_compact(arg, shared, seen) for arg in args])
+    if hasattr(value, "input_size"):
+        return ("sbox", backend_of(value).name, [int(y) for y in value])
+    if hasattr(value, "nrows"):
+        M = get_backend("numpy").convert(value)
+        return ("matrix", backend_of(value).name, M.nrows(), M.ncols(), _words(M._words, shared))
+    if getattr(value, "BACKEND", None) == "numpy" or is_sage_vector(value):
+        v = get_backend("numpy").convert(value)
+        return ("vector", backend_of(value).name, len(v), _words(v._words, shared))
+    return ("value", value)
+
+
+def _restore(form, restored):
+    # identical forms (e.g. the blocks of a block diagonal matrix) are restored once
+    if id(form) not in restored:
+        restored[id(form)] = _restore_form(form, restored)
+    return restored[id(form)]
+
+
+def _restore_form(form, restored):
+    from ciphers.gf2 import GF2Matrix, GF2Vector, _nwords
+    kind = form[0]
+    if kind == "block_diagonal":
+        return BlockDiagonalMatrix([_restore(block, restored) for block in form[1]])
+    if kind == "permutation":
+        return PermutationMatrix(form[2], form[1])
+    if kind == "product":
+        return ProductMatrix([_restore(factor, restored) for factor in form[1]])
+    if kind == "sbox":
+        return get_backend(form[1]).sbox(form[2])
+    if kind == "matrix":
+        _, backend, nrows, ncols, data = form
+        M = GF2Matrix(nrows, ncols, _array(data, (nrows, _nwords(ncols))))
+        return get_backend(backend).convert(M)
+    if kind == "vector":
+        _, backend, n, data = form
+        return get_backend(backend).convert(GF2Vector(n, _array(data, (_nwords(n),))))
+    if kind == "call":
+        _, module, name, args = form
+        return getattr(importlib.import_module(module), name)(*[_restore(arg, restored) for arg in args])
+    if kind == "cipher":
+        _, module, name, attributes = form
+        cls = getattr(importlib.import_module(module), name)
+        cipher = cls.__new__(cls)
+        cipher.__dict__.update({attribute: _restore(value, restored) for attribute, value in attributes.items()})
+        return cipher
+    return form[1]
+
+
+def compact(value, shared=None):
+    """
+    Returns the compact form of a cipher, matrix, vector or S-box of any backend (other values are
+    kept as is). The arrays of at least shared.min_bytes bytes are put in shared memory if shared
+    (a SharedArrays) is given.
+    """
+    seen = {}
+    if isinstance(value, Cipher):
+        form = ("cipher", type(value).__module__, type(value).__qualname__,
+                {attribute: _compact(x, shared, seen) for attribute, x in vars(value).items()
+                 if attribute not in _SKIPPED})
+    else:
+        form = _compact(value, shared, seen)
+    return (FORMAT_VERSION, form)
+
+
+def restore(form):
+    """
+    Returns the value of a compact form
+    """
+    version, form = form
+    if version != FORMAT_VERSION:
+        raise ValueError(f"compact form of version {version}, expected version {FORMAT_VERSION}")
+    return _restore(form, {})
@@ -0,0 +1,270 @@
+# Structured matrices over GF(2) (block diagonal, bit permutation, product of factors) for the
+# linear layers of ciphers. They are applied to vectors without building the dense matrix, and are
+# inverted by inverting their factors. Inverses are computed on first use and are linked both ways,
+# so that a matrix and its inverse are never inverted twice. Any other matrix operation (slicing,
+# nonzero_positions, ...) is carried out on the dense matrix, which is also built on first use.
+
+import itertools
+from functools import reduce
+
+from ciphers.backend import backend_of, get_backend
+
+
+def permutation_indices(mtr):
+    """
+    Return the list ``p`` such that ``mtr * x`` is ``[x[p[0]], x[p[1]], ...]`` if the
+    given matrix is a permutation matrix, and ``None`` otherwise
+    """
+    if isinstance(mtr, StructuredMatrix):
+        return mtr.permutation()
+    if not mtr.is_square():
+        return None
+    p = [None] * mtr.nrows()
+    for r, c in mtr.nonzero_positions():
+        if p[r] is not None or mtr[r, c] != 1:
+            return None
+        p[r] = c
+    if None in p or len(set(p)) != len(p):
+        return None
+    return p
+
+
+def inverse_permutation(p):
+    inverse = [0] * len(p)
+    for i, j in enumerate(p):
+        inverse[j] = i
+    return inverse
+
+
+def permute_vector(state, p):
+    """
+    Returns the vector whose i-th coordinate is state[p[i]], for vectors of any backend
+    """
+    if hasattr(state, "permuted"):
+        return state.permuted(p)
+    from sage.modules.free_module_element import vector
+    return vector(state.base_ring(), [state[j] for j in p])
+
+
+def concatenate_vectors(state, pieces):
+    """
+    Concatenation of vectors of the same backend (and base ring) as state
+    """
+    if hasattr(state, "permuted"):
+        from ciphers.gf2 import concatenate
+        return concatenate(pieces)
+    from sage.modules.free_module_element import vector
+    return vector(state.base_ring(), list(itertools.chain(*pieces)))
+
+
+def _dense(mtr):
+    return mtr.dense() if isinstance(mtr, StructuredMatrix) else mtr
+
+
+class StructuredMatrix:
+    """
+    Base class of structured matrices. Subclasses implement _apply (product with a vector),
+    _invert, _build_dense, permutation and to_backend.
+    """
+    def __init__(self):
+        self._inverse_matrix = None
+        self._dense_matrix = None
+
+    def inverse(self):
+        if self._inverse_matrix is None:
+            self._inverse_matrix = self._invert()
+            self._inverse_matrix._inverse_matrix = self
+        return self._inverse_matrix
+
+    __invert__ = inverse
+
+    def dense(self):
+        """
+        Returns the matrix as a dense matrix of its backend
+        """
+        if self._dense_matrix is None:
+            self._dense_matrix = self._build_dense()
+        return self._dense_matrix
+
+    def __mul__(self, other):
+        if hasattr(other, "nrows"):
+            return ProductMatrix([self, other])
+        return self._apply(other)
+
+    def __rmul__(self, other):
+        if hasattr(other, "nrows"):
+            return ProductMatrix([other, self])
+        return NotImplemented
+
+    def is_square(self):
+        return self.nrows() == self.ncols()
+
+    def set_immutable(self):
+        pass
+
+    def __eq__(self, other):
+        return self.dense() == _dense(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        dense = self.dense()
+        dense.set_immutable()
+        return hash(dense)
+
+    def __getitem__(self, key):
+        return self.dense()[key]
+
+    def __getattr__(self, name):
+        # everything else is delegated to the dense matrix
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.dense(), name)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_dense_matrix"] = None  # rebuilt on demand
+        return state
+
+    def __repr__(self):
+        return repr(self.dense())
+
+
+class BlockDiagonalMatrix(StructuredMatrix):
+    """
+    Block diagonal matrix with the given square blocks. Identical blocks are only inverted once.
+    """
+    def __init__(self, blocks):
+        super().__init__()
+        self.blocks = list(blocks)
+        self._offsets = [0]
+        for block in self.blocks:
+            self._offsets.append(self._offsets[-1] + block.nrows())
+
+    @property
+    def BACKEND(self):
+        return backend_of(self.blocks[0]).name
+
+    def nrows(self):
+        return self._offsets[-1]
+
+    def ncols(self):
+        return self._offsets[-1]
+
+    def _apply(self, state):
+        return concatenate_vectors(state, [
+            block * state[start:end] for block, start, end in zip(self.blocks, self._offsets, self._offsets[1:])
+        ])
+
+    def _invert(self):
+        inverses = {}  # id of block -> inverse
+        for block in self.blocks:
+            if id(block) not in inverses:
+                inverses[id(block)] = block.inverse()
+        return BlockDiagonalMatrix([inverses[id(block)] for block in self.blocks])
+
+    def _build_dense(self):
+        return backend_of(self.blocks[0]).block_diagonal_matrix([_dense(block) for block in self.blocks])
+
+    def nonzero_positions(self):
+        return [(start + r, start + c) for block, start in zip(self.blocks, self._offsets)
+                for r, c in block.nonzero_positions()]
+
+    def permutation(self):
+        p = []
+        for block, start in zip(self.blocks, self._offsets):
+            q = permutation_indices(block)
+            if q is None:
+                return None
+            p += [start + j for j in q]
+        return p
+
+    def to_backend(self, backend):
+        backend = get_backend(backend)
+        converted = {}
+        for block in self.blocks:
+            if id(block) not in converted:
+                converted[id(block)] = backend.convert(block)
+        return BlockDiagonalMatrix([converted[id(block)] for block in self.blocks])
+
+
+class PermutationMatrix(StructuredMatrix):
+    """
+    Bit permutation matrix P such that (P x)[i] = x[permutation[i]]
+    """
+    def __init__(self, permutation, backend="sage"):
+        super().__init__()
+        self.indices = list(permutation)
+        self.BACKEND = get_backend(backend).name
+
+    def nrows(self):
+        return len(self.indices)
+
+    def ncols(self):
+        return len(self.indices)
+
+    def _apply(self, state):
+        return permute_vector(state, self.indices)
+
+    def _invert(self):
+        return PermutationMatrix(inverse_permutation(self.indices), self.BACKEND)
+
+    def _build_dense(self):
+        return get_backend(self.BACKEND).permutation_matrix(self.indices)
+
+    def nonzero_positions(self):
+        return [(i, j) for i, j in enumerate(self.indices)]
+
+    def permutation(self):
+        return list(self.indices)
+
+    def to_backend(self, backend):
+        return PermutationMatrix(self.indices, backend)
+
+
+class ProductMatrix(StructuredMatrix):
+    """
+    Product factors[0] * factors[1] * ... of square matrices, applied factor by factor
+    """
+    def __init__(self, factors):
+        super().__init__()
+        self.factors = []
+        for factor in factors:
+            # flatten nested products
+            self.factors += factor.factors if isinstance(factor, ProductMatrix) else [factor]
+
+    @property
+    def BACKEND(self):
+        return backend_of(self.factors[0]).name
+
+    def nrows(self):
+        return self.factors[0].nrows()
+
+    def ncols(self):
+        return self.factors[-1].ncols()
+
+    def _apply(self, state):
+        for factor in reversed(self.factors):
+            state = factor * state
+        return state
+
+    def _invert(self):
+        return ProductMatrix([factor.inverse() for factor in reversed(self.factors)])
+
+    def _build_dense(self):
+        return reduce(lambda A, B: A * B, [_dense(factor) for factor in self.factors])
+
+    def permutation(self):
+        # (F_0 F_1 x)[i] = (F_1 x)[p_0[i]] = x[p_1[p_0[i]]]
+        p = None
+        for factor in self.factors:
+            q = permutation_indices(factor)
+            if q is None:
+                return None
+            p = q if p is None else [q[j] for j in p]
+        return p
+
+    def to_backend(self, backend):
+        backend = get_backend(backend)
+        return ProductMatrix([backend.convert(factor) for factor in self.factors])
@@ -0,0 +1,157 @@
+# Look up tables of the superboxes of AES-like ciphers (S-box layer, MixColumns on one column,
+# S-box layer), for superboxes of up to 32 bits. The table is evaluated once with NumPy, a chunk
+# of inputs at a time, and stored on disk as an array of uint16 or uint32 (entry x is the output
+# for the input x, where the first bit of a state is its most significant bit, as in Sage). The
+# file is named after a fingerprint of the S-box and MixColumns matrix, so that it is only built
+# once per cipher, and it is opened as a read-only memory map: processes using the same table
+# share its pages, and SuperboxTable objects are pickled as their path.
+
+import hashlib
+import os
+import re
+
+import numpy as np
+
+from ciphers.backend import affine_key, backend_of, matrix_bits, vector_to_int
+
+FORMAT_VERSION = 1  # part of the fingerprints, to be increased if the file format changes
+_CHUNK = 1 << 22
+
+
+def _dtype(n):
+    if n > 32:
+        raise ValueError("superbox tables are limited to 32 bits")
+    return np.dtype("<u2") if n <= 16 else np.dtype("<u4")
+
+
+class _AffineMap:
+    """
+    Evaluates x -> M x + c on arrays of integers (big-endian states of n bits), with one table of
+    256 entries per byte of the input
+    """
+    def __init__(self, M, c, n):
+        bits = matrix_bits(M).astype(np.uint64)
+        weights = np.uint64(1) << (np.uint64(n - 1) - np.arange(n, dtype=np.uint64))
+        columns = (bits * weights[:, None]).sum(axis=0, dtype=np.uint64)  # image of input bit j
+        self.tables = []
+        for byte in range((n + 7) // 8):
+            table = np.zeros(256, dtype=np.uint64)
+            for k in range(8):
+                j = n - 1 - (8*byte + k)  # integer bit 8*byte + k is state bit j
+                if j >= 0:
+                    table[(np.arange(256) >> k) & 1 == 1] ^= columns[j]
+            self.tables.append(table)
+        self.c = np.uint64(0 if c is None else vector_to_int(c))
+
+    def __call__(self, x):
+        x = x.astype(np.uint64)
+        y = np.full(x.shape, self.c, dtype=np.uint64)
+        for byte, table in enumerate(self.tables):
+            y ^= table[(x >> np.uint64(8*byte)) & np.uint64(255)]
+        return y
+
+
+def _sbox_layer(lut, m, nbr_sboxes, x):
+    y = np.zeros(x.shape, dtype=np.uint64)
+    mask = np.uint64(2**m - 1)
+    for k in range(nbr_sboxes):
+        shift = np.uint64(m*(nbr_sboxes - 1 - k))  # S-box 0 holds the most significant bits
+        y |= lut[(x >> shift) & mask] << shift
+    return y
+
+
+def superbox_fingerprint(lut, mc_binary_matrix):
+    data = repr((FORMAT_VERSION, [int(y) for y in lut], matrix_bits(mc_binary_matrix).tolist()))
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+
+def build_superbox_table(lut, mc_binary_matrix, path):
+    """
+    Evaluates the superbox with S-box lut and MixColumns matrix mc_binary_matrix on all inputs,
+    and writes the table to path (through a temporary file, so that a partially written table is
+    never used)
+    """
+    m = (len(lut) - 1).bit_length()
+    n = mc_binary_matrix.nrows()
+    dtype = _dtype(n)
+    lut = np.array(lut, dtype=np.uint64)
+    mc = _AffineMap(mc_binary_matrix, None, n)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    table = np.lib.format.open_memmap(temporary, mode="w+", dtype=dtype, shape=(2**n,))
+    for start in range(0, 2**n, _CHUNK):
+        x = np.arange(start, min(start + _CHUNK, 2**n), dtype=np.uint64)
+        table[start:start + len(x)] = _sbox_layer(lut, m, n // m, mc(_sbox_layer(lut, m, n // m, x)))
+    table.flush()
+    del table
+    os.replace(temporary, path)
+
+
+class SuperboxTable:
+    """
+    Read-only look up table of a superbox, see the top of this file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lut = np.load(path, mmap_mode="r")
+        self.n = (len(self.lut) - 1).bit_length()
+
+    def __reduce__(self):
+        # other processes map the same file instead of receiving a copy of the table
+        return (SuperboxTable, (self.path,))
+
+    def __len__(self):
+        return len(self.lut)
+
+    def __call__(self, x):
+        return int(self.lut[x])
+
+    def __getitem__(self, x):
+        return self.lut[x]
+
+    def commutation_count(self, L_in, c_in, L_out, c_out):
+        """
+        Returns the number of inputs x such that F(L_in x + c_in) = L_out F(x) + c_out for the
+        superbox F, with matrices and vectors of any backend (2**n for a probability one pair)
+        """
+        input_map = _AffineMap(L_in, c_in, self.n)
+        output_map = _AffineMap(L_out, c_out, self.n)
+        count = 0
+        for start in range(0, len(self.lut), _CHUNK):
+            end = min(start + _CHUNK, len(self.lut))
+            x = np.arange(start, end, dtype=np.uint64)
+            y = self.lut[input_map(x)].astype(np.uint64)
+            count += int(np.count_nonzero(y == output_map(self.lut[start:end])))
+        return count
+
+    def verify_trail(self, trail, sbox_affine_equivalences):
+        """
+        Checks on all inputs that a trail core of the superbox (as returned by find_two_round_trails),
+        extended by the self equivalences of the S-boxes, holds with probability one
+        """
+        backend = backend_of(sbox_affine_equivalences[0].L_in)
+        m = sbox_affine_equivalences[0].L_in.nrows()
+        by_output = {affine_key(e.L_out, e.c_out): e for e in sbox_affine_equivalences}
+        by_input = {affine_key(e.L_in, e.c_in): e for e in sbox_affine_equivalences}
+        first, second = [], []
+        for k in range(self.n // m):
+            cell = slice(k*m, (k+1)*m)
+            # the core uses the output maps of the first S-box layer and the input maps of the second one
+            first.append(by_output[affine_key(trail.L_in[cell, cell], trail.c_in[cell])])
+            second.append(by_input[affine_key(trail.L_out[cell, cell], trail.c_out[cell])])
+        L_in = backend.block_diagonal_matrix([e.L_in for e in first])
+        c_in = backend.vector([b for e in first for b in e.c_in])
+        L_out = backend.block_diagonal_matrix([e.L_out for e in second])
+        c_out = backend.vector([b for e in second for b in e.c_out])
+        return self.commutation_count(L_in, c_in, L_out, c_out) == len(self.lut)
+
+
+def superbox_table(cipher, directory="."):
+    """
+    Returns the SuperboxTable of an AESLikeCipher, stored in directory and built if needed
+    """
+    path = os.path.join(directory, "superbox_{}_{}.npy".format(
+        re.sub(r"\W", "_", cipher.name), superbox_fingerprint(list(cipher.S), cipher.mc_binary_matrix)))
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        build_superbox_table(list(cipher.S), cipher.mc_binary_matrix, path)
+    return SuperboxTable(path)
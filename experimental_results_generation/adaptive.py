@@ -0,0 +1,278 @@
+#
+# Adaptive sampling of the events tracked by step_by_step_observation.
+#
+# commutative.out runs the same number of plaintexts for every key, chosen beforehand, even when
+# the rate of a key is known precisely much earlier. This driver encrypts the pairs (p0, A(p0))
+# with NumPy (all the keys of a round index at once, see step_by_step_diff), in batches whose size
+# doubles, and stops each key as soon as the Wilson interval of its success rate for the chosen
+# event is narrower than -precision bits, or lies entirely above or below the hypothesized
+# probability 2^-k of the round (computed by sample_sizes.py, or given with -log2_p). A key also
+# stops when it reaches 2^plaintexts_2 plaintexts, the budget of a non-adaptive run.
+# The interval of look j is computed at the level alpha * 6/(pi^2 j^2), so that the intervals of
+# all the looks hold together with probability 1 - alpha (confidence sequence by union bound).
+#
+# The results file has the format of the out_fixed_key_results output of commutative.out, each
+# group "a b c" being followed by the number of plaintexts of the key ("a b c n"), which
+# ingest.py reads. The random generator is NumPy's, so that a seed does not give the same keys and
+# plaintexts as commutative.out.
+#
+# When the events of a round index depend on few enough nibbles, enumeration.py computes their
+# exact probabilities instead (-exact_2): each group then holds the exact counts and the number of
+# pairs they are out of.
+#
+# Usage:
+#   python3 adaptive.py -pattern square -min 1 -max 6 -keys_2 10 -plaintexts_2 30 -constants weak
+#
+
+import argparse
+import math
+import os
+import random
+import time
+from statistics import NormalDist
+
+import numpy as np
+
+from ingest import COUNTERS, wilson_interval
+from midori import SB0, mc, midori_key_schedule_weak_round_csts, sbox_layer, shuffle_cells
+from patterns import pattern_sequence
+from sample_sizes import EVENTS, SHUFFLE_CELLS, success_probabilities
+
+RESULTS = "results"
+# largest number of states of the arrays of a batch
+MAX_ELEMENTS = 2**20
+REASONS = ["budget", "precision", "separated"]
+
+
+def _zero_diff(pattern, s0, s1, mask):
+    if mask is None:
+        return pattern.apply(s0) == s1
+    return (pattern.apply(s0) ^ s1) & np.uint64(mask) == 0
+
+
+def step_by_step_diff(patterns, round_keys, nb_rounds, p0, sbox=SB0, perm=SHUFFLE_CELLS["shift_rows"],
+                      whitening_key=0, masks=None):
+    """
+    Vectorized step_by_step_diff of commutative_property.cpp: p0 holds the plaintexts (one row per
+    key) and round_keys the round keys of each row. Returns the boolean arrays final_0_diff,
+    all_0_diff and all_end_round_0_diff of the pairs (p0, A(p0)) for the initial pattern A.
+    The pattern differences are compared at 4 nb_rounds - 2 steps ("input S", then "input SR",
+    "input MC", "input AC" and "input S" of each round, then "output S"); masks[t] restricts the
+    comparison of step t to some nibbles (see enumeration.py).
+    """
+    masks = masks or [None] * (4*nb_rounds - 2)
+    whitening_key = np.uint64(whitening_key)
+    s0 = p0 ^ whitening_key
+    s1 = patterns[0].apply(p0) ^ whitening_key
+    all_0_diff = _zero_diff(patterns[0], s0, s1, masks[0])
+    all_end_round_0_diff = np.ones(p0.shape, dtype=bool)
+    for i in range(1, nb_rounds):
+        s0, s1 = sbox_layer(s0, sbox), sbox_layer(s1, sbox)
+        all_0_diff &= _zero_diff(patterns[i], s0, s1, masks[4*i - 3])
+        s0, s1 = shuffle_cells(s0, perm), shuffle_cells(s1, perm)
+        all_0_diff &= _zero_diff(patterns[i], s0, s1, masks[4*i - 2])
+        s0, s1 = mc(s0), mc(s1)
+        all_0_diff &= _zero_diff(patterns[i], s0, s1, masks[4*i - 1])
+        s0 ^= round_keys[:, i:i + 1]
+        s1 ^= round_keys[:, i:i + 1]
+        end_round_0_diff = _zero_diff(patterns[i], s0, s1, masks[4*i])
+        all_0_diff &= end_round_0_diff
+        all_end_round_0_diff &= end_round_0_diff
+    s0 = sbox_layer(s0, sbox) ^ whitening_key
+    s1 = sbox_layer(s1, sbox) ^ whitening_key
+    final_0_diff = _zero_diff(patterns[nb_rounds], s0, s1, masks[4*nb_rounds - 3])
+    return final_0_diff, all_0_diff & final_0_diff, all_end_round_0_diff & final_0_diff
+
+
+def random_plaintexts(rng, pattern, shape):
+    """
+    Returns random plaintexts p0 with A(p0) != p0, as commutative.out
+    """
+    p0 = rng.integers(0, 2**64, size=shape, dtype=np.uint64)
+    fixed = pattern.apply(p0) == p0
+    while fixed.any():
+        p0[fixed] = rng.integers(0, 2**64, size=int(fixed.sum()), dtype=np.uint64)
+        fixed = pattern.apply(p0) == p0
+    return p0
+
+
+def adaptive_counts(patterns, nb_rounds, round_keys, max_trials, rng, event="all_0_diff", hypothesis=None,
+                    precision=1.0, alpha=0.01, initial_trials=1024, sbox=SB0, perm=SHUFFLE_CELLS["shift_rows"],
+                    whitening_key=0):
+    """
+    Samples the events of round index nb_rounds for each row of round_keys until its stopping rule
+    holds (see the top of this file). Returns the counts of the events (one row per key, in the
+    order of COUNTERS), the numbers of plaintexts and the indices in REASONS of the stopping rules.
+    """
+    nb_keys = len(round_keys)
+    e = COUNTERS.index(event)
+    counts = np.zeros((nb_keys, len(COUNTERS)), dtype=np.int64)
+    trials = np.zeros(nb_keys, dtype=np.int64)
+    reasons = np.zeros(nb_keys, dtype=np.int64)
+    active = np.arange(nb_keys)
+    batch = min(initial_trials, max_trials)
+    look = 0
+    while len(active):
+        look += 1
+        step = min(batch, MAX_ELEMENTS)
+        for start in range(0, len(active), max(1, MAX_ELEMENTS // step)):
+            keys = active[start:start + max(1, MAX_ELEMENTS // step)]
+            for done in range(0, batch, step):
+                p0 = random_plaintexts(rng, patterns[0], (len(keys), min(step, batch - done)))
+                events = step_by_step_diff(patterns, round_keys[keys], nb_rounds, p0, sbox, perm, whitening_key)
+                for i, occurred in enumerate(events):
+                    counts[keys, i] += occurred.sum(axis=1)
+        trials[active] += batch
+
+        z = NormalDist().inv_cdf(1 - 3*alpha / (math.pi**2 * look**2))
+        low, high = wilson_interval(counts[active, e], trials[active], z)
+        with np.errstate(divide="ignore"):
+            precise = (low > 0) & (np.log2(high) - np.log2(low) <= precision)
+        separated = (high < hypothesis) | (low > hypothesis) if hypothesis else np.zeros(len(active), dtype=bool)
+        budget = trials[active] >= max_trials
+        reasons[active] = np.select([precise, separated], [REASONS.index("precision"), REASONS.index("separated")],
+                                    REASONS.index("budget"))
+        active = active[~(precise | separated | budget)]
+        batch = min(trials[active[0]], max_trials - trials[active[0]]) if len(active) else 0
+    return counts, trials, reasons
+
+
+def results_filename(seed):
+    prefix = os.path.join(RESULTS, f"results_0x{seed:016x}")
+    version = 0
+    while os.path.exists(f"{prefix}_v{version}.txt"):
+        version += 1
+    return f"{prefix}_v{version}.txt"
+
+
+def _pattern_header(pattern):
+    def activity(lut):
+        return " ".join(f"{y:x}" for y in lut)
+
+    def weak_keys(keys):
+        return " ".join(f"{k:x}" for k in keys)
+    if all(item == pattern.activities[0] for item in pattern.activities):
+        return (f"pattern : {pattern.label}\tnibble {' '.join(f'{i:x}' for i in pattern.nibbles)} "
+                f"| activity {{{activity(pattern.activities[0])} }} | wk {{{weak_keys(pattern.weak_keys[0])} }}\n")
+    return f"pattern : {pattern.label}\n" + "".join(
+        f"\tnibble {i:x} | activity {{{activity(lut)} }} | wk {{{weak_keys(keys)} }}\n"
+        for i, lut, keys in zip(pattern.nibbles, pattern.activities, pattern.weak_keys))
+
+
+def header(filename, seed, sbox, perm, patterns, args, min_round, max_round):
+    """
+    Returns the header of a results file, as printed by Parameters::print (with the parameters of
+    the adaptive sampling)
+    """
+    return (f"filename : {filename}\n"
+            f"seed : 0x{seed:016x}\n"
+            f"sbox : {' '.join(map(str, sbox))} \n"
+            f"shuffle_cells : {' '.join(map(str, perm))} \n"
+            + "".join(_pattern_header(pattern) for pattern in patterns) +
+            f"constants : {args.constants}\n"
+            f"whitening_key : 0x{args.whitening:016x}\n"
+            f"min_round_index : {min_round}\n"
+            f"max_round_index : {max_round}\n"
+            f"msg_per_round : {' '.join(str(args.plaintexts_2) for _ in range(min_round, max_round + 1))} \n"
+            f"nb_keys : {2**args.keys_2}\n"
+            f"sampling : adaptive\n"
+            f"event : {args.event}\n"
+            f"precision : {args.precision}\n"
+            f"confidence : {args.confidence}\n"
+            f"exact_2 : {args.exact_2}\n")
+
+
+def _log2(p):
+    return math.log2(p) if p > 0 else -math.inf
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-pattern")
+    parser.add_argument("-pattern_a_b")
+    parser.add_argument("-round", type=int)
+    parser.add_argument("-min", type=int, default=1)
+    parser.add_argument("-max", type=int)
+    parser.add_argument("-keys_2", type=int, default=4)
+    parser.add_argument("-plaintexts_2", type=int, required=True, help="log2 of the largest number of plaintexts per key")
+    parser.add_argument("-initial_2", type=int, help="log2 of the first batch (default: about the inverse of the hypothesis)")
+    parser.add_argument("-constants", choices=["null", "weak", "standard"], default="null")
+    parser.add_argument("-whitening", type=lambda value: int(value, 16), default=0)
+    parser.add_argument("-seed", type=lambda value: int(value, 16), default=0)
+    parser.add_argument("-event", choices=COUNTERS, default="all_0_diff")
+    parser.add_argument("-log2_p", type=float, nargs="+",
+                        help="log2 of the hypothesized probabilities of the round indices (default: from sample_sizes.py)")
+    parser.add_argument("-precision", type=float, default=1.0, help="width in bits of the intervals at which keys stop")
+    parser.add_argument("-confidence", type=float, default=0.99)
+    parser.add_argument("-shuffle_cells", choices=sorted(SHUFFLE_CELLS), default="shift_rows")
+    parser.add_argument("-exact_2", type=int, default=20,
+                        help="log2 of the largest number of values per key enumerated by enumeration.py (-1: always sample)")
+    args = parser.parse_args()
+    from enumeration import exact_counts  # enumeration.py imports this file
+    if (args.pattern is None) == (args.pattern_a_b is None):
+        parser.error("exactly one of -pattern and -pattern_a_b is required")
+    min_round, max_round = (args.round, args.round) if args.round is not None else (args.min, args.max or args.min)
+    seed = args.seed or random.getrandbits(64) or 1
+    perm = SHUFFLE_CELLS[args.shuffle_cells]
+    patterns = pattern_sequence(max_round, args.pattern, args.pattern_a_b)
+
+    if args.log2_p is not None:
+        hypotheses = [2**args.log2_p[min(i, len(args.log2_p) - 1)] for i in range(max_round - min_round + 1)]
+    elif args.event in EVENTS:
+        probabilities = success_probabilities(patterns, max_round, SB0, perm, event=args.event)
+        hypotheses = probabilities[min_round - 1:]
+    else:
+        hypotheses = [None] * (max_round - min_round + 1)
+
+    rng = np.random.default_rng(seed)
+    nb_keys = 2**args.keys_2
+    k0 = patterns[0].random_weak_keys(rng, nb_keys)
+    k1 = patterns[1].random_weak_keys(rng, nb_keys)
+    round_keys = midori_key_schedule_weak_round_csts(k0, k1, args.constants)
+
+    os.makedirs(RESULTS, exist_ok=True)
+    filename = results_filename(seed)
+    with open(filename, "w") as file:
+        file.write(header(filename, seed, SB0, perm, patterns, args, min_round, max_round))
+    lines = [f"0x{int(a):016x} 0x{int(b):016x} | " for a, b in zip(k0, k1)]
+    max_trials = 2**args.plaintexts_2
+    for r, hypothesis in zip(range(min_round, max_round + 1), hypotheses):
+        if args.initial_2 is not None:
+            initial_trials = 2**args.initial_2
+        elif hypothesis:
+            initial_trials = 2**max(4, math.ceil(-math.log2(hypothesis)))
+        else:
+            initial_trials = 1024
+        time_start = time.time()
+        e = COUNTERS.index(args.event)
+        exact = None
+        if args.exact_2 >= 0:
+            exact = exact_counts(patterns, r, round_keys, 2**args.exact_2, SB0, perm, args.whitening)
+        if exact is not None:
+            counts, size = exact
+            for key in range(nb_keys):
+                lines[key] += " ".join(map(str, counts[key])) + f" {size} | "
+            rates = [count / size for count in counts[:, e]]
+            print(f"round {r}: {args.event} exact rate 2^{_log2(sum(rates) / nb_keys):.2f} on average over the keys "
+                  f"(from 2^{_log2(min(rates)):.2f} to 2^{_log2(max(rates)):.2f}) in {time.time() - time_start:.1f}s",
+                  flush=True)
+            continue
+        counts, trials, reasons = adaptive_counts(patterns, r, round_keys, max_trials, rng, args.event, hypothesis,
+                                                  args.precision, 1 - args.confidence, initial_trials, SB0, perm,
+                                                  args.whitening)
+        for key in range(nb_keys):
+            lines[key] += " ".join(map(str, counts[key])) + f" {trials[key]} | "
+        low, high = wilson_interval(counts[:, e].sum(), trials.sum())
+        rate = counts[:, e].sum() / trials.sum()
+        stops = ", ".join(f"{np.count_nonzero(reasons == i)} {reason}" for i, reason in enumerate(REASONS))
+        print(f"round {r}: {args.event} rate 2^{_log2(rate):.2f} [2^{_log2(low):.2f}, 2^{_log2(high):.2f}]"
+              + (f", hypothesis 2^{math.log2(hypothesis):.2f}" if hypothesis else "")
+              + f", 2^{math.log2(trials.sum()):.1f} plaintexts instead of 2^{math.log2(nb_keys * max_trials):.1f}"
+              f" ({stops}) in {time.time() - time_start:.1f}s", flush=True)
+    with open(filename, "a") as file:
+        file.write("".join(line + "\n" for line in lines))
+    print(f"results in {filename}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#
+# Exact probabilities of the events tracked by step_by_step_observation, by enumeration.
+#
+# Each comparison of step_by_step_diff (step t, nibble j) depends only on the input nibbles of the
+# dependency cone of nibble j at step t, and is trivially true when the pattern of step t is
+# inactive on j and the two states of the pair cannot differ there. The remaining comparisons are
+# grouped into components whose cones are disjoint: the events are the conjunctions of independent
+# events on the components, which are enumerated separately over the 16^n values of the n nibbles
+# of their cones (the other nibbles are set to 0), for all the keys at once.
+#
+# commutative.out rejects the plaintexts with A(p0) = p0, which is also a conjunction of events on
+# the components (the nibbles active in A are compared at step 0). Over the product of the
+# enumerated spaces, the number of pairs for which the event E holds is then
+#   prod_c N(E_c) - prod_c N(E_c and A(p0) = p0 on c)   out of   prod_c 16^n_c - prod_c N(A(p0) = p0 on c),
+# which are the counts returned by exact_counts. For a few rounds, the cones cover the whole state
+# and the enumeration is too large: exact_counts returns None and the caller samples instead.
+#
+
+import numpy as np
+
+from adaptive import MAX_ELEMENTS, step_by_step_diff
+from ingest import COUNTERS
+from midori import MIDORI_MC, SB0, SHIFT_ROWS
+
+
+def _mask(nibbles):
+    return sum(0xf << (4*(15 - i)) for i in nibbles)
+
+
+def dependency_components(patterns, nb_rounds, perm=SHIFT_ROWS, mc=MIDORI_MC):
+    """
+    Returns the components of the comparisons of step_by_step_diff for the round index nb_rounds,
+    as a list of (input nibbles, masks), masks[t] being the mask of the nibbles compared at step t
+    """
+    cones = [{i} for i in range(16)]  # input nibbles on which each nibble of the state depends
+    differ = set(patterns[0].nibbles)  # nibbles where the two states of a pair may differ
+    checks = []  # (step, nibble, cone)
+
+    def compare(step, pattern):
+        for j in range(16):
+            if j in differ or j in pattern.nibbles:
+                checks.append((step, j, cones[j]))
+
+    compare(0, patterns[0])
+    for i in range(1, nb_rounds):
+        compare(4*i - 3, patterns[i])
+        cones = [cones[perm[j]] for j in range(16)]
+        differ = {j for j in range(16) if perm[j] in differ}
+        compare(4*i - 2, patterns[i])
+        cones = [set().union(*(cones[4*(j//4) + k] for k in range(4) if mc[j % 4][k])) for j in range(16)]
+        differ = {j for j in range(16) if any(mc[j % 4][k] and 4*(j//4) + k in differ for k in range(4))}
+        compare(4*i - 1, patterns[i])
+        compare(4*i, patterns[i])
+    compare(4*nb_rounds - 3, patterns[nb_rounds])
+
+    components = []  # [cone, checks]
+    for step, j, cone in checks:
+        merged = [set(cone), [(step, j)]]
+        for component in [component for component in components if component[0] & cone]:
+            components.remove(component)
+            merged[0] |= component[0]
+            merged[1] += component[1]
+        components.append(merged)
+    return [(sorted(cone), [_mask(j for step_j, j in component_checks if step_j == step)
+                            for step in range(4*nb_rounds - 2)])
+            for cone, component_checks in components]
+
+
+def enumeration_size(components):
+    return sum(16**len(nibbles) for nibbles, _ in components)
+
+
+def _component_counts(patterns, nb_rounds, round_keys, nibbles, masks, sbox, perm, whitening_key):
+    # counts of the events, of the events with A(p0) = p0 on the component, and of A(p0) = p0
+    values = np.arange(16**len(nibbles), dtype=np.uint64)
+    p0 = np.zeros_like(values)
+    for k, i in enumerate(nibbles):
+        p0 |= ((values >> np.uint64(4*k)) & np.uint64(0xf)) << np.uint64(4*(15 - i))
+    fixed = (patterns[0].apply(p0) ^ p0) & np.uint64(_mask(nibbles)) == 0
+    counts = np.zeros((len(round_keys), len(COUNTERS)), dtype=object)
+    fixed_counts = np.zeros((len(round_keys), len(COUNTERS)), dtype=object)
+    step = min(len(p0), MAX_ELEMENTS)
+    keys_per_chunk = max(1, MAX_ELEMENTS // step)
+    for start in range(0, len(round_keys), keys_per_chunk):
+        keys = slice(start, start + keys_per_chunk)
+        for done in range(0, len(p0), step):
+            chunk = p0[done:done + step]
+            events = step_by_step_diff(patterns, round_keys[keys], nb_rounds,
+                                       np.broadcast_to(chunk, (len(round_keys[keys]), len(chunk))),
+                                       sbox, perm, whitening_key, masks)
+            for e, occurred in enumerate(events):
+                counts[keys, e] += occurred.sum(axis=1).astype(object)
+                fixed_counts[keys, e] += (occurred & fixed[done:done + step]).sum(axis=1).astype(object)
+    return counts, fixed_counts, int(fixed.sum())
+
+
+def exact_counts(patterns, nb_rounds, round_keys, max_size=2**20, sbox=SB0, perm=SHIFT_ROWS, whitening_key=0):
+    """
+    Returns the exact counts of the events (one row per key, in the order of COUNTERS, as Python
+    integers) and the number of pairs they are out of (see the top of this file), or None if more
+    than max_size values per key would be enumerated
+    """
+    components = dependency_components(patterns, nb_rounds, perm)
+    if enumeration_size(components) > max_size:
+        return None
+    counts = np.ones((len(round_keys), len(COUNTERS)), dtype=object)
+    fixed_counts = np.ones((len(round_keys), len(COUNTERS)), dtype=object)
+    size, fixed = 1, 1
+    for nibbles, masks in components:
+        component_counts, component_fixed_counts, component_fixed = _component_counts(
+            patterns, nb_rounds, round_keys, nibbles, masks, sbox, perm, whitening_key)
+        counts *= component_counts
+        fixed_counts *= component_fixed_counts
+        size *= 16**len(nibbles)
+        fixed *= component_fixed
+    return counts - fixed_counts, size - fixed
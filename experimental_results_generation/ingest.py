@@ -0,0 +1,219 @@
+#
+# Columnar store of the results files written by commutative.out, and aggregation of the counters.
+#
+# A results file holds the header printed by Parameters::print, then either one line per key
+# ("k0 k1 | a b c | a b c | ...", one group per round index, with out_fixed_key_results) or one
+# line per round index ("a b c | ", with out_overall_results), where a, b and c count the
+# plaintexts for which final_0_diff, all_0_diff and all_end_round_0_diff held (adaptive.py adds
+# the number of plaintexts of the key to each group, "a b c n").
+#
+# The store is a directory holding one .npz file per ingest (a "part") and index.json, which lists
+# the files already ingested: ingesting again only parses the new files. Files which do not hold
+# the results of all keys yet (runs in progress) are left for a later ingest. Each part holds one
+# row per run (file) and one row per (file, key, round index); for overall results, there is a
+# single row per round index, with key index -1, counting the plaintexts of all keys.
+#
+# Usage:
+#   python3 ingest.py results -store results/store                  # ingest new files
+#   python3 ingest.py -store results/store -by pattern constants round -counter all_0_diff
+#
+
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+
+COUNTERS = ["final_0_diff", "all_0_diff", "all_end_round_0_diff"]
+RUN_COLUMNS = ["file", "seed", "pattern", "constants", "whitening_key", "sbox", "shuffle_cells", "nb_keys"]
+ROW_COLUMNS = ["run", "key", "k0", "k1", "round", "trials"] + COUNTERS
+
+
+def parse_results_file(path):
+    """
+    Returns the run (a dict of header values) and the rows (a list of dicts) of a results file,
+    or None if the file does not hold the results of all keys yet
+    """
+    header = {}
+    labels = []
+    lines = []
+    with open(path) as file:
+        for line in file:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("\t"):
+                continue  # nibbles of patterns with different activities
+            if " : " in line:
+                name, value = line.split(" : ", 1)
+                if name == "pattern":
+                    labels.append(value.split("\t")[0].strip())
+                else:
+                    header[name] = value.strip()
+            else:
+                lines.append([group.split() for group in line.split("|") if group.strip()])
+    min_round = int(header["min_round_index"])
+    max_round = int(header["max_round_index"])
+    log2_plaintexts = [int(n) for n in header["msg_per_round"].split()]
+    nb_keys = int(header["nb_keys"])
+    # a single pattern, or alternating patterns (-pattern_a_b)
+    pattern = labels[0] if len(set(labels)) == 1 else f"{labels[0]}+{labels[1]}"
+    run = {"file": os.path.basename(path), "seed": int(header["seed"], 16), "pattern": pattern,
+           "constants": header["constants"], "whitening_key": int(header["whitening_key"], 16),
+           "sbox": header["sbox"], "shuffle_cells": header["shuffle_cells"], "nb_keys": nb_keys}
+
+    rows = []
+    per_key = lines and lines[0][0][0].startswith("0x")
+    if per_key:
+        if len(lines) < nb_keys:
+            return None
+        for key, (keys, *groups) in enumerate(lines):
+            for i, counters in enumerate(groups):
+                trials = int(counters[3]) if len(counters) > 3 else 2**log2_plaintexts[i]
+                rows.append({"key": key, "k0": int(keys[0], 16), "k1": int(keys[1], 16), "round": min_round + i,
+                             "trials": trials, **dict(zip(COUNTERS, map(int, counters)))})
+    else:
+        if len(lines) < max_round - min_round + 1:
+            return None
+        for i, (counters,) in enumerate(lines):
+            rows.append({"key": -1, "k0": 0, "k1": 0, "round": min_round + i,
+                         "trials": nb_keys * 2**log2_plaintexts[i], **dict(zip(COUNTERS, map(int, counters)))})
+    return run, rows
+
+
+class Store:
+    """
+    Columnar store of results files, see the top of this file
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index_path = os.path.join(path, "index.json")
+        self.index = {"files": {}, "parts": []}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as file:
+                self.index = json.load(file)
+
+    def ingest(self, directory):
+        """
+        Parses the results files of directory which are not in the store yet, and saves them as a
+        new part. Returns the number of files ingested.
+        """
+        runs = {column: [] for column in RUN_COLUMNS}
+        rows = {column: [] for column in ROW_COLUMNS}
+        files = []
+        for name in sorted(os.listdir(directory)):
+            if not (name.startswith("results_") and name.endswith(".txt")) or name in self.index["files"]:
+                continue
+            parsed = parse_results_file(os.path.join(directory, name))
+            if parsed is None:
+                continue
+            run, run_rows = parsed
+            for column in RUN_COLUMNS:
+                runs[column].append(run[column])
+            for row in run_rows:
+                row["run"] = len(files)
+                for column in ROW_COLUMNS:
+                    rows[column].append(row[column])
+            files.append(name)
+        if not files:
+            return 0
+        part = f"part_{len(self.index['parts']):05d}.npz"
+        np.savez(os.path.join(self.path, part),
+                 **{f"runs_{column}": np.array(values, dtype=np.uint64 if column in ("seed", "whitening_key") else None)
+                    for column, values in runs.items()},
+                 **{f"rows_{column}": np.array(values, dtype=np.int64 if column in ("run", "key", "round") else np.uint64)
+                    for column, values in rows.items()})
+        self.index["parts"].append(part)
+        for name in files:
+            self.index["files"][name] = part
+        temporary = self.index_path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.index, file)
+        os.replace(temporary, self.index_path)
+        return len(files)
+
+    def load(self):
+        """
+        Returns the runs and rows of all parts as two dicts of columns (NumPy arrays), with the run
+        column of the rows indexing the runs
+        """
+        runs = {column: [] for column in RUN_COLUMNS}
+        rows = {column: [] for column in ROW_COLUMNS}
+        offset = 0
+        for part in self.index["parts"]:
+            with np.load(os.path.join(self.path, part)) as data:
+                for column in RUN_COLUMNS:
+                    runs[column].append(data[f"runs_{column}"])
+                for column in ROW_COLUMNS:
+                    rows[column].append(data[f"rows_{column}"] + (offset if column == "run" else 0))
+                offset += len(data["runs_file"])
+        if offset == 0:
+            return None, None
+        return ({column: np.concatenate(values) for column, values in runs.items()},
+                {column: np.concatenate(values) for column, values in rows.items()})
+
+
+def wilson_interval(successes, trials, z=1.96):
+    """
+    Wilson score intervals of binomial proportions (vectorized)
+    """
+    successes = np.asarray(successes, dtype=float)
+    trials = np.asarray(trials, dtype=float)
+    p = successes / trials
+    denominator = 1 + z**2 / trials
+    center = (p + z**2 / (2*trials)) / denominator
+    half_width = z * np.sqrt(p*(1 - p)/trials + z**2/(4*trials**2)) / denominator
+    return center - half_width, center + half_width
+
+
+def aggregate(runs, rows, by=("pattern", "constants", "round"), counter="all_0_diff", z=1.96):
+    """
+    Sums the counter and the numbers of trials over the rows grouped by the given columns (of the
+    rows or of their runs), and returns the groups as a dict of columns with the success rates and
+    their Wilson intervals
+    """
+    columns = [rows[name] if name in rows else runs[name][rows["run"]] for name in by]
+    codes = []
+    uniques = []
+    for column in columns:
+        unique, code = np.unique(column, return_inverse=True)
+        uniques.append(unique)
+        codes.append(code)
+    group_ids, group = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+    group = group.reshape(-1)
+    successes = np.bincount(group, weights=rows[counter].astype(float))
+    trials = np.bincount(group, weights=rows["trials"].astype(float))
+    low, high = wilson_interval(successes, trials, z)
+    result = {name: unique[group_ids[:, i]] for i, (name, unique) in enumerate(zip(by, uniques))}
+    result.update(successes=successes.astype(np.int64), trials=trials.astype(np.int64), rate=successes / trials,
+                  low=low, high=high)
+    return result
+
+
+def _log2(p):
+    return f"{math.log2(p):.2f}" if p > 0 else "-inf"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", nargs="?", help="directory of results files to ingest")
+    parser.add_argument("-store", default=os.path.join("results", "store"))
+    parser.add_argument("-by", nargs="+", default=["pattern", "constants", "round"])
+    parser.add_argument("-counter", choices=COUNTERS, default="all_0_diff")
+    args = parser.parse_args()
+    store = Store(args.store)
+    if args.directory:
+        print(f"{store.ingest(args.directory)} new files ingested")
+    runs, rows = store.load()
+    if runs is None:
+        return
+    groups = aggregate(runs, rows, args.by, args.counter)
+    print(" ".join(args.by) + " successes trials log2(rate) [95% interval]")
+    for i in range(len(groups["rate"])):
+        print(" ".join(str(groups[name][i]) for name in args.by),
+              groups["successes"][i], groups["trials"][i],
+              f"{_log2(groups['rate'][i])} [{_log2(groups['low'][i])}, {_log2(groups['high'][i])}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#
+# Python counterpart of midori.hpp, used by the Python tools of this folder.
+# States follow the same convention: nibble 0 (top-left-hand) is the most significant one,
+# and nibble i is in column i / 4 and row i % 4.
+# The layers (sbox_layer, shuffle_cells, mc) are applied to NumPy arrays of uint64 states.
+#
+
+import functools
+import sys
+
+import numpy as np
+
+# Midori Sbox
+SB0 = [0xc, 0xa, 0xd, 0x3, 0xe, 0xb, 0xf, 0x7, 0x8, 0x9, 0x1, 0x5, 0x0, 0x2, 0x4, 0x6]
+# Midori cell permutation
+MIDORI_CELL_PERM = [0, 10, 5, 15, 14, 4, 11, 1, 9, 3, 12, 6, 7, 13, 2, 8]
+# AES ShiftRows
+SHIFT_ROWS = [0, 5, 10, 15, 4, 9, 14, 3, 8, 13, 2, 7, 12, 1, 6, 11]
+# Midori original round constants
+ROUND_CONSTANTS = [
+    0x0001010110110011, 0x0111100011000000, 0x1010010000110101, 0x0110001000010011, 0x0001000001001111,
+    0x1101000101110000, 0x0000001001100110, 0x0000101111001100, 0x1001010010000001, 0x0100000010111000,
+    0x0111000110010111, 0x0010001010001110, 0x0101000100110000, 0x1111100011001010, 0x1101111110010000]
+# Midori modified constants used in our paper
+WEAK_ROUND_CONSTANTS = [
+    0x0002020220220022, 0x0222200022000000, 0x2020020000220202, 0x0220002000020022, 0x0002000002002222,
+    0x2202000202220000, 0x0000002002200220, 0x0000202222002200, 0x2002020020000002, 0x0200000020222000,
+    0x0222000220020222, 0x0020002020002220, 0x0202000200220000, 0x2222200022002020, 0x2202222220020000]
+# Midori MixColumns, as the cell coefficients of one column: each output nibble is the XOR
+# of the three other input nibbles of its column
+MIDORI_MC = [[0, 1, 1, 1],
+             [1, 0, 1, 1],
+             [1, 1, 0, 1],
+             [1, 1, 1, 0]]
+
+
+def get_nibble(s, i):
+    return (s >> (4*(15 - i))) & 0xf
+
+
+def shift_to_nibble(value, i):
+    return value << (4*(15 - i))
+
+
+def mc_column(columns, mc=MIDORI_MC):
+    """
+    Applies the MixColumns matrix mc (binary cell coefficients) to an array of 16-bit columns
+    (nibble 0 of the column is the most significant one)
+    """
+    columns = np.asarray(columns)
+    nibbles = [(columns >> (4*(3 - j))) & 0xf for j in range(4)]
+    output = np.zeros_like(columns)
+    for i in range(4):
+        nibble = np.zeros_like(columns)
+        for j in range(4):
+            if mc[i][j]:
+                nibble ^= nibbles[j]
+        output |= nibble << (4*(3 - i))
+    return output
+
+
+def word_nibbles(w):
+    """
+    Returns the indices of the nibbles of word w of the uint16 view of uint64 states, from the
+    most significant one
+    """
+    if sys.byteorder == "little":
+        return list(range(12 - 4*w, 16 - 4*w))
+    return list(range(4*w, 4*w + 4))
+
+
+def nibble_tables(luts):
+    """
+    Returns the 4 x 2^16 tables applying luts[i] to nibble i, word by word (see apply_nibble_tables)
+    """
+    tables = np.zeros((4, 2**16), dtype=np.uint16)
+    v = np.arange(2**16)
+    for w in range(4):
+        for j, i in enumerate(word_nibbles(w)):
+            tables[w] |= (np.array(luts[i])[(v >> (4*(3 - j))) & 0xf] << (4*(3 - j))).astype(np.uint16)
+    return tables
+
+
+_WORD_OFFSETS = np.arange(0, 4 * 2**16, 2**16, dtype=np.uint32)
+
+
+def apply_nibble_tables(states, tables):
+    states = np.ascontiguousarray(states, dtype=np.uint64)
+    words = states.view(np.uint16).reshape(states.shape + (4,)) + _WORD_OFFSETS
+    return tables.ravel().take(words).view(np.uint64).reshape(states.shape)
+
+
+@functools.lru_cache(maxsize=None)
+def _sbox_tables(sbox):
+    return nibble_tables([sbox] * 16)
+
+
+def sbox_layer(states, sbox=SB0):
+    return apply_nibble_tables(states, _sbox_tables(tuple(sbox)))
+
+
+def shuffle_cells(states, perm):
+    """
+    New nibble i = old nibble perm[i], nibbles moving by the same offset being moved together
+    """
+    states = np.asarray(states, dtype=np.uint64)
+    output = np.zeros_like(states)
+    masks = {}
+    for i in range(16):
+        shift = 4*(perm[i] - i)  # left shift of the nibble
+        masks[shift] = masks.get(shift, 0) | (0xf << (4*(15 - perm[i])))
+    for shift, mask in masks.items():
+        moved = states & np.uint64(mask)
+        output |= moved << np.uint64(shift) if shift >= 0 else moved >> np.uint64(-shift)
+    return output
+
+
+def _rotate_columns(states, r):
+    # rotates each 16-bit column by 4r bits (nibble j of a column goes to nibble j - r)
+    r = 4*r
+    return ((states << np.uint64(r)) & np.uint64(0x10000 - (1 << r)) * np.uint64(0x0001000100010001) |
+            (states >> np.uint64(16 - r)) & np.uint64((1 << r) - 1) * np.uint64(0x0001000100010001))
+
+
+def mc(states):
+    """
+    Midori MixColumns of uint64 states: the XOR of the three rotations of each column
+    """
+    states = np.asarray(states, dtype=np.uint64)
+    return _rotate_columns(states, 1) ^ _rotate_columns(states, 2) ^ _rotate_columns(states, 3)
+
+
+def midori_key_schedule_weak_round_csts(k0, k1, constants="null"):
+    """
+    Returns the 15 round keys derived from k0 and k1, with the round constants "null", "weak"
+    or "standard" (k0 and k1 may be arrays, the round keys are then the last axis)
+    """
+    k0, k1 = np.asarray(k0, dtype=np.uint64), np.asarray(k1, dtype=np.uint64)
+    round_keys = np.stack([k0 if i % 2 == 0 else k1 for i in range(15)], axis=-1)
+    if constants == "weak":
+        round_keys = round_keys ^ np.array(WEAK_ROUND_CONSTANTS, dtype=np.uint64)
+    elif constants == "standard":
+        round_keys = round_keys ^ np.array(ROUND_CONSTANTS, dtype=np.uint64)
+    return round_keys
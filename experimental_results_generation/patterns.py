@@ -0,0 +1,94 @@
+#
+# Python counterpart of the activity patterns of commutative_property.hpp.
+#
+
+import numpy as np
+
+from midori import apply_nibble_tables, nibble_tables
+
+
+class ActivityPattern:
+    """
+    Activity pattern: activities[k] is the LUT of the affine map applied to nibble nibbles[k]
+    (all other nibbles are left unchanged). weak_keys[k] lists the key nibbles which commute with
+    activities[k], as in Activity_pattern.
+    """
+    def __init__(self, nibbles, activities, label):
+        self.label = label
+        self.nibbles = list(nibbles)
+        self.activities = [list(activity) for activity in activities]
+        self.weak_keys = [[j for j in range(len(activity)) if activity[j] ^ activity[0] == j]
+                          for activity in self.activities]
+
+    def activity(self, i):
+        """
+        Returns the LUT applied to nibble i (the identity for inactive nibbles)
+        """
+        if i in self.nibbles:
+            return self.activities[self.nibbles.index(i)]
+        return list(range(16))
+
+    def apply(self, states):
+        """
+        Applies the pattern to an array of uint64 states
+        """
+        if not hasattr(self, "_tables"):
+            self._tables = nibble_tables([self.activity(i) for i in range(16)])
+        return apply_nibble_tables(states, self._tables)
+
+    def random_weak_keys(self, rng, n):
+        """
+        Returns n random weak keys (uint64) of the pattern, as random_weak_key: the active nibbles
+        are drawn from their weak key spaces, the other ones uniformly
+        """
+        keys = np.zeros(n, dtype=np.uint64)
+        for i in range(16):
+            if i in self.nibbles:
+                weak_keys = np.array(self.weak_keys[self.nibbles.index(i)], dtype=np.uint64)
+                nibbles = weak_keys[rng.integers(len(weak_keys), size=n)]
+            else:
+                nibbles = rng.integers(16, size=n, dtype=np.uint64)
+            keys |= nibbles << np.uint64(4*(15 - i))
+        return keys
+
+    def __repr__(self):
+        return f"pattern {self.label} on nibbles {self.nibbles}"
+
+
+# affine function such that A o SB0 = SB0 o A
+affine_a = [15, 11, 13, 9, 14, 10, 12, 8, 7, 3, 5, 1, 6, 2, 4, 0]
+# affine function such that B o SB0(x) = SB0 o B(x) with proba 10/16
+affine_b = [4, 5, 6, 7, 0, 1, 2, 3, 10, 11, 8, 9, 14, 15, 12, 13]
+# affine function x -> x XOR 15
+diff_0xf = [15, 14, 13, 12, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1, 0]
+
+tic_proba_1 = [10, 6, 8, 4, 3, 15, 1, 13, 2, 14, 0, 12, 11, 7, 9, 5]
+tac_proba_1 = [5, 12, 7, 14, 9, 0, 11, 2, 13, 4, 15, 6, 1, 8, 3, 10]
+
+tic_proba_075 = [6, 15, 4, 13, 2, 11, 0, 9, 14, 7, 12, 5, 10, 3, 8, 1]
+tac_proba_075 = [1, 0, 3, 2, 8, 9, 10, 11, 6, 7, 4, 5, 15, 14, 13, 12]
+
+# Some useful activity patterns (same labels as in commutative_property.hpp)
+PATTERNS = {pattern.label: pattern for pattern in [
+    ActivityPattern([0, 2, 8, 10], [affine_a] * 4, "square"),
+    ActivityPattern([4, 6, 12, 14], [affine_a] * 4, "square2"),
+    ActivityPattern([4, 6, 12, 14], [affine_b] * 4, "square_b"),
+    ActivityPattern(range(16), [affine_a] * 16, "full_a"),
+    ActivityPattern(range(16), [affine_b] * 16, "full_b"),
+    ActivityPattern([0, 2, 8, 10], [affine_a, diff_0xf, affine_a, diff_0xf], "mixed"),
+    ActivityPattern([0, 2, 8, 10], [tic_proba_1] * 4, "tic_proba_1"),
+    ActivityPattern([0, 2, 8, 10], [tac_proba_1] * 4, "tac_proba_1"),
+    ActivityPattern([0, 2, 8, 10], [tic_proba_075] * 4, "tic_proba_075"),
+    ActivityPattern([0, 2, 8, 10], [tac_proba_075] * 4, "tac_proba_075"),
+]}
+
+
+def pattern_sequence(nb_rounds, pattern=None, pattern_a_b=None):
+    """
+    Returns the patterns of rounds 0 to nb_rounds, as built by commutative.out from -pattern
+    or -pattern_a_b (given as "a+b")
+    """
+    if pattern is not None:
+        return [PATTERNS[pattern]] * (nb_rounds + 1)
+    a, b = pattern_a_b.split("+")
+    return [PATTERNS[a] if i % 2 == 0 else PATTERNS[b] for i in range(nb_rounds + 1)]
@@ -0,0 +1,166 @@
+#
+# Derives the number of plaintexts per key needed by commutative.out from the exact probabilities
+# of the tracked events, instead of the hard-coded log2 counts of
+# Parameters::auto_fill_plaintexts_expected_success.
+#
+# A round of commutative.out (S-box layer, ShuffleCells, MixColumns, round key) maps the nibbles
+# routed to a column by ShuffleCells to that column only, so the probability that the pattern
+# differences of a round vanish is computed column by column, by enumerating the 2^16 values of
+# these nibbles. Round keys are weak keys, which do not change the pattern differences but do
+# change the values entering the next S-box layer: they are averaged over the weak key space of
+# the pattern. Successive rounds are not independent (a pair which went through a round has
+# non-uniform nibbles), so the distribution of each nibble given the success of the previous
+# rounds is carried from one round to the next. This is exact for the first round, and only
+# neglects the correlations between nibbles of different columns afterwards (round constants and
+# the plaintexts p0 with A(p0) = p0, which commutative.out skips, are not taken into account).
+#
+# Usage (one line of arguments of commutative.out per round):
+#   python3 sample_sizes.py -pattern square -min 1 -max 8 -expected_success 4
+#
+
+import argparse
+import math
+
+import numpy as np
+
+from midori import MIDORI_CELL_PERM, MIDORI_MC, SB0, SHIFT_ROWS, mc_column
+from patterns import pattern_sequence
+
+EVENTS = ["all_0_diff", "all_end_round_0_diff"]
+SHUFFLE_CELLS = {"shift_rows": SHIFT_ROWS, "midori": MIDORI_CELL_PERM}
+
+
+def _column(nibbles):
+    column = np.zeros_like(nibbles[0])
+    for j, nibble in enumerate(nibbles):
+        column |= nibble << (4*(3 - j))
+    return column
+
+
+def _key_average(distribution, pattern, i):
+    # distribution of v ^ k for a key nibble k uniform in the weak key space of nibble i
+    if i not in pattern.nibbles:
+        return np.full(16, 1/16)
+    weak_keys = pattern.weak_keys[pattern.nibbles.index(i)]
+    return np.mean([distribution[np.arange(16) ^ k] for k in weak_keys], axis=0)
+
+
+def round_probability(pattern_in, pattern_out, distributions=None, sbox=SB0, shuffle_cells=SHIFT_ROWS,
+                      mc=MIDORI_MC, event="all_0_diff"):
+    """
+    Returns the probability that a round maps a pair (s, A(s)) for the input pattern A to a pair
+    (t, A'(t)) for the output pattern A', where nibble i of s follows distributions[i] (uniform by
+    default), and the distributions of the nibbles of t given this event (after a weak round key
+    of A'). For the event "all_0_diff", the pattern difference (with respect to A') must also
+    vanish after the S-box layer and after ShuffleCells, as in step_by_step_diff.
+    """
+    if distributions is None:
+        distributions = [np.full(16, 1/16)] * 16
+    sbox = np.array(sbox)
+    x = np.arange(2**16, dtype=np.uint32)
+    probability = 1.0
+    output_distributions = [None] * 16
+    for c in range(4):
+        ok = np.ones(len(x), dtype=bool)
+        weights = np.ones(len(x))
+        t0, t1 = [], []
+        for j in range(4):
+            source = shuffle_cells[4*c + j]  # the nibble at position 4c + j comes from this nibble
+            x_j = (x >> (4*(3 - j))) & 0xf
+            weights *= distributions[source][x_j]
+            s0 = sbox[x_j]
+            s1 = sbox[np.array(pattern_in.activity(source))[x_j]]
+            if event == "all_0_diff":
+                ok &= s1 == np.array(pattern_out.activity(source))[s0]  # input SR
+                ok &= s1 == np.array(pattern_out.activity(4*c + j))[s0]  # input MC
+            t0.append(s0)
+            t1.append(s1)
+        t0 = mc_column(_column(t0), mc)
+        t1 = mc_column(_column(t1), mc)
+        expected = _column([np.array(pattern_out.activity(4*c + j))[(t0 >> (4*(3 - j))) & 0xf] for j in range(4)])
+        ok &= t1 == expected  # input AC (and input S, the round key being weak)
+        weights = np.where(ok, weights, 0.0)
+        probability *= weights.sum()
+        for j in range(4):
+            if weights.sum() == 0:
+                output_distributions[4*c + j] = np.full(16, 1/16)
+                continue
+            distribution = np.bincount((t0 >> (4*(3 - j))) & 0xf, weights=weights, minlength=16) / weights.sum()
+            output_distributions[4*c + j] = _key_average(distribution, pattern_out, 4*c + j)
+    return probability, output_distributions
+
+
+def final_probability(pattern_in, pattern_out, distributions=None, sbox=SB0):
+    """
+    Returns the probability that the final S-box layer maps the input pattern to the output one,
+    where nibble i follows distributions[i] (uniform by default)
+    """
+    probability = 1.0
+    for i in range(16):
+        a_in, a_out = pattern_in.activity(i), pattern_out.activity(i)
+        distribution = distributions[i] if distributions is not None else np.full(16, 1/16)
+        probability *= sum(distribution[x] for x in range(16) if sbox[a_in[x]] == a_out[sbox[x]])
+    return probability
+
+
+def success_probabilities(patterns, max_round_index, sbox=SB0, shuffle_cells=SHIFT_ROWS, mc=MIDORI_MC,
+                          event="all_0_diff"):
+    """
+    Returns the probabilities of the event for the round indices 1 to max_round_index, for the patterns
+    of rounds 0 to max_round_index (see patterns.pattern_sequence)
+    """
+    probabilities = []
+    rounds = 1.0  # probability of the full rounds 1 to r - 1
+    distributions = None
+    for r in range(1, max_round_index + 1):
+        if r > 1:
+            probability, distributions = round_probability(patterns[r - 2], patterns[r - 1], distributions, sbox,
+                                                           shuffle_cells, mc, event)
+            rounds *= probability
+        probabilities.append(rounds * final_probability(patterns[r - 1], patterns[r], distributions, sbox))
+    return probabilities
+
+
+def log2_plaintexts(probability, log2_expected_success):
+    """
+    Returns the log2 of the number of plaintexts such that the expected number of successes is at
+    least 2^log2_expected_success (None if the event is impossible)
+    """
+    if probability <= 0:
+        return None
+    return max(0, math.ceil(log2_expected_success - math.log2(probability)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-pattern")
+    parser.add_argument("-pattern_a_b")
+    parser.add_argument("-round", type=int)
+    parser.add_argument("-min", type=int, default=1)
+    parser.add_argument("-max", type=int)
+    parser.add_argument("-expected_success", type=int, default=0, help="log2 of the expected number of successes")
+    parser.add_argument("-event", choices=EVENTS, default="all_0_diff")
+    parser.add_argument("-shuffle_cells", choices=sorted(SHUFFLE_CELLS), default="shift_rows")
+    parser.add_argument("-sbox", help="LUT of the S-box, as 16 comma-separated integers (default: SB0)")
+    args = parser.parse_args()
+    if (args.pattern is None) == (args.pattern_a_b is None):
+        parser.error("exactly one of -pattern and -pattern_a_b is required")
+    min_round, max_round = (args.round, args.round) if args.round is not None else (args.min, args.max or args.min)
+    sbox = [int(y, 0) for y in args.sbox.split(",")] if args.sbox else SB0
+
+    patterns = pattern_sequence(max_round, args.pattern, args.pattern_a_b)
+    pattern_option = f"-pattern {args.pattern}" if args.pattern else f"-pattern_a_b {args.pattern_a_b}"
+    probabilities = success_probabilities(patterns, max_round, sbox, SHUFFLE_CELLS[args.shuffle_cells], MIDORI_MC,
+                                          args.event)
+    for r in range(min_round, max_round + 1):
+        probability = probabilities[r - 1]
+        log2_n = log2_plaintexts(probability, args.expected_success)
+        log2_p = f"{math.log2(probability):.2f}" if probability else "-inf"
+        if log2_n is None:
+            print(f"# round {r}: {args.event} is impossible")
+        else:
+            print(f"-round {r} {pattern_option} -plaintexts_2 {log2_n}  # log2 p = {log2_p}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#
+# Runs a sweep of commutative.out experiments on all cores of a machine.
+#
+# The sweep is a JSON file holding one specification or a list of them. In a specification,
+# "grid" maps options of commutative.out to lists of values (all combinations are run), and the
+# other entries are options shared by all runs, e.g.
+#   {"seed": 1, "grid": {"round": [1, 2, 3, 4, 5, 6], "pattern": ["square", "square_b"]},
+#    "constants": "weak", "keys_2": 13, "expected_success": 4}
+# Each run is launched for a single round index (-round), with either "plaintexts_2" or
+# "expected_success", in which case the number of plaintexts is derived by sample_sizes.py
+# (one run per round index also avoids the parsing of -plaintexts_2 for several rounds).
+#
+# Every run gets an explicit -seed, derived from the seed of the sweep and its options, so that
+# its results file results/results_<seed>_v<N>.txt is known and a sweep can be regenerated.
+# Runs are started largest first, each with a number of threads proportional to its share of the
+# total work, and never more threads than cores are used at the same time. parallel_keys is used
+# when there are enough keys to keep the threads of a run busy, parallel_plaintexts otherwise.
+# Failed runs are retried, and the manifest (results/manifest.json by default) records the
+# command, status and results files of every run. It is rewritten after each run, and runs that
+# already succeeded according to an existing manifest are not launched again.
+#
+# Usage:
+#   python3 scheduler.py sweep.json -cores 32
+#
+
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+from patterns import pattern_sequence
+from sample_sizes import log2_plaintexts, success_probabilities
+
+RESULTS = "results"
+# Options of commutative.out which take a value (-launch is always added)
+OPTIONS = ["round", "pattern", "pattern_a_b", "constants", "keys_2", "plaintexts_2", "whitening", "output",
+           "print_res", "print_diff"]
+DEFAULTS = {"output": "out_fixed_key_results", "print_res": "print_no_result"}
+
+
+def expand(specification):
+    """
+    Returns the runs (dicts of options) of a sweep specification, or of a list of them
+    """
+    if isinstance(specification, list):
+        return [run for item in specification for run in expand(item)]
+    shared = {**DEFAULTS, **{key: value for key, value in specification.items() if key != "grid"}}
+    grid = specification.get("grid", {})
+    runs = []
+    for values in itertools.product(*grid.values()):
+        run = {**shared, **dict(zip(grid.keys(), values))}
+        if "expected_success" in run and "plaintexts_2" not in run:
+            patterns = pattern_sequence(run["round"], run.get("pattern"), run.get("pattern_a_b"))
+            probability = success_probabilities(patterns, run["round"])[-1]
+            log2_n = log2_plaintexts(probability, run["expected_success"])
+            if log2_n is None:
+                print(f"skipping {run}: the event is impossible", file=sys.stderr)
+                continue
+            run["plaintexts_2"] = log2_n
+        runs.append(run)
+    return runs
+
+
+def run_seed(run):
+    """
+    Returns the (non-zero) 64-bit seed of a run, derived from the seed of the sweep and its options
+    """
+    digest = hashlib.sha256(json.dumps(run, sort_keys=True).encode()).digest()
+    return int.from_bytes(digest[:8], "big") or 1
+
+
+def run_work(run):
+    return run["round"] * 2**(run.get("keys_2", 0) + run["plaintexts_2"])
+
+
+def run_command(executable, run, seed, threads):
+    """
+    Returns the command line of a run, with its parallel mode chosen from its numbers of keys and plaintexts
+    """
+    mode = "parallel_keys" if 2**run.get("keys_2", 0) >= 4*threads else "parallel_plaintexts"
+    if threads == 1:
+        mode = "no_parallel"
+    command = [executable]
+    for option in OPTIONS:
+        if option in run:
+            command += [f"-{option}", str(run[option])]
+    command += ["-seed", f"{seed:x}", "-threads", str(threads), "-parallel", mode, "-launch"]
+    return command
+
+
+def results_files(seed):
+    prefix = f"results_0x{seed:016x}_v"
+    return {name for name in os.listdir(RESULTS) if name.startswith(prefix) and name.endswith(".txt")}
+
+
+class Manifest:
+    """
+    State of the runs of a sweep, saved as JSON after each change
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.entries = {entry["seed"]: entry for entry in json.load(file)["runs"]}
+
+    def succeeded(self, seed):
+        return self.entries.get(f"{seed:016x}", {}).get("status") == "done"
+
+    def update(self, seed, **entry):
+        self.entries.setdefault(f"{seed:016x}", {"seed": f"{seed:016x}", "attempts": 0, "results": []}).update(entry)
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump({"runs": list(self.entries.values())}, file, indent=1)
+        os.replace(temporary, self.path)
+
+    def entry(self, seed):
+        return self.entries[f"{seed:016x}"]
+
+
+def schedule(runs, executable, cores, retries, manifest):
+    total_work = sum(run_work(run) for run in runs) or 1
+    pending = []
+    for run in runs:
+        seed = run_seed(run)
+        if manifest.succeeded(seed):
+            continue
+        # threads proportional to the share of the work, at least one, at most the cores
+        threads = max(1, min(cores, math.ceil(cores * run_work(run) / total_work)))
+        pending.append((run_work(run), seed, threads, run))
+        manifest.update(seed, run=run, status="pending")
+    pending.sort(key=lambda item: -item[0])
+    running = {}  # process -> (seed, threads, run, results files before the launch, start time, log file)
+    done, failed, total = 0, 0, len(pending)
+    time_start = time.time()
+    os.makedirs(os.path.join(RESULTS, "logs"), exist_ok=True)
+
+    while pending or running:
+        free = cores - sum(threads for _, threads, *_ in running.values())
+        for item in list(pending):
+            _, seed, threads, run = item
+            if threads <= free:
+                pending.remove(item)
+                free -= threads
+                command = run_command(executable, run, seed, threads)
+                attempts = manifest.entry(seed)["attempts"] + 1
+                log = open(os.path.join(RESULTS, "logs", f"{seed:016x}_{attempts}.log"), "w")
+                before = results_files(seed)
+                process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+                running[process] = (seed, threads, run, before, time.time(), log)
+                manifest.update(seed, status="running", command=" ".join(command), attempts=attempts)
+        time.sleep(0.5)
+        for process in [process for process in running if process.poll() is not None]:
+            seed, threads, run, before, start, log = running.pop(process)
+            log.close()
+            files = sorted(results_files(seed) - before)
+            entry = manifest.entry(seed)
+            if process.returncode == 0:
+                done += 1
+                manifest.update(seed, status="done", results=entry["results"] + files,
+                                duration=time.time() - start, returncode=0)
+            elif entry["attempts"] <= retries:
+                pending.append((run_work(run), seed, threads, run))
+                pending.sort(key=lambda item: -item[0])
+                manifest.update(seed, status="retrying", failed_results=entry.get("failed_results", []) + files,
+                                returncode=process.returncode)
+            else:
+                failed += 1
+                manifest.update(seed, status="failed", failed_results=entry.get("failed_results", []) + files,
+                                returncode=process.returncode)
+            elapsed = time.time() - time_start
+            print(f"[{done + failed}/{total}] {entry['status']} {run} after {time.time() - start:.0f}s "
+                  f"({elapsed:.0f}s elapsed, {len(running)} running)", flush=True)
+    return done, failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sweep", help="JSON sweep specification")
+    parser.add_argument("-cores", type=int, default=os.cpu_count())
+    parser.add_argument("-retries", type=int, default=2)
+    parser.add_argument("-executable", default="./commutative.out")
+    parser.add_argument("-manifest", default=os.path.join(RESULTS, "manifest.json"))
+    args = parser.parse_args()
+    with open(args.sweep) as file:
+        runs = expand(json.load(file))
+    os.makedirs(RESULTS, exist_ok=True)
+    done, failed = schedule(runs, args.executable, args.cores, args.retries, Manifest(args.manifest))
+    print(f"{done} runs done, {failed} failed, manifest in {args.manifest}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from ciphers.gf2 import GF2Matrix, GF2Vector, block_diagonal_matrix
+
+rng = np.random.default_rng(0)
+SHAPES = [(1, 1), (3, 5), (8, 8), (64, 64), (70, 130), (130, 70)]
+
+
+def random_bits(nrows, ncols):
+    return rng.integers(0, 2, size=(nrows, ncols), dtype=np.uint8)
+
+
+def span_size(bits):
+    # number of distinct sums of subsets of the rows
+    return len({tuple(np.bitwise_xor.reduce(bits[list(rows)], axis=0)) if rows else (0,) * bits.shape[1]
+                for k in range(len(bits) + 1) for rows in itertools.combinations(range(len(bits)), k)})
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_bits_round_trip(shape):
+    bits = random_bits(*shape)
+    M = GF2Matrix.from_bits(bits)
+    assert M.dimensions() == shape
+    assert np.array_equal(M.bits(), bits)
+    assert np.array_equal(M.transpose().bits(), bits.T)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_multiply(shape):
+    A = random_bits(*shape)
+    B = random_bits(shape[1], 67)
+    v = random_bits(1, shape[1])[0]
+    assert np.array_equal((GF2Matrix.from_bits(A) * GF2Matrix.from_bits(B)).bits(), A.astype(int) @ B % 2)
+    assert np.array_equal((GF2Matrix.from_bits(A) * GF2Vector.from_bits(v)).bits(), A.astype(int) @ v % 2)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_add(shape):
+    A, B = random_bits(*shape), random_bits(*shape)
+    assert np.array_equal((GF2Matrix.from_bits(A) + GF2Matrix.from_bits(B)).bits(), A ^ B)
+
+
+@pytest.mark.parametrize("nrows, ncols", [(1, 1), (2, 3), (4, 4), (6, 5), (8, 8), (10, 3)])
+def test_rank(nrows, ncols):
+    for _ in range(20):
+        bits = random_bits(nrows, ncols)
+        assert 2**GF2Matrix.from_bits(bits).rank() == span_size(bits)
+
+
+def test_rank_all_3x3():
+    for entries in itertools.product([0, 1], repeat=9):
+        bits = np.array(entries, dtype=np.uint8).reshape(3, 3)
+        M = GF2Matrix.from_bits(bits)
+        assert 2**M.rank() == span_size(bits)
+        assert M.is_invertible() == (M.rank() == 3)
+
+
+@pytest.mark.parametrize("n", [1, 3, 8, 64, 65, 100])
+def test_inverse(n):
+    identity = GF2Matrix.identity(n)
+    for _ in range(5):
+        M = GF2Matrix.from_bits(random_bits(n, n))
+        if M.is_invertible():
+            assert M * M.inverse() == identity
+            assert M.inverse() * M == identity
+        else:
+            with pytest.raises(ZeroDivisionError):
+                M.inverse()
+
+
+def test_inverse_all_3x3():
+    identity = GF2Matrix.identity(3)
+    invertible = 0
+    for entries in itertools.product([0, 1], repeat=9):
+        M = GF2Matrix.from_bits(np.array(entries, dtype=np.uint8).reshape(3, 3))
+        if M.is_invertible():
+            invertible += 1
+            assert M * M.inverse() == identity
+    assert invertible == 168  # order of GL(3, 2)
+
+
+def test_block_diagonal():
+    blocks = [random_bits(3, 3), random_bits(2, 5), random_bits(70, 66)]
+    M = block_diagonal_matrix([GF2Matrix.from_bits(b) for b in blocks])
+    expected = np.zeros((75, 74), dtype=np.uint8)
+    expected[:3, :3] = blocks[0]
+    expected[3:5, 3:8] = blocks[1]
+    expected[5:, 8:] = blocks[2]
+    assert np.array_equal(M.bits(), expected)
+    assert M == block_diagonal_matrix(*[GF2Matrix.from_bits(b) for b in blocks])
+
+
+def test_slicing():
+    bits = random_bits(70, 130)
+    M = GF2Matrix.from_bits(bits)
+    assert np.array_equal(M[5:60, 60:129].bits(), bits[5:60, 60:129])
+    assert np.array_equal(M[3, 64:].bits(), bits[3:4, 64:])
+    assert np.array_equal(M[:, 7].bits(), bits[:, 7:8])
+    assert M[69, 129] == bits[69, 129] and M[0, 64] == bits[0, 64]
+    assert np.array_equal(M[10].bits(), bits[10])
+    assert np.array_equal(M.matrix_from_rows_and_columns([1, 5, 69], [0, 64, 129]).bits(),
+                          bits[np.ix_([1, 5, 69], [0, 64, 129])])
+    v = GF2Vector.from_bits(bits[0])
+    assert np.array_equal(v[60:70].bits(), bits[0, 60:70])
+    assert v[-1] == bits[0, -1]
+
+
+def test_vector_int():
+    for n in [1, 5, 64, 65]:
+        for x in [0, 1, 2**n - 1, int(rng.integers(0, 2**min(n, 63)))]:
+            v = GF2Vector.from_int(x, n)
+            assert v.to_int() == x
+            assert v.list() == [(x >> (n - 1 - i)) & 1 for i in range(n)]
+
+
+def test_hash():
+    bits = random_bits(70, 130)
+    A, B = GF2Matrix.from_bits(bits), GF2Matrix.from_bits(bits.copy())
+    assert A == B and hash(A) == hash(B)
+    assert len({A, B}) == 1
+    bits[69, 129] ^= 1
+    assert GF2Matrix.from_bits(bits) != A
+    # same bits, different shapes
+    assert GF2Matrix(2, 3) != GF2Matrix(3, 2)
+    v = GF2Vector.from_int(5, 70)
+    assert v == GF2Vector.from_int(5, 70) and hash(v) == hash(GF2Vector.from_int(5, 70))
+    assert len({v, GF2Vector.from_int(5, 70), GF2Vector.from_int(5, 71)}) == 2
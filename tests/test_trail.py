@@ -0,0 +1,55 @@
+import itertools
+import random
+
+import pytest
+
+from ciphers.gf2 import LUTSBox
+from trails.trail import Trail, _self_affine_equivalent_mappings
+
+
+def affine_permutations(n):
+    # look up tables of all affine permutations of GF(2)^n
+    for columns in itertools.product(range(1, 2**n), repeat=n):
+        linear = [0] * 2**n
+        for x in range(2**n):
+            for k in range(n):
+                if x >> k & 1:
+                    linear[x] ^= columns[k]
+        if len(set(linear)) == 2**n:
+            for a in range(2**n):
+                yield [y ^ a for y in linear]
+
+
+def self_equivalences_brute_force(lut):
+    n = (len(lut) - 1).bit_length()
+    affine = {tuple(A) for A in affine_permutations(n)}
+    inverse = [0] * len(lut)
+    for x, y in enumerate(lut):
+        inverse[y] = x
+    result = set()
+    for A in affine:
+        # B(S(A(x))) = S(x) for all x
+        B = [0] * len(lut)
+        for x in range(len(lut)):
+            B[lut[A[x]]] = lut[x]
+        if tuple(B) in affine:
+            result.add((A, tuple(B)))
+    return result
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_self_equivalences_3_bits(seed):
+    lut = random.Random(seed).sample(range(8), 8)
+    found = {(tuple(A), tuple(B)) for A, B in _self_affine_equivalent_mappings(lut)}
+    assert found == self_equivalences_brute_force(lut)
+
+
+def test_self_equivalences_identity():
+    assert len(_self_affine_equivalent_mappings(list(range(8)))) == 1344  # order of AGL(3, 2)
+
+
+@pytest.mark.parametrize("lut", [[0xC, 5, 6, 0xB, 9, 0, 0xA, 0xD, 3, 0xE, 0xF, 8, 4, 7, 1, 2],
+                                 [0xC, 0xA, 0xD, 3, 0xE, 0xB, 0xF, 7, 8, 9, 1, 5, 0, 2, 4, 6]])
+def test_over_sbox(lut):
+    # the equivalences are checked on all inputs by validate_results
+    assert len(Trail.over_sbox(LUTSBox(lut), validate_results=True, backend="numpy")) == 4
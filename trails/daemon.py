@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from ciphers.backend import get_backend, matrix_bits, vector_to_int
+from trails.search import _iter_trails, _superbox_layer
+from trails.trail import Trail
+
+
+# Local analysis server: a long-lived process which keeps the ciphers (see ciphers.registry), the
+# self equivalences of their S-boxes, their two-round trails and their superbox tables in memory,
+# and answers queries on a Unix socket, so that repeated queries do not pay for starting Sage and
+# building the ciphers again. Queries are answered by one thread per connection, and each value is
+# only computed once, by the first query which needs it.
+#
+# The protocol is one JSON object per line: {"query": name, ...parameters} is answered by
+# {"ok": true, "result": ...} or {"ok": false, "error": message}. Matrices are lists of rows and
+# vectors are integers, the first bit being the most significant one (as in Sage). The queries are
+# the methods query_<name> of AnalysisServer, e.g. {"query": "trails", "cipher": "GIFT-64"}.
+#
+# The server is started with `sage -python -m trails.daemon serve` (which needs Sage for the ciphers
+# of the registry), and queried with AnalysisClient or `python3 -m trails.daemon query trails
+# -params '{"cipher": "GIFT-64"}'`.
+
+SOCKET = os.path.join(os.path.expanduser("~"), ".commutative_trails.sock")
+
+
+def _rows(M):
+    return [vector_to_int(row) for row in matrix_bits(M)]
+
+
+def _gf2_matrix(rows, n):
+    from ciphers.gf2 import GF2Matrix
+    return GF2Matrix.from_bits(np.array([[(row >> (n - 1 - j)) & 1 for j in range(n)] for row in rows],
+                                        dtype=np.uint8).reshape(len(rows), n))
+
+
+def _trail_to_json(trail):
+    return {"L_in": _rows(trail.L_in), "c_in": vector_to_int(trail.c_in),
+            "L_out": _rows(trail.L_out), "c_out": vector_to_int(trail.c_out)}
+
+
+class _Cache:
+    """
+    Values computed once per key, the other threads asking for a key being computed wait for it
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}  # key -> Future
+
+    def get(self, key, compute):
+        with self._lock:
+            future = self._values.get(key)
+            owner = future is None
+            if owner:
+                future = self._values[key] = Future()
+        if owner:
+            try:
+                future.set_result(compute())
+            except Exception as error:
+                with self._lock:
+                    del self._values[key]  # computed again by the next query
+                future.set_exception(error)
+        return future.result()
+
+    def __len__(self):
+        return len(self._values)
+
+
+class AnalysisServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Server answering the queries of the top of this file on a Unix socket. ciphers maps the names of
+    the ciphers to ciphers (ciphers.registry by default), and superbox tables are stored in
+    directory.
+    """
+    daemon_threads = True
+
+    def __init__(self, path=SOCKET, ciphers=None, directory="."):
+        if ciphers is None:
+            from ciphers.registry import ciphers
+        self.ciphers = ciphers
+        self.directory = directory
+        self.caches = {name: _Cache() for name in ["ciphers", "sbox_affine_equivalences", "trails", "superbox_tables"]}
+        self.time_start = time.time()
+        self.queries = 0
+        self._queries_lock = threading.Lock()
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(path)  # left by a previous server
+            else:
+                raise RuntimeError(f"a server is already running on {path}")
+            finally:
+                probe.close()
+        super().__init__(path, _Handler)
+
+    def cipher(self, name, backend="sage"):
+        def build():
+            if name not in self.ciphers:
+                raise KeyError(f"unknown cipher {name!r}")
+            cipher = self.ciphers[name]
+            return cipher if backend == "sage" else cipher.to_backend(backend)
+        return self.caches["ciphers"].get((name, backend), build)
+
+    def sbox_affine_equivalences(self, lut, backend="numpy"):
+        lut = tuple(int(y) for y in lut)
+        return self.caches["sbox_affine_equivalences"].get(
+            (lut, backend), lambda: Trail.over_sbox(get_backend(backend).sbox(lut), backend=backend))
+
+    def two_round_trails(self, name, engine=None, backend="numpy"):
+        def search():
+            time_start = time.time()
+            cipher = self.cipher(name, backend)
+            linear_layer, permutation, nbr_sboxes = _superbox_layer(cipher)
+            E = self.sbox_affine_equivalences(list(cipher.S), backend)
+            trails = list(_iter_trails(E, linear_layer, permutation, nbr_sboxes, cipher.S.input_size(), engine, None))
+            return trails, time.time() - time_start
+        return self.caches["trails"].get((name, engine, backend), search)
+
+    def superbox_table(self, name):
+        return self.caches["superbox_tables"].get(name, lambda: self.cipher(name).superbox_table(self.directory))
+
+    def answer(self, request):
+        query = getattr(self, "query_" + str(request.pop("query", "")), None)
+        if query is None:
+            raise ValueError("unknown query")
+        with self._queries_lock:
+            self.queries += 1
+        return query(**request)
+
+    def query_ciphers(self):
+        return sorted(self.ciphers)
+
+    def query_stats(self):
+        return {"uptime": time.time() - self.time_start, "queries": self.queries,
+                **{name: len(cache) for name, cache in self.caches.items()}}
+
+    def query_self_equivalences(self, sbox):
+        """
+        Affine self equivalences of the S-box given by its look up table, see Trail.over_sbox
+        """
+        return [_trail_to_json(e) for e in self.sbox_affine_equivalences(sbox)]
+
+    def query_trails(self, cipher, engine=None, backend="numpy"):
+        """
+        Two-round trails of a cipher of the registry, see find_two_round_trails
+        """
+        trails, elapsed = self.two_round_trails(cipher, engine, backend)
+        return {"trails": [_trail_to_json(trail) for trail in trails], "search_time": elapsed}
+
+    def query_commutation_count(self, L_in, c_in, L_out, c_out, sbox=None, cipher=None):
+        """
+        Number of inputs x such that F(L_in x + c_in) = L_out F(x) + c_out, where F is the S-box
+        given by its look up table, or the superbox of an AES-like cipher of the registry
+        """
+        n = len(L_in)
+        if sbox is not None:
+            def affine(rows, c, x):
+                bits = (x[:, None] >> (n - 1 - np.arange(n))) & 1
+                return (bits @ _gf2_matrix(rows, n).bits().T % 2) @ (1 << np.arange(n - 1, -1, -1)) ^ c
+            lut = np.array(sbox)
+            return int(np.count_nonzero(lut[affine(L_in, c_in, np.arange(2**n))] == affine(L_out, c_out, lut)))
+        from ciphers.gf2 import GF2Vector
+        return self.superbox_table(cipher).commutation_count(
+            _gf2_matrix(L_in, n), GF2Vector.from_int(c_in, n), _gf2_matrix(L_out, n), GF2Vector.from_int(c_out, n))
+
+    def query_branch_number(self, matrix, degree=1, modulus=None):
+        """
+        Differential and linear branch numbers of a matrix over GF(2^degree) (given by the integer
+        representations of its entries, and modulus as an integer for a field other than Sage's default)
+        """
+        from sage.matrix.constructor import Matrix
+        from sage.rings.finite_rings.finite_field_constructor import GF
+        from sage.rings.polynomial.polynomial_ring_constructor import PolynomialRing
+
+        from ciphers.linearlayer import branch_number
+        if modulus is not None:
+            modulus = PolynomialRing(GF(2), name="a")([(modulus >> k) & 1 for k in range(degree + 1)])
+        F = GF(2**degree, name="x", modulus=modulus, repr="int") if degree > 1 else GF(2)
+        M = Matrix(F, [[F.fetch_int(x) if degree > 1 else F(x) for x in row] for row in matrix])
+        return {"differential": int(branch_number(M)), "linear": int(branch_number(M.transpose()))}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = {"ok": True, "result": self.server.answer(json.loads(line))}
+            except Exception as error:
+                response = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class AnalysisClient:
+    """
+    Connection to an AnalysisServer, e.g. AnalysisClient().query("trails", cipher="GIFT-64")
+    """
+    def __init__(self, path=SOCKET):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile("rwb")
+
+    def query(self, name, **parameters):
+        self.file.write(json.dumps({"query": name, **parameters}).encode() + b"\n")
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["serve", "query"])
+    parser.add_argument("query", nargs="?", help="name of the query (for query)")
+    parser.add_argument("-params", default="{}", help="parameters of the query, as a JSON object")
+    parser.add_argument("-socket", default=SOCKET)
+    parser.add_argument("-preload", nargs="*", default=[], help="ciphers whose trails are searched at startup")
+    parser.add_argument("-directory", default=".", help="directory of the superbox tables")
+    args = parser.parse_args()
+    if args.command == "query":
+        with AnalysisClient(args.socket) as client:
+            print(json.dumps(client.query(args.query, **json.loads(args.params)), indent=1))
+        return
+    with AnalysisServer(args.socket, directory=args.directory) as server:
+        for name in args.preload:
+            server.two_round_trails(name)
+        print(f"listening on {args.socket}", file=sys.stderr, flush=True)
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import random
+
+import numpy as np
+
+from ciphers.backend import matrix_bits
+
+
+# Round keys and round constants compatible with commutative trails. Between the two S-box layers
+# of a trail, the state x is mapped to L_out x + c_out (see Trail): the addition of a round key k
+# and of a round constant c commutes with this map iff (L_out + I)(P k + Q c) = 0, where P and Q
+# inject the key and the constant into the state (the identity if they cover the whole state). For
+# a fixed constant, the weak keys are thus an affine subspace (possibly empty), and the constants
+# which are compatible with every weak key of the zero constant are a linear subspace. They are
+# obtained by solving these linear systems over GF(2), instead of enumerating the keys S-box by
+# S-box as Activity_pattern does (see experimental_results_generation/). Vectors are Python integers,
+# the first bit of the state (or key) being the most significant bit, as in Sage.
+
+
+class AffineSubspace:
+    """
+    The affine subspace offset + span(basis) of GF(2)^n, with vectors as integers
+    """
+    def __init__(self, n, offset, basis):
+        self.n = n
+        self.offset = offset
+        self.basis = basis  # (free bit, vector): each vector has a distinct free bit, unset in the others
+
+    @staticmethod
+    def empty(n):
+        return AffineSubspace(n, None, [])
+
+    def is_empty(self):
+        return self.offset is None
+
+    def dimension(self):
+        return -1 if self.is_empty() else len(self.basis)
+
+    def vectors(self):
+        return [vector for _, vector in self.basis]
+
+    def sample(self, rng=None):
+        """
+        Returns a uniformly random vector of the subspace, using rng (a random.Random instance)
+        """
+        if self.is_empty():
+            raise ValueError("the subspace is empty")
+        rng = rng or random
+        coefficients = rng.getrandbits(len(self.basis)) if self.basis else 0
+        x = self.offset
+        for k, (_, vector) in enumerate(self.basis):
+            if coefficients >> k & 1:
+                x ^= vector
+        return x
+
+    def __contains__(self, x):
+        if self.is_empty():
+            return False
+        x ^= self.offset
+        for free_bit, vector in self.basis:
+            if x >> free_bit & 1:
+                x ^= vector
+        return x == 0
+
+    def __repr__(self):
+        if self.is_empty():
+            return f"empty subspace of GF(2)^{self.n}"
+        return f"affine subspace of dimension {self.dimension()} of GF(2)^{self.n}, offset {self.offset:#x}"
+
+
+def _rows(bits):
+    return [int("".join(map(str, row)), 2) if len(row) else 0 for row in bits]
+
+
+def solve(A, b, ncols):
+    """
+    Returns the solutions x of A x = b as an AffineSubspace, for a matrix A given by its rows (as
+    integers of ncols bits) and a vector b (as an integer, first row first)
+    """
+    pivots = {}  # leading bit -> reduced row, each row being followed by its bit of b
+    for r, row in enumerate(A):
+        row = row << 1 | (b >> (len(A) - 1 - r)) & 1
+        while row > 1:
+            lead = row.bit_length() - 1
+            if lead not in pivots:
+                pivots[lead] = row
+                break
+            row ^= pivots[lead]
+        if row == 1:
+            return AffineSubspace.empty(ncols)
+    # reduced row echelon form: each pivot row has no other pivot bit
+    leads = sorted(pivots)
+    for k, lead in enumerate(leads):
+        for other in leads[k + 1:]:
+            if pivots[other] >> lead & 1:
+                pivots[other] ^= pivots[lead]
+    offset = sum((row & 1) << (lead - 1) for lead, row in pivots.items())
+    basis = []
+    for free in range(1, ncols + 1):
+        if free not in pivots:
+            vector = 1 << (free - 1)
+            for lead, row in pivots.items():
+                if row >> free & 1:
+                    vector |= 1 << (lead - 1)
+            basis.append((free - 1, vector))
+    return AffineSubspace(ncols, offset, basis)
+
+
+def _matrix_bits(M):
+    return M if isinstance(M, np.ndarray) else matrix_bits(M)
+
+
+def _product(A, B):
+    # product of matrices of bits over GF(2) (with floating point products, which are exact for these sizes)
+    return np.fmod(A.astype(np.float64) @ B.astype(np.float64), 2).astype(np.uint8)
+
+
+def commuting_additions(M, injection=None, constant=0):
+    """
+    Returns the vectors v such that the addition of P v + constant commutes with the linear map M
+    (a matrix of any backend, or of bits), i.e. such that (M + I)(P v + constant) = 0, where P is
+    the injection matrix (the identity by default)
+    """
+    M_plus_I = _matrix_bits(M) ^ np.eye(len(_matrix_bits(M)), dtype=np.uint8)
+    n = len(M_plus_I)
+    A = M_plus_I if injection is None else _product(M_plus_I, _matrix_bits(injection))
+    c = np.array([int(bit) for bit in format(constant, f"0{n}b")], dtype=np.uint8)
+    b = _rows(_product(M_plus_I, c[:, None]).T)[0]
+    return solve(_rows(A), b, A.shape[1])
+
+
+def weak_keys(trail, constant=0, key_injection=None):
+    """
+    Returns the affine subspace of the round keys whose addition with the round constant commutes
+    with the output map of trail
+    """
+    return commuting_additions(trail.L_out, key_injection, constant)
+
+
+def weak_constants(trail, constant_injection=None):
+    """
+    Returns the linear subspace of the round constants whose addition commutes with the output map
+    of trail (for all the keys of weak_keys(trail))
+    """
+    return commuting_additions(trail.L_out, constant_injection)
+
+
+def trail_key_spaces(trails, constant=0, key_injection=None, constant_injection=None):
+    """
+    Returns the pairs (weak_keys(trail, constant, key_injection), weak_constants(trail,
+    constant_injection)) of all trails, solving the systems once per distinct output linear map
+    """
+    spaces = {}
+    result = []
+    for trail in trails:
+        M = matrix_bits(trail.L_out)
+        key = M.tobytes()
+        if key not in spaces:
+            spaces[key] = (commuting_additions(M, key_injection, constant),
+                           commuting_additions(M, constant_injection))
+        result.append(spaces[key])
+    return result
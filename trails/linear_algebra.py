@@ -0,0 +1,159 @@
+import itertools
+from copy import copy
+
+from sage.matrix.constructor import Matrix
+from sage.matrix.special import block_diagonal_matrix
+from sage.modules.free_module import VectorSpace
+from sage.modules.free_module_element import vector
+from sage.rings.finite_rings.finite_field_constructor import GF
+
+from trails.trail import Trail
+
+
+class LinearSpan:
+    """
+    The GF(2)-span of a set of m x m matrices (e.g. the linear parts of the S-box self equivalences),
+    together with the coordinates of each of the matrices in the echelonized basis of the span
+    """
+    def __init__(self, matrices, m):
+        self.matrices = []
+        self._index = {}  # matrix -> position in self.matrices
+        for M in matrices:
+            M = copy(M)
+            M.set_immutable()
+            if M not in self._index:
+                self._index[M] = len(self.matrices)
+                self.matrices.append(M)
+        self.space = VectorSpace(GF(2), m*m).subspace([vector(GF(2), M.list()) for M in self.matrices])
+        self.basis = [Matrix(GF(2), m, m, b.list()) for b in self.space.basis()]
+        self.coordinates = [self.space.coordinate_vector(vector(GF(2), M.list())) for M in self.matrices]
+
+    def dimension(self):
+        return len(self.basis)
+
+    def index(self, M):
+        """
+        Returns the position of M in self.matrices
+        """
+        M = copy(M)
+        M.set_immutable()
+        return self._index[M]
+
+
+class LinearConstraints:
+    """
+    Linear constraints z * K_c = v_c on the coordinates z of a solution with respect to a kernel basis K.
+    Columns K_c are Python integers (bit r is K[r, c]) and are kept in echelon form, which allows to
+    add constraints one by one and to undo them when backtracking.
+    """
+    def __init__(self):
+        self.pivots = {}  # leading bit -> (column, value)
+
+    def add(self, column, value):
+        """
+        Adds the constraint z * column = value. Returns the leading bit of the new pivot (None if the
+        constraint was implied by the previous ones) or False if it is inconsistent with them.
+        """
+        while column:
+            lead = column.bit_length() - 1
+            if lead not in self.pivots:
+                self.pivots[lead] = (column, value)
+                return lead
+            pivot_column, pivot_value = self.pivots[lead]
+            column ^= pivot_column
+            value ^= pivot_value
+        return None if value == 0 else False
+
+    def add_all(self, columns, values):
+        """
+        Adds several constraints at once. Returns the leading bits of the added pivots, or None if
+        the constraints are inconsistent (in which case nothing is added).
+        """
+        added = []
+        for column, value in zip(columns, values):
+            lead = self.add(column, int(value))
+            if lead is False:
+                self.remove(added)
+                return None
+            if lead is not None:
+                added.append(lead)
+        return added
+
+    def remove(self, leads):
+        for lead in leads:
+            del self.pivots[lead]
+
+
+def solve_over_linear_layer(sbox_affine_equivalences, L, nbr_sboxes, m):
+    """
+    Same result as connect_over_linear_layer, but instead of enumerating combinations of
+    S-box self equivalences, the equation L Diag(B_1,...,B_{n/m}) = Diag(A'_1,...,A'_{n/m}) L is
+    solved as a linear system over GF(2), where each B_j (resp. A'_i) ranges over the span of the
+    output (resp. input) linear parts of the self equivalences. Combinations of self equivalences
+    are then only enumerated inside the solution space, block after block, so that the work
+    depends on the dimension of the solution space rather than on |E|^nbr_sboxes.
+    Works for any number of S-boxes.
+    """
+    E = sbox_affine_equivalences
+    span_B = LinearSpan([e.L_out for e in E], m)
+    span_A = LinearSpan([e.L_in for e in E], m)
+    d_B, d_A = span_B.dimension(), span_A.dimension()
+    d = d_B + d_A  # Number of unknowns per S-box: B_j = sum_k x_{j,k} basis_B[k], A'_j = sum_k y_{j,k} basis_A[k]
+
+    # Only the blocks L_ij which are non-zero give equations L_ij B_j + A'_i L_ij = 0
+    coupled_blocks = sorted({(r // m, c // m) for r, c in L.nonzero_positions()})
+    entries = {}
+    for row, (i, j) in enumerate(coupled_blocks):
+        L_ij = L[i*m:(i+1)*m, j*m:(j+1)*m]
+        for k, basis_matrix in enumerate(span_B.basis):
+            for r, c in (L_ij * basis_matrix).nonzero_positions():
+                entries[(row*m*m + r*m + c, j*d + k)] = 1
+        for k, basis_matrix in enumerate(span_A.basis):
+            for r, c in (basis_matrix * L_ij).nonzero_positions():
+                entries[(row*m*m + r*m + c, i*d + d_B + k)] = 1
+    equations = Matrix(GF(2), len(coupled_blocks)*m*m, nbr_sboxes*d, entries, sparse=False)
+    K = equations.right_kernel_matrix()
+    columns = [sum(int(b) << r for r, b in enumerate(col)) for col in K.columns()]
+
+    # Enumerate the solutions whose blocks are all actual self equivalences, block after block
+    constraints = LinearConstraints()
+    linear_solutions = []
+    choice = []
+
+    def enumerate_blocks(j):
+        if j == nbr_sboxes:
+            linear_solutions.append(list(choice))
+            return
+        for b, coordinates_b in enumerate(span_B.coordinates):
+            added_b = constraints.add_all(columns[j*d:j*d + d_B], coordinates_b)
+            if added_b is None:
+                continue
+            for a, coordinates_a in enumerate(span_A.coordinates):
+                added_a = constraints.add_all(columns[j*d + d_B:(j+1)*d], coordinates_a)
+                if added_a is None:
+                    continue
+                choice.append((b, a))
+                enumerate_blocks(j + 1)
+                choice.pop()
+                constraints.remove(added_a)
+            constraints.remove(added_b)
+
+    enumerate_blocks(0)
+
+    # Add the constants: choose the input constants freely, the output constants are then given by L
+    equivalences_by_B = [[] for _ in span_B.matrices]
+    equivalences_by_A = {}
+    for j, e in enumerate(E):
+        equivalences_by_B[span_B.index(e.L_out)].append(j)
+        equivalences_by_A[(span_A.index(e.L_in), tuple(e.c_in))] = j
+    trails = []
+    for solution in linear_solutions:
+        for j1s in itertools.product(*[equivalences_by_B[b] for b, _ in solution]):
+            c_in = vector(GF(2), itertools.chain(*[E[j1].c_out for j1 in j1s]))
+            c_out = L * c_in
+            if all((a, tuple(c_out[i*m:(i+1)*m])) in equivalences_by_A for i, (_, a) in enumerate(solution)):
+                trails.append(Trail(
+                    block_diagonal_matrix([span_B.matrices[b] for b, _ in solution]), c_in,
+                    block_diagonal_matrix([span_A.matrices[a] for _, a in solution]), c_out,
+                ))
+    return trails
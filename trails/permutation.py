@@ -0,0 +1,77 @@
+import itertools
+
+from ciphers.backend import backend_of
+from trails.trail import Trail
+
+
+def connect_over_permutation_layer(sbox_affine_equivalences, permutation, nbr_sboxes, m):
+    """
+    Returns the list of all trails of iter_connect_over_permutation_layer
+    """
+    return list(iter_connect_over_permutation_layer(sbox_affine_equivalences, permutation, nbr_sboxes, m))
+
+
+def iter_connect_over_permutation_layer(sbox_affine_equivalences, permutation, nbr_sboxes, m):
+    """
+    Same result as connect_over_linear_layer, for a linear layer L which is a bit permutation, given
+    as the list permutation such that (L x)[r] = x[permutation[r]]. In that case
+    Diag(A'_1,...,A'_{n/m}) = L Diag(B_1,...,B_{n/m}) L^-1 is a relabeling of the rows and columns of
+    Diag(B_1,...,B_{n/m}), so instead of checking matrix equations, each A'_t (and its constant) is
+    read off the B_j of the S-boxes j whose bits are sent to S-box t.
+    Trails are yielded as soon as they are found.
+    """
+    E = sbox_affine_equivalences
+    if not E:
+        return
+    backend = backend_of(E[0].L_in)
+    n = nbr_sboxes * m
+    entries_out = [[[int(x) for x in row] for row in e.L_out.rows()] for e in E]
+    input_maps = {}  # (entries of L_in, c_in) -> indices of the equivalences with this input map
+    for j2, e in enumerate(E):
+        key = (tuple(int(x) for x in e.L_in.list()), tuple(int(x) for x in e.c_in))
+        input_maps.setdefault(key, []).append(j2)
+
+    # Entry (u, v) of Diag(B_1,...,B_{n/m}) is sent to entry (p^-1(u), p^-1(v)), so the relabeled
+    # matrix is only block diagonal if B_j[u, v] = 0 whenever p^-1(u) and p^-1(v) lie in different S-boxes
+    inverse = [0] * n
+    for r, u in enumerate(permutation):
+        inverse[u] = r
+    candidates = []
+    for j in range(nbr_sboxes):
+        forbidden = [(a, b) for a in range(m) for b in range(m) if inverse[j*m + a] // m != inverse[j*m + b] // m]
+        candidates.append([j1 for j1 in range(len(E)) if all(entries_out[j1][a][b] == 0 for a, b in forbidden)])
+
+    # S-box t is checked as soon as all the S-boxes sending bits to it are assigned
+    sources = [[permutation[t*m + a] for a in range(m)] for t in range(nbr_sboxes)]
+    ready = [[] for _ in range(nbr_sboxes)]
+    for t in range(nbr_sboxes):
+        ready[max(u // m for u in sources[t])].append(t)
+
+    choice = [None] * nbr_sboxes  # index j1 of the equivalence whose output map is used for S-box j
+    outputs = [None] * nbr_sboxes  # indices j2 of the equivalences whose input map fits S-box t
+
+    def relabel(t):
+        A = tuple(entries_out[choice[u // m]][u % m][v % m] if u // m == v // m else 0
+                  for u in sources[t] for v in sources[t])
+        c = tuple(int(E[choice[u // m]].c_out[u % m]) for u in sources[t])
+        return input_maps.get((A, c), [])
+
+    def assign(j):
+        if j == nbr_sboxes:
+            c_in = backend.vector(itertools.chain(*[E[j1].c_out for j1 in choice]))
+            L_in = backend.block_diagonal_matrix([E[j1].L_out for j1 in choice])
+            for j2s in itertools.product(*outputs):
+                yield Trail(L_in, c_in,
+                            backend.block_diagonal_matrix([E[j2].L_in for j2 in j2s]),
+                            backend.vector(itertools.chain(*[E[j2].c_in for j2 in j2s])))
+            return
+        for j1 in candidates[j]:
+            choice[j] = j1
+            for t in ready[j]:
+                outputs[t] = relabel(t)
+                if not outputs[t]:
+                    break
+            else:
+                yield from assign(j + 1)
+
+    yield from assign(0)
@@ -0,0 +1,155 @@
+import itertools
+import math
+
+
+class MergePlan:
+    """
+    Order in which connect_over_linear_layer merges blocks of S-boxes into bigger blocks. Node k < nbr_sboxes
+    is S-box k, and node nbr_sboxes + s is the result of step s, which merges the nodes steps[s] = (left, right).
+    nodes[k] lists the S-boxes covered by node k, in the order in which they appear in the matrices of its
+    partial trail cores (the S-boxes of the left node first). Blocks do not have to be contiguous.
+    predicted_log_sizes[k] is the predicted log2 of the number of partial trail cores of node k (None if
+    the plan was not predicted).
+    """
+    def __init__(self, nbr_sboxes, steps, predicted_log_sizes=None):
+        self.nbr_sboxes = nbr_sboxes
+        self.steps = list(steps)
+        self.nodes = [(k,) for k in range(nbr_sboxes)]
+        for left, right in self.steps:
+            self.nodes.append(self.nodes[left] + self.nodes[right])
+        self.predicted_log_sizes = predicted_log_sizes
+        assert len(self.nodes) == 2*nbr_sboxes - 1 and sorted(self.nodes[self.root]) == list(range(nbr_sboxes))
+
+    @property
+    def root(self):
+        return len(self.nodes) - 1
+
+    @staticmethod
+    def contiguous(nbr_sboxes):
+        """
+        Merges neighbouring blocks (2i, 2i+1) level by level. When a level has an odd number of blocks,
+        the last one is carried over to the next level.
+        """
+        steps = []
+        level = list(range(nbr_sboxes))
+        while len(level) > 1:
+            merged = []
+            for i in range(0, len(level) - 1, 2):
+                steps.append((level[i], level[i + 1]))
+                merged.append(nbr_sboxes + len(steps) - 1)
+            if len(level) % 2 == 1:
+                merged.append(level[-1])
+            level = merged
+        return MergePlan(nbr_sboxes, steps)
+
+    def __repr__(self):
+        lines = []
+        for s, (left, right) in enumerate(self.steps):
+            node = self.nbr_sboxes + s
+            line = f"node {node} = node {left} + node {right} (S-boxes {list(self.nodes[node])})"
+            if self.predicted_log_sizes is not None:
+                line += f", predicted 2^{self.predicted_log_sizes[node]:.1f} partial trail cores"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def block_submatrix(L, row_sboxes, column_sboxes, m):
+    """
+    Returns the submatrix of L on the rows of the S-boxes row_sboxes and the columns of the
+    S-boxes column_sboxes (in the given orders)
+    """
+    def is_range(sboxes):
+        return list(sboxes) == list(range(sboxes[0], sboxes[0] + len(sboxes)))
+    if is_range(row_sboxes) and is_range(column_sboxes):
+        # Slicing is much faster than extracting rows and columns
+        return L[row_sboxes[0]*m:(row_sboxes[-1] + 1)*m, column_sboxes[0]*m:(column_sboxes[-1] + 1)*m]
+    rows = [i*m + k for i in row_sboxes for k in range(m)]
+    columns = [j*m + k for j in column_sboxes for k in range(m)]
+    return L.matrix_from_rows_and_columns(rows, columns)
+
+
+def coupling_ranks(L, m):
+    """
+    Returns the ranks of the non-zero blocks L_ij (i != j) of L, as a dict (i, j) -> rank
+    """
+    blocks = {(r // m, c // m) for r, c in L.nonzero_positions()}
+    return {(i, j): L[i*m:(i+1)*m, j*m:(j+1)*m].rank() for i, j in sorted(blocks) if i != j}
+
+
+class PreparedLinearLayer:
+    """
+    The parts of connect_over_linear_layer which only depend on the linear layer L: the diagonal
+    blocks L_ii, the coupling ranks (see coupling_ranks) and the blocks between sets of S-boxes,
+    which are extracted on first use and kept. One object can be used for the searches of any
+    number of S-boxes over the same L (see trails/screen.py).
+    """
+    def __init__(self, L, nbr_sboxes, m):
+        self.L = L
+        self.nbr_sboxes = nbr_sboxes
+        self.m = m
+        self.diagonal_blocks = []
+        for i in range(nbr_sboxes):
+            L_ii = L[i*m:(i+1)*m, i*m:(i+1)*m]
+            L_ii.set_immutable()
+            self.diagonal_blocks.append(L_ii)
+        self.coupling_ranks = coupling_ranks(L, m)
+        self._blocks = {}
+
+    def block(self, row_sboxes, column_sboxes):
+        """
+        Returns the (immutable) block of L on the given S-boxes, see block_submatrix
+        """
+        key = (tuple(row_sboxes), tuple(column_sboxes))
+        if key not in self._blocks:
+            block = block_submatrix(self.L, row_sboxes, column_sboxes, self.m)
+            block.set_immutable()
+            self._blocks[key] = block
+        return self._blocks[key]
+
+
+def plan_merges(L, nbr_sboxes, m, leaf_sizes, nbr_equivalences, ranks=None):
+    """
+    Greedily picks the merge order of connect_over_linear_layer which keeps the predicted numbers of
+    partial trail cores small. leaf_sizes are the numbers of cores of the single S-boxes. A block
+    L_ij of rank r between two merged blocks gives r*m linear conditions on their cores, which is
+    predicted to divide the number of merged cores by nbr_equivalences^(r/m) (a full rank block L_ij
+    fixes A'_i given B_j). Merging uncoupled blocks multiplies their numbers of cores, so at each step
+    the pair of blocks with the smallest predicted result is merged, whether coupled or not.
+    ranks are the coupling ranks of L, computed if not given.
+    """
+    log_sizes = [math.log2(size) if size else -math.inf for size in leaf_sizes]
+    gain = math.log2(nbr_equivalences) / m if nbr_equivalences > 1 else 0.0
+    coupling = [{} for _ in range(nbr_sboxes)]  # node -> {node: sum of the ranks of the blocks between them}
+    if ranks is None:
+        ranks = coupling_ranks(L, m)
+    for (i, j), rank in ranks.items():
+        coupling[i][j] = coupling[i].get(j, 0) + rank
+        coupling[j][i] = coupling[j].get(i, 0) + rank
+    active = set(range(nbr_sboxes))
+    steps = []
+
+    def predict(P, Q, rank):
+        log_size = log_sizes[P] + log_sizes[Q] - rank*gain
+        return max(log_size, 0.0) if log_size != -math.inf else log_size  # the trivial core always survives
+
+    while len(active) > 1:
+        candidates = [(predict(P, Q, rank), P, Q) for P in active for Q, rank in coupling[P].items() if P < Q]
+        P, Q = sorted(active, key=lambda node: (log_sizes[node], node))[:2]
+        candidates.append((predict(P, Q, 0), min(P, Q), max(P, Q)))
+        log_size, P, Q = min(candidates)
+        node = len(log_sizes)
+        steps.append((P, Q))
+        log_sizes.append(log_size)
+        merged = {}
+        for R, rank in itertools.chain(coupling[P].items(), coupling[Q].items()):
+            if R not in (P, Q):
+                merged[R] = merged.get(R, 0) + rank
+        for R, rank in merged.items():
+            coupling[R].pop(P, None)
+            coupling[R].pop(Q, None)
+            coupling[R][node] = rank
+        coupling.append(merged)
+        active -= {P, Q}
+        active.add(node)
+    return MergePlan(nbr_sboxes, steps, log_sizes)
+
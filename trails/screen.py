@@ -0,0 +1,56 @@
+import time
+from multiprocessing import Pool
+
+from ciphers.backend import backend_of
+from trails.plan import PreparedLinearLayer
+from trails.search import _iter_trails, _superbox_layer
+from trails.trail import Trail
+
+
+# Screening of S-boxes over a fixed linear layer: the linear layer of a cipher is kept (and its blocks
+# are only extracted once per worker process, see PreparedLinearLayer), and only the S-box, hence its
+# self equivalences, changes from one search to the next.
+
+_worker = {}
+
+
+def _init_worker(linear_layer, permutation, nbr_sboxes, m, engine):
+    prepared = None
+    if permutation is None and engine in (None, "enumeration"):
+        prepared = PreparedLinearLayer(linear_layer, nbr_sboxes, m)
+    _worker.update(linear_layer=linear_layer, permutation=permutation, nbr_sboxes=nbr_sboxes, m=m,
+                   engine=engine, prepared=prepared, backend=backend_of(linear_layer))
+
+
+def _screen_worker(lut):
+    time_start = time.time()
+    S = _worker["backend"].sbox(lut)
+    sbox_affine_equivalences = Trail.over_sbox(S, backend=_worker["backend"])
+    time_affine_equivalence = time.time() - time_start
+    trails = list(_iter_trails(sbox_affine_equivalences, _worker["linear_layer"], _worker["permutation"],
+                               _worker["nbr_sboxes"], _worker["m"], _worker["engine"], None, _worker["prepared"]))
+    return {"lut": tuple(lut),
+            "affine_equivalences": len(sbox_affine_equivalences),
+            "trails": len(trails),
+            "nontrivial_trails": sum(not trail.is_trivial() for trail in trails),
+            "time_affine_equivalence": time_affine_equivalence,
+            "time_total": time.time() - time_start}
+
+
+def screen_sboxes(luts, cipher, engine=None, processes=None):
+    """
+    Runs the two-round trail search (see find_two_round_trails) of cipher with each of the S-boxes
+    given as lookup tables instead of cipher.S, over a process pool with the given number of processes.
+    The S-boxes must have the size of cipher.S. Returns one dict per S-box (in the order of luts) with
+    the lookup table, the numbers of affine self equivalences, trails and nontrivial trails, and the
+    timings in seconds, e.g. for tabulate(rows, headers="keys").
+    """
+    linear_layer, permutation, nbr_sboxes = _superbox_layer(cipher)
+    m = cipher.S.input_size()
+    luts = [list(lut) for lut in luts]
+    for lut in luts:
+        if len(lut) != 2**m:
+            raise ValueError(f"S-boxes must have {m} bits")
+    with Pool(processes, initializer=_init_worker,
+              initargs=(linear_layer, permutation, nbr_sboxes, m, engine)) as pool:
+        return pool.map(_screen_worker, luts)
@@ -0,0 +1,548 @@
+import hashlib
+import itertools
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from ciphers.backend import backend_of, matrix_bits, vector_to_int
+from ciphers.cipher import AESLikeCipher
+from trails.permutation import iter_connect_over_permutation_layer
+from trails.plan import MergePlan, PreparedLinearLayer, plan_merges
+from trails.trail import Trail
+
+ALGORITHM_VERSION = 1  # part of the fingerprints of the checkpoints, to be increased if the cores or their order change
+
+
+def _superbox_layer(cipher):
+    """
+    Returns the linear layer between the two S-box layers (as a matrix and, if it is a bit permutation,
+    as a list of indices) and the number of S-boxes it acts on
+    """
+    # Make use of super-box structure (if present)
+    if isinstance(cipher, AESLikeCipher):
+        return cipher.mc_binary_matrix, cipher.mc_permutation, cipher.nbr_sboxes // cipher.nbr_superboxes
+    return cipher.L, cipher.L_permutation, cipher.nbr_sboxes
+
+
+def _iter_trails(sbox_affine_equivalences, linear_layer, permutation, nbr_sboxes, m, engine, plan, prepared=None,
+                 processes=None, checkpoint=None):
+    parallel = processes is not None and processes > 1
+    if engine is None:
+        engine = "enumeration" if permutation is None or parallel or checkpoint is not None else "permutation"
+    elif engine != "enumeration" and parallel:
+        raise ValueError(f"the {engine} engine cannot run on a process pool, use the enumeration engine")
+    elif engine != "enumeration" and checkpoint is not None:
+        raise ValueError(f"the {engine} engine cannot save checkpoints, use the enumeration engine")
+    # Try to connect trails over the s-box layers over the linear layer
+    if engine == "permutation":
+        return iter_connect_over_permutation_layer(sbox_affine_equivalences, permutation, nbr_sboxes, m)
+    if engine == "linear_algebra":
+        # This engine relies on Sage's vector spaces, so it is only imported when used
+        if backend_of(linear_layer).name != "sage":
+            raise ValueError("the linear_algebra engine requires the sage backend")
+        from trails.linear_algebra import solve_over_linear_layer
+        return iter(solve_over_linear_layer(sbox_affine_equivalences, linear_layer, nbr_sboxes, m))
+    if parallel or checkpoint is not None:
+        return iter(connect_over_linear_layer(sbox_affine_equivalences, linear_layer, nbr_sboxes, m, plan, prepared,
+                                              processes, checkpoint))
+    return iter_connect_over_linear_layer(sbox_affine_equivalences, linear_layer, nbr_sboxes, m, plan, prepared)
+
+
+def find_two_round_trails(cipher, engine=None, plan=None, processes=None, checkpoint=None):
+    """
+    Returns all two-round commutative trails for cipher, as well as the time required to do so.
+    engine selects how trails are connected over the linear layer: "enumeration" (filter
+    combinations of self equivalences block-wise, see connect_over_linear_layer),
+    "linear_algebra" (solve the commutation equation as a linear system, see solve_over_linear_layer)
+    or "permutation" (relabel self equivalences, only for bit permutation layers, see
+    connect_over_permutation_layer). By default, "permutation" is used for bit permutation layers
+    and "enumeration" otherwise. plan is the merge order of the "enumeration" engine (see
+    connect_over_linear_layer and merge_plan). With processes > 1, the "enumeration" engine runs
+    on a process pool of this size, and if checkpoint is a directory, it saves its progress there
+    to resume an interrupted search (see connect_over_linear_layer and SearchCheckpoint). With
+    either of them, "enumeration" is the default engine and the other engines raise a ValueError.
+    The trails use the backend of the linear layer of cipher (see ciphers.backend and Cipher.to_backend).
+    """
+    time_start = time.time()
+    linear_layer, permutation, nbr_sboxes = _superbox_layer(cipher)
+    sbox_affine_equivalences = Trail.over_sbox(cipher.S, backend=backend_of(linear_layer))
+    time_affine_equivalence = time.time() - time_start
+    trails = list(_iter_trails(sbox_affine_equivalences, linear_layer, permutation, nbr_sboxes,
+                               cipher.S.input_size(), engine, plan, processes=processes,
+                               checkpoint=checkpoint))
+    return trails, {"total": time.time() - time_start, "affine_equivalence": time_affine_equivalence}
+
+
+def inverse_two_round_trails(cipher, trails=None, engine=None, plan=None):
+    """
+    Returns all two-round commutative trails for cipher.inverse(), derived from the trails of cipher
+    (see Trail.inverse) instead of searching them again. trails are the trails of cipher, as
+    returned by find_two_round_trails (which is called with engine and plan if they are not given).
+    """
+    if trails is None:
+        trails, _ = find_two_round_trails(cipher, engine, plan)
+    return [trail.inverse() for trail in trails]
+
+
+def iter_two_round_trails(cipher, engine=None, plan=None):
+    """
+    Same as find_two_round_trails, but yields the trails one by one as soon as they are found
+    (in depth-first merge order for the "enumeration" engine), so that the search can be stopped early
+    """
+    linear_layer, permutation, nbr_sboxes = _superbox_layer(cipher)
+    sbox_affine_equivalences = Trail.over_sbox(cipher.S, backend=backend_of(linear_layer))
+    yield from _iter_trails(sbox_affine_equivalences, linear_layer, permutation, nbr_sboxes,
+                            cipher.S.input_size(), engine, plan)
+
+
+def first_trails(cipher, k, nontrivial=True, engine=None, plan=None):
+    """
+    Returns the first k two-round trails of cipher (only nontrivial ones by default, see
+    Trail.is_trivial), and stops the search as soon as they are found
+    """
+    trails = (trail for trail in iter_two_round_trails(cipher, engine, plan) if not (nontrivial and trail.is_trivial()))
+    return list(itertools.islice(trails, k))
+
+
+def exists_trail(cipher, engine=None, plan=None):
+    """
+    Returns whether cipher has a nontrivial two-round commutative trail, and stops the search as
+    soon as one is found
+    """
+    return len(first_trails(cipher, 1, True, engine, plan)) > 0
+
+
+class TrailCoreTree:
+    """
+    Partial trail cores of connect_over_linear_layer, stored by reference instead of as matrices.
+    The nodes of the tree are those of a MergePlan. A core of an S-box (node k < nbr_sboxes) is a pair
+    (j1, j2) of indices into the S-box affine self equivalences (the core uses the output map of
+    equivalence j1 and the input map of equivalence j2). A core of the node merging the nodes
+    (left, right) is a pair (a, b) of indices into the cores of these nodes. Matrices and constants are
+    only built for the cores that are accessed, in the S-box order of the node (see MergePlan.nodes).
+    Nodes with identical results share the same list of cores, identified by a result id.
+    Matrices and constants are built with the backend of the self equivalences.
+    """
+    def __init__(self, sbox_affine_equivalences, plan=None):
+        self.sbox_affine_equivalences = sbox_affine_equivalences
+        self.backend = backend_of(sbox_affine_equivalences[0].L_in) if sbox_affine_equivalences else None
+        self.plan = plan
+        self.cores = []  # cores[k] holds the cores of node k
+        self.result_ids = []  # result_ids[k] identifies the list cores[k] among the distinct results
+
+    def leaves(self, node, index, natural_order=False):
+        """
+        Returns the pairs (j1, j2) of all S-boxes covered by a core, in the S-box order of the node
+        (or from the first to the last S-box if natural_order is set)
+        """
+        leaves = []
+        stack = [(node, index)]
+        while stack:
+            node_, index_ = stack.pop()
+            if node_ < self.plan.nbr_sboxes:
+                leaves.append(self.cores[node_][index_])
+            else:
+                left, right = self.plan.steps[node_ - self.plan.nbr_sboxes]
+                a, b = self.cores[node_][index_]
+                stack += [(right, b), (left, a)]
+        if natural_order:
+            leaves = [leaf for _, leaf in sorted(zip(self.plan.nodes[node], leaves))]
+        return leaves
+
+    def constants(self, node, index, natural_order=False):
+        """
+        Returns the input and output constants of a core without building its matrices
+        """
+        return _core_constants(self.sbox_affine_equivalences, self.backend, self.leaves(node, index, natural_order))
+
+    def materialize(self, node, index, natural_order=False):
+        """
+        Returns a core as a Trail object
+        """
+        return _core_trail(self.sbox_affine_equivalences, self.backend, self.leaves(node, index, natural_order))
+
+
+def _core_constants(E, backend, leaves):
+    c_in = backend.vector(itertools.chain(*[E[j1].c_out for j1, _ in leaves]))
+    c_out = backend.vector(itertools.chain(*[E[j2].c_in for _, j2 in leaves]))
+    return c_in, c_out
+
+
+def _core_trail(E, backend, leaves):
+    c_in, c_out = _core_constants(E, backend, leaves)
+    return Trail(backend.block_diagonal_matrix([E[j1].L_out for j1, _ in leaves]), c_in,
+                 backend.block_diagonal_matrix([E[j2].L_in for _, j2 in leaves]), c_out)
+
+
+def _frozen_hash(M):
+    M.set_immutable()
+    return hash(M)
+
+
+class _LazyCores:
+    """
+    Cores of a node, generated on demand from an iterator and kept once generated. Nodes with
+    identical results share the same object.
+    """
+    def __init__(self, cores):
+        self.items = []
+        self._cores = iter(cores)
+        self.done = False
+
+    def pull(self):
+        """
+        Generates the next core, returns False if there is none left
+        """
+        if not self.done:
+            try:
+                self.items.append(next(self._cores))
+                return True
+            except StopIteration:
+                self.done = True
+        return False
+
+    def indices(self):
+        """
+        Iterates over the indices of all cores, generating them when needed
+        """
+        index = 0
+        while index < len(self.items) or self.pull():
+            yield index
+            index += 1
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __len__(self):
+        # Number of cores generated so far
+        return len(self.items)
+
+
+def _merge(tree, left, right, L_12, L_21):
+    """
+    Yields the pairs (a, b) of cores of two nodes whose union is a core of the merged node. Writing the
+    merged block of L as [[L_11, L_12], [L_21, L_22]], the cores already satisfy the equation on L_11
+    and L_22, so L_ii Diag(B_1, B_2) = Diag(A'_1, A'_2) L_ii holds iff L_12 B_2 = A'_1 L_12 and
+    L_21 B_1 = A'_2 L_21. The cores of the right node are bucketed by the hashes of L_12 B_2 and
+    A'_2 L_21, so that only hashes are kept in memory and each core of the left node is only compared
+    with the cores of the right node that (most likely) match it.
+    Cores of both nodes are only generated when needed: for each core of the left node, the matches
+    among the right cores bucketed so far are yielded first, then further right cores are generated
+    (and bucketed) one at a time. Pairs are yielded in the order of a, then b.
+    """
+    left_cores, right_cores = tree.cores[left], tree.cores[right]
+    buckets = {}
+    bucketed = 0  # number of right cores in buckets
+
+    def matches(b, x1, y1):
+        # Rule out hash collisions
+        t2 = tree.materialize(right, b)
+        return L_12 * t2.L_in == y1 and t2.L_out * L_21 == x1
+
+    for a in left_cores.indices():
+        t1 = tree.materialize(left, a)
+        x1, y1 = L_21 * t1.L_in, t1.L_out * L_12
+        key = (_frozen_hash(y1), _frozen_hash(x1))
+        for b in list(buckets.get(key, [])):
+            if matches(b, x1, y1):
+                yield (a, b)
+        while bucketed < len(right_cores) or right_cores.pull():
+            b = bucketed
+            bucketed += 1
+            t2 = tree.materialize(right, b)
+            key_b = (_frozen_hash(L_12 * t2.L_in), _frozen_hash(t2.L_out * L_21))
+            buckets.setdefault(key_b, []).append(b)
+            if key_b == key and matches(b, x1, y1):
+                yield (a, b)
+
+
+def _block_cores(sbox_affine_equivalences, L_ii, j1s):
+    """
+    Returns the cores (j1, j2) of a single S-box with diagonal block L_ii, for the equivalences j1 in j1s
+    """
+    cores = []
+    for j1 in j1s:
+        left_side = L_ii * sbox_affine_equivalences[j1].L_out  # precalculate the left side, as it will stay the same
+        for j2, e2 in enumerate(sbox_affine_equivalences):
+            # Filter based on L_ii
+            if left_side == e2.L_in * L_ii:
+                # Note: The trail core uses the output map (of equivalence e1) as input and the input map (of equivalence e2) as output
+                cores.append((j1, j2))
+    return cores
+
+
+def _sbox_cores(tree, prepared, results, pool=None, checkpoint=None):
+    """
+    Computes the cores of the single S-boxes: filtering based on m x m blocks L_ii
+    (i.e. L_ii B = A' L_ii for S A = B S and S A' = B' S), on pool (a _SearchPool) if given, or
+    loads them from checkpoint (a SearchCheckpoint) if they were saved
+    """
+    sbox_affine_equivalences = tree.sbox_affine_equivalences
+    for L_ii in prepared.diagonal_blocks:
+        if L_ii not in results:
+            cores = checkpoint.load(f"sbox_{len(results)}") if checkpoint is not None else None
+            if cores is None:
+                if pool is None:
+                    cores = _block_cores(sbox_affine_equivalences, L_ii, range(len(sbox_affine_equivalences)))
+                else:
+                    cores = pool.map(_block_cores_worker,
+                                     [(L_ii, j1s) for j1s in pool.chunks(range(len(sbox_affine_equivalences)))])
+                if checkpoint is not None:
+                    checkpoint.save(f"sbox_{len(results)}", cores)
+            results[L_ii] = (len(results), cores)
+        result_id, cores = results[L_ii]
+        tree.result_ids.append(result_id)
+        tree.cores.append(cores)
+
+
+def _default_plan(tree, prepared):
+    return plan_merges(prepared.L, prepared.nbr_sboxes, prepared.m, [len(cores) for cores in tree.cores],
+                       len(tree.sbox_affine_equivalences), prepared.coupling_ranks)
+
+
+def merge_plan(sbox_affine_equivalences, L, nbr_sboxes, m, prepared=None):
+    """
+    Returns the MergePlan that connect_over_linear_layer uses by default, for inspection
+    """
+    if prepared is None:
+        prepared = PreparedLinearLayer(L, nbr_sboxes, m)
+    tree = TrailCoreTree(sbox_affine_equivalences)
+    _sbox_cores(tree, prepared, {})
+    return _default_plan(tree, prepared)
+
+
+def connect_over_linear_layer(sbox_affine_equivalences, L, nbr_sboxes, m, plan=None, prepared=None, processes=None,
+                              checkpoint=None):
+    """
+    Starting with all possible A, B such that S A = B S, return those such that
+    L Diag(B_1,...,B_{n/m}) = Diag(A'_1,...,A'_{n/m}) L. In other words, return the
+    cores of all trails over SBox-, linear- and SBox-layer.
+    Blocks of S-boxes are merged two at a time, in the order given by plan (a MergePlan, or
+    "contiguous" to merge neighbouring blocks level by level). By default, the order is chosen by
+    plan_merges from the coupling structure of L, which keeps the numbers of partial cores small.
+    prepared is a PreparedLinearLayer of L, which can be passed to reuse the blocks of L across
+    searches with different S-boxes.
+    With processes > 1, the filters of the single S-boxes, the products of each merge and the final
+    filter on the constants are split into chunks computed by a process pool (see _SearchPool), and
+    the trail cores are returned in the same order as without it.
+    If checkpoint is a directory, the cores of every completed merge step are saved there (see
+    SearchCheckpoint), and a search which was interrupted resumes after its last saved step.
+    """
+    if (processes is None or processes <= 1) and checkpoint is None:
+        return list(iter_connect_over_linear_layer(sbox_affine_equivalences, L, nbr_sboxes, m, plan, prepared))
+    if prepared is None:
+        prepared = PreparedLinearLayer(L, nbr_sboxes, m)
+    if checkpoint is not None:
+        checkpoint = SearchCheckpoint(checkpoint, sbox_affine_equivalences, L, nbr_sboxes, m)
+    tree = TrailCoreTree(sbox_affine_equivalences)
+    results = {}  # as in iter_connect_over_linear_layer
+    pool = _SearchPool(sbox_affine_equivalences, L, processes) if processes is not None and processes > 1 else None
+    try:
+        _sbox_cores(tree, prepared, results, pool, checkpoint)
+        if plan is None:
+            plan = _default_plan(tree, prepared)
+        elif plan == "contiguous":
+            plan = MergePlan.contiguous(nbr_sboxes)
+        tree.plan = plan
+        if checkpoint is not None:
+            checkpoint.set_plan(plan)
+        lazy_cores = {}  # result id -> _LazyCores holding all the cores
+        tree.cores = [lazy_cores.setdefault(result_id, _generated(cores))
+                      for result_id, cores in zip(tree.result_ids, tree.cores)]
+        for step, (left, right) in enumerate(plan.steps):
+            L_12 = prepared.block(plan.nodes[left], plan.nodes[right])
+            L_21 = prepared.block(plan.nodes[right], plan.nodes[left])
+            key = (tree.result_ids[left], tree.result_ids[right], L_12, L_21)
+            if key not in results:
+                cores = checkpoint.load(f"step_{step}") if checkpoint is not None else None
+                if cores is None:
+                    if pool is not None:
+                        cores = _parallel_merge(pool, tree, left, right, L_12, L_21)
+                    else:
+                        cores = list(_merge(tree, left, right, L_12, L_21))
+                    if checkpoint is not None:
+                        checkpoint.save(f"step_{step}", cores)
+                results[key] = (len(results), _generated(cores))
+            result_id, cores = results[key]
+            tree.result_ids.append(result_id)
+            tree.cores.append(cores)
+        root = plan.root
+        if pool is None:
+            trails = []
+            for index in range(len(tree.cores[root])):
+                c_in, c_out = tree.constants(root, index, natural_order=True)
+                if L * c_in == c_out:
+                    trails.append(tree.materialize(root, index, natural_order=True))
+            return trails
+        leaves = [tree.leaves(root, index, natural_order=True) for index in range(len(tree.cores[root]))]
+        return pool.map(_constants_worker, pool.chunks(leaves))
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def _generated(cores):
+    # _LazyCores holding a list of cores which are all known
+    lazy = _LazyCores(())
+    lazy.items = list(cores)
+    lazy.done = True
+    return lazy
+
+
+class SearchCheckpoint:
+    """
+    Cores of the single S-boxes and of the merge steps of connect_over_linear_layer, saved as
+    arrays of pairs of indices in directory/<fingerprint>, where the fingerprint covers
+    ALGORITHM_VERSION, L and the self equivalences (whose order defines the indices). The cores of
+    the merge steps are in a subdirectory per merge plan. Files are written atomically, and files
+    which cannot be read are computed again.
+    """
+    def __init__(self, directory, sbox_affine_equivalences, L, nbr_sboxes, m):
+        fingerprint = hashlib.sha256(f"{ALGORITHM_VERSION} {nbr_sboxes} {m}".encode())
+        fingerprint.update(np.packbits(matrix_bits(L)).tobytes())
+        for e in sbox_affine_equivalences:
+            for M, c in [(e.L_in, e.c_in), (e.L_out, e.c_out)]:
+                fingerprint.update(np.packbits(matrix_bits(M)).tobytes() + str(vector_to_int(c)).encode())
+        self.path = os.path.join(directory, fingerprint.hexdigest()[:32])
+        self.plan_path = None
+        os.makedirs(self.path, exist_ok=True)
+
+    def set_plan(self, plan):
+        self.plan_path = os.path.join(self.path, "plan_" + hashlib.sha256(str(plan.steps).encode()).hexdigest()[:16])
+        os.makedirs(self.plan_path, exist_ok=True)
+
+    def _file(self, name):
+        return os.path.join(self.plan_path if name.startswith("step_") else self.path, name + ".npy")
+
+    def load(self, name):
+        """
+        Returns the saved cores of name (a list of pairs), or None
+        """
+        try:
+            cores = np.load(self._file(name))
+        except (OSError, ValueError, EOFError):
+            return None  # missing, empty or truncated file
+        if cores.ndim != 2 or cores.shape[1] != 2:
+            return None
+        return [(int(a), int(b)) for a, b in cores]
+
+    def save(self, name, cores):
+        path = self._file(name)
+        temporary = path + f".{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, np.array(cores, dtype=np.int64).reshape(-1, 2))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+
+
+_worker = {}
+
+
+def _init_worker(sbox_affine_equivalences, L):
+    _worker.update(E=sbox_affine_equivalences, L=L,
+                   backend=backend_of(sbox_affine_equivalences[0].L_in) if sbox_affine_equivalences else None)
+
+
+def _block_cores_worker(task):
+    L_ii, j1s = task
+    return _block_cores(_worker["E"], L_ii, j1s)
+
+
+def _merge_keys_worker(task):
+    leaves, L_12, L_21, is_left = task
+    keys = []
+    for core_leaves in leaves:
+        t = _core_trail(_worker["E"], _worker["backend"], core_leaves)
+        # see _merge: a left core matches the right cores with the same key
+        key = (t.L_out * L_12, L_21 * t.L_in) if is_left else (L_12 * t.L_in, t.L_out * L_21)
+        for M in key:
+            M.set_immutable()
+        keys.append(key)
+    return keys
+
+
+def _constants_worker(leaves):
+    trails = []
+    for core_leaves in leaves:
+        c_in, c_out = _core_constants(_worker["E"], _worker["backend"], core_leaves)
+        if _worker["L"] * c_in == c_out:
+            trails.append(_core_trail(_worker["E"], _worker["backend"], core_leaves))
+    return trails
+
+
+class _SearchPool:
+    """
+    Process pool of connect_over_linear_layer. The self equivalences and L are given to the workers
+    once, when they start (the other inputs are small: indices of self equivalences and blocks of L).
+    Work is split into about chunks_per_process chunks per process, and the results of the chunks
+    are concatenated in order.
+    """
+    def __init__(self, sbox_affine_equivalences, L, processes, chunks_per_process=4):
+        self.processes = processes
+        self.chunks_per_process = chunks_per_process
+        self.pool = Pool(processes, initializer=_init_worker, initargs=(sbox_affine_equivalences, L))
+
+    def chunks(self, items):
+        items = list(items)
+        size = max(1, -(-len(items) // (self.processes * self.chunks_per_process)))
+        return [items[k:k + size] for k in range(0, len(items), size)]
+
+    def map(self, function, tasks):
+        return list(itertools.chain.from_iterable(self.pool.map(function, tasks, chunksize=1)))
+
+    def close(self):
+        self.pool.terminate()
+
+
+def _parallel_merge(pool, tree, left, right, L_12, L_21):
+    """
+    Returns the pairs (a, b) of _merge, in the same order, with the products of the cores of both
+    nodes computed by pool: the keys are compared as matrices, so there is no hash collision to rule out
+    """
+    def keys(node, is_left):
+        leaves = [tree.leaves(node, index) for index in range(len(tree.cores[node]))]
+        return pool.map(_merge_keys_worker, [(chunk, L_12, L_21, is_left) for chunk in pool.chunks(leaves)])
+
+    buckets = {}
+    for b, key in enumerate(keys(right, False)):
+        buckets.setdefault(key, []).append(b)
+    return [(a, b) for a, key in enumerate(keys(left, True)) for b in buckets.get(key, [])]
+
+
+def iter_connect_over_linear_layer(sbox_affine_equivalences, L, nbr_sboxes, m, plan=None, prepared=None):
+    """
+    Same as connect_over_linear_layer, but yields the trail cores one by one, in depth-first merge
+    order: partial cores are only generated when they are needed to find the next trail core.
+    """
+    if prepared is None:
+        prepared = PreparedLinearLayer(L, nbr_sboxes, m)
+    tree = TrailCoreTree(sbox_affine_equivalences)
+    results = {}  # Memoize the results per block matrix L_ii and per pair of child results and off-diagonal blocks
+    _sbox_cores(tree, prepared, results)
+    if plan is None:
+        plan = _default_plan(tree, prepared)
+    elif plan == "contiguous":
+        plan = MergePlan.contiguous(nbr_sboxes)
+    tree.plan = plan
+    lazy_cores = {}  # result id -> _LazyCores
+    tree.cores = [lazy_cores.setdefault(result_id, _LazyCores(cores))
+                  for result_id, cores in zip(tree.result_ids, tree.cores)]
+
+    for left, right in plan.steps:
+        L_12 = prepared.block(plan.nodes[left], plan.nodes[right])
+        L_21 = prepared.block(plan.nodes[right], plan.nodes[left])
+        key = (tree.result_ids[left], tree.result_ids[right], L_12, L_21)
+        if key not in results:
+            results[key] = (len(results), _LazyCores(_merge(tree, left, right, L_12, L_21)))
+        result_id, cores = results[key]
+        tree.result_ids.append(result_id)
+        tree.cores.append(cores)
+    # Filter constants (only the final survivors are materialized, with the S-boxes in their natural order)
+    root = plan.root
+    for index in tree.cores[root].indices():
+        c_in, c_out = tree.constants(root, index, natural_order=True)
+        if L * c_in == c_out:
+            yield tree.materialize(root, index, natural_order=True)
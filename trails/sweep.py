@@ -0,0 +1,196 @@
+import hashlib
+import itertools
+import sqlite3
+from copy import copy
+from multiprocessing import Pool
+
+from ciphers.structured import inverse_permutation
+from trails.plan import block_submatrix
+from trails.search import iter_connect_over_linear_layer
+from trails.trail import Trail
+
+
+# Sweeps over the ShuffleCells layer of AES-like ciphers (S-box layer, then L = SC * MC with identical S-boxes,
+# MC acting on columns of consecutive cells, cell i = nbr_rows*column + row, and SC a cell permutation such
+# that (SC x)[i] = x[permutation[i]], as in AESLikeCipher with sc_first=False).
+#
+# Over a single linear layer, SC only relabels the output cells of the trail cores of MC, so the number of
+# trails does not depend on SC. The sweep therefore counts the commutative trails over several rounds
+# (S L S ... L S), which are chains of trail cores of L where the self equivalence used by each cell of the
+# middle S-box layers is the same for both cores. All trail cores of L are combinations of the trail cores
+# of a single MC (a superbox), with the output cells permuted by SC: the superbox trail cores are computed
+# once (as indices into the S-box self equivalences), and each candidate permutation only counts chains.
+
+
+def _frozen_key(L, c):
+    L = copy(L)
+    L.set_immutable()
+    return (L, tuple(int(x) for x in c))
+
+
+def superbox_cores(sbox_affine_equivalences, mc_binary_matrix, nbr_rows, m):
+    """
+    Returns the trail cores of a superbox as pairs (j1s, j2s) of tuples of indices into the S-box
+    affine self equivalences, one per cell: the core uses the output maps of the equivalences j1s
+    as input and the input maps of the equivalences j2s as output
+    """
+    E = sbox_affine_equivalences
+    # An affine self equivalence is determined by its input map, as well as by its output map
+    by_output = {_frozen_key(e.L_out, e.c_out): j for j, e in enumerate(E)}
+    by_input = {_frozen_key(e.L_in, e.c_in): j for j, e in enumerate(E)}
+    cores = []
+    for trail in iter_connect_over_linear_layer(E, mc_binary_matrix, nbr_rows, m):
+        cells = [slice(k*m, (k+1)*m) for k in range(nbr_rows)]
+        j1s = tuple(by_output[_frozen_key(trail.L_in[k, k], trail.c_in[k])] for k in cells)
+        j2s = tuple(by_input[_frozen_key(trail.L_out[k, k], trail.c_out[k])] for k in cells)
+        cores.append((j1s, j2s))
+    return cores
+
+
+def mc_symmetries(mc_binary_matrix, nbr_rows, nbr_columns, m):
+    """
+    Returns the cell relabelings q (new cell i = old cell q[i]) which commute with the MixColumns layer:
+    all permutations of the columns, combined with the permutations of the rows which commute with MC
+    """
+    row_permutations = [rho for rho in itertools.permutations(range(nbr_rows))
+                        if block_submatrix(mc_binary_matrix, rho, rho, m) == mc_binary_matrix]
+    return [tuple(nbr_rows*sigma[c] + rho[r] for c in range(nbr_columns) for r in range(nbr_rows))
+            for sigma in itertools.permutations(range(nbr_columns)) for rho in row_permutations]
+
+
+def canonical_cell_permutation(permutation, symmetries):
+    """
+    Returns the smallest conjugate q p q^-1 of the cell permutation p over the given relabelings q.
+    Conjugate permutations give the same trails up to a relabeling of the cells.
+    """
+    best = None
+    for q in symmetries:
+        q_inverse = inverse_permutation(q)
+        conjugate = tuple(q_inverse[permutation[q[i]]] for i in range(len(q)))
+        if best is None or conjugate < best:
+            best = conjugate
+    return best
+
+
+def count_trails(permutation, cores, nbr_rows, nbr_columns, rounds):
+    """
+    Returns the number of commutative trails over the given number of rounds for the cell permutation,
+    given the superbox trail cores (including the identity trail)
+    """
+    by_j1s = {}
+    for j1s, j2s in cores:
+        by_j1s.setdefault(j1s, []).append(j2s)
+
+    def output_cells(columns):
+        # the cells after MC are those of the chosen superbox cores, SC then relabels them
+        cells = list(itertools.chain(*columns))
+        return tuple(cells[j] for j in permutation)
+
+    # states maps the self equivalences used by the cells of the last S-box layer to the number of chains
+    states = {}
+    for columns in itertools.product([j2s for _, j2s in cores], repeat=nbr_columns):
+        cells = output_cells(columns)
+        states[cells] = states.get(cells, 0) + 1
+    for _ in range(rounds - 1):
+        next_states = {}
+        for cells, count in states.items():
+            options = [by_j1s.get(cells[c*nbr_rows:(c+1)*nbr_rows], []) for c in range(nbr_columns)]
+            for columns in itertools.product(*options):
+                cells_ = output_cells(columns)
+                next_states[cells_] = next_states.get(cells_, 0) + count
+        states = next_states
+    return sum(states.values())
+
+
+class SweepStore:
+    """
+    SQLite store of sweep results: one row per (context, permutation, rounds), with the permutation
+    stored as bytes. context identifies the S-box and MixColumns matrix (see sweep_context).
+    """
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sweep (context TEXT, permutation BLOB, rounds INTEGER, "
+                                "trails INTEGER, PRIMARY KEY (context, permutation, rounds)) WITHOUT ROWID")
+
+    def get(self, context, permutation, rounds):
+        row = self.connection.execute("SELECT trails FROM sweep WHERE context = ? AND permutation = ? AND rounds = ?",
+                                      (context, bytes(permutation), rounds)).fetchone()
+        return None if row is None else row[0]
+
+    def add(self, context, permutation, rounds, trails):
+        self.connection.execute("INSERT OR REPLACE INTO sweep VALUES (?, ?, ?, ?)",
+                                (context, bytes(permutation), rounds, trails))
+
+    def results(self, context, rounds):
+        """
+        Yields the pairs (permutation, number of trails) stored for a context and number of rounds
+        """
+        for permutation, trails in self.connection.execute(
+                "SELECT permutation, trails FROM sweep WHERE context = ? AND rounds = ?", (context, rounds)):
+            yield tuple(permutation), trails
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def sweep_context(S, mc_binary_matrix):
+    """
+    Returns a fingerprint of an S-box and a MixColumns matrix
+    """
+    data = repr((list(S), [int(x) for x in mc_binary_matrix.list()]))
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+
+_worker = {}
+
+
+def _init_worker(cores, nbr_rows, nbr_columns, rounds):
+    _worker.update(cores=cores, nbr_rows=nbr_rows, nbr_columns=nbr_columns, rounds=rounds)
+
+
+def _count_worker(permutation):
+    return permutation, count_trails(permutation, _worker["cores"], _worker["nbr_rows"], _worker["nbr_columns"],
+                                     _worker["rounds"])
+
+
+def sweep_cell_permutations(S, mc_binary_matrix, permutations, nbr_columns, rounds=2, store=None, processes=None,
+                            chunksize=64):
+    """
+    Counts the commutative trails over the given number of rounds of the AES-like ciphers with S-box S,
+    MixColumns matrix mc_binary_matrix (on one column) and ShuffleCells layers given by the cell
+    permutations (lists p such that new cell i = old cell p[i], see the top of this file).
+    Permutations are canonicalized under the relabelings of rows and columns which commute with MC, and
+    each class is only computed once (and not at all if it is already in store, a SweepStore).
+    The counting is distributed over a process pool with the given number of processes.
+    Returns a dict canonical permutation -> number of trails (the identity trail included).
+    """
+    m = S.input_size()
+    nbr_rows = mc_binary_matrix.nrows() // m
+    E = Trail.over_sbox(S, backend=getattr(mc_binary_matrix, "BACKEND", "sage"))
+    cores = superbox_cores(E, mc_binary_matrix, nbr_rows, m)
+    symmetries = mc_symmetries(mc_binary_matrix, nbr_rows, nbr_columns, m)
+    context = sweep_context(S, mc_binary_matrix)
+
+    results = {}
+    todo = []
+    for permutation in permutations:
+        canonical = canonical_cell_permutation(tuple(permutation), symmetries)
+        if canonical in results:
+            continue
+        results[canonical] = store.get(context, canonical, rounds) if store is not None else None
+        if results[canonical] is None:
+            todo.append(canonical)
+
+    if todo:
+        with Pool(processes, initializer=_init_worker, initargs=(cores, nbr_rows, nbr_columns, rounds)) as pool:
+            for permutation, trails in pool.imap_unordered(_count_worker, todo, chunksize):
+                results[permutation] = trails
+                if store is not None:
+                    store.add(context, permutation, rounds, trails)
+    if store is not None:
+        store.commit()
+    return results
@@ -0,0 +1,135 @@
+from ciphers.backend import get_backend
+
+_MAX_SEARCH_SIZE = 5  # largest S-boxes whose self equivalences are searched without sboxU
+
+
+def _self_affine_equivalent_mappings(lut):
+    """
+    Same as sboxU's self_affine_equivalent_mappings: returns the pairs (A, B) of look up tables of
+    affine permutations such that B(S(A(x))) = S(x). The affine map A(x) = L x + a is guessed one
+    column of L at a time, and a guess is dropped as soon as the pairs (S(x), S(A(x))) on the span
+    of the columns guessed so far cannot be those of an affine map C = S A S^-1 (B being C^-1).
+    """
+    n = (len(lut) - 1).bit_length()
+    size = len(lut)
+    one = 1 << n
+    result = []
+
+    def consistent(pivots, y, z):
+        # adds the point C(y) = z to the reduced system of the affine relations of C, which holds
+        # pairs (1 || y, z) by leading bit: an affine dependency of the y must hold for the z
+        v = one | y
+        while v:
+            lead = v.bit_length() - 1
+            if lead not in pivots:
+                pivots[lead] = (v, z)
+                return True
+            v ^= pivots[lead][0]
+            z ^= pivots[lead][1]
+        return z == 0
+
+    def search(a, A, pivots, k):
+        # A holds the images of the 2^k inputs x < 2^k
+        if k == n:
+            C = [0] * size
+            for x in range(size):
+                C[lut[x]] = lut[A[x]]
+            B = [0] * size
+            for y, z in enumerate(C):
+                B[z] = y
+            result.append((A, B))
+            return
+        images = set(A)
+        for column in range(1, size):
+            if column ^ a in images:
+                continue  # L would not be invertible
+            pivots_ = dict(pivots)
+            extension = [x ^ column for x in A]
+            if all(consistent(pivots_, lut[(1 << k) | x], lut[image]) for x, image in enumerate(extension)):
+                search(a, A + extension, pivots_, k + 1)
+
+    for a in range(size):
+        pivots = {}
+        consistent(pivots, lut[0], lut[a])
+        search(a, [a], pivots, 0)
+    return result
+
+
+class Trail:
+    """
+    Class for representing commutative trails
+    """
+    def __init__(self, L_in, c_in, L_out, c_out):
+        self.L_in = L_in  # Linear part of affine map applied to the input
+        self.c_in = c_in  # Constant of affine map applied to the input
+        self.L_out = L_out  # Linear part of affine map applied to the output
+        self.c_out = c_out  # Constant of affine map applied to the output
+
+    @staticmethod
+    def over_sbox(S, validate_results=False, backend="sage"):
+        """
+        Returns all affine self equivalences of SBox S, with matrices and vectors of the given
+        backend (see ciphers.backend). If validate_results is set to true, then it is also
+        checked that the affine equivalence holds for all inputs.
+        """
+        backend = get_backend(backend)
+        m = S.input_size()
+        try:
+            from sboxU import self_affine_equivalent_mappings
+        except ImportError:
+            # sboxU needs Sage: small S-boxes are handled by a search in Python instead
+            if m > _MAX_SEARCH_SIZE:
+                raise ImportError(f"the self equivalences of S-boxes of more than {_MAX_SEARCH_SIZE} bits "
+                                  "require sboxU (and Sage)")
+            self_affine_equivalent_mappings = _self_affine_equivalent_mappings
+        affine_equivalences = []
+        for lut_in, lut_out in self_affine_equivalent_mappings(list(S)):
+            c_in = backend.vector_from_int(lut_in[0], m)
+            c_out = backend.vector_from_int(lut_out[0], m)
+            L_in = backend.matrix_from_linear_lut([l ^ lut_in[0] for l in lut_in])
+            L_out = backend.matrix_from_linear_lut([l ^ lut_out[0] for l in lut_out])
+            L_out = L_out.inverse()
+            c_out = L_out * c_out
+            affine_equivalences.append(Trail(L_in, c_in, L_out, c_out))
+        if validate_results:
+            S = backend.convert(S)
+            for x in range(2**m):
+                x = backend.vector_from_int(x, m)
+                for ae in affine_equivalences:
+                    # Make sure that bit order is correct
+                    assert ae.L_out * S(x) + ae.c_out == S(ae.L_in * x + ae.c_in)
+        return affine_equivalences
+
+    @staticmethod
+    def over_sbox_inverse(sbox_affine_equivalences):
+        """
+        Returns the affine self equivalences of the inverse of an S-box, given those of the S-box
+        (as returned by over_sbox): L_out S(x) + c_out = S(L_in x + c_in) is equivalent to
+        L_in S^-1(y) + c_in = S^-1(L_out y + c_out)
+        """
+        return [e.inverse() for e in sbox_affine_equivalences]
+
+    def inverse(self):
+        """
+        Returns the corresponding trail of the inverse cipher, whose input and output maps are the
+        output and input maps of this trail: L (L_in x + c_in) = L_out L x + c_out is equivalent to
+        L^-1 (L_out y + c_out) = L_in L^-1 y + c_in. This also holds for S-box self equivalences
+        """
+        return Trail(self.L_out, self.c_out, self.L_in, self.c_in)
+
+    def is_trivial(self):
+        """
+        Returns whether this is the identity trail (which exists for every cipher)
+        """
+        return self.L_in.is_one() and self.L_out.is_one() and self.c_in.is_zero() and self.c_out.is_zero()
+
+    def to_backend(self, backend):
+        """
+        Returns the same trail with matrices and vectors of the given backend
+        """
+        backend = get_backend(backend)
+        return Trail(backend.convert(self.L_in), backend.convert(self.c_in),
+                     backend.convert(self.L_out), backend.convert(self.c_out))
+
+    def __repr__(self):
+        return f"L_in={self.L_in}, c_in={self.c_in}, L_out={self.L_out}, c_out={self.c_out}"
@@ -0,0 +1,266 @@
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from ciphers.backend import affine_key, backend_of, matrix_bits, vector_to_int
+from ciphers.cipher import AESLikeCipher
+from trails.trail import Trail
+
+
+# Empirical validation of commutative trails over several rounds, with key additions and round
+# constants. The cipher is evaluated on NumPy arrays of states (one column of 64-bit words per
+# state, the first bit of a state being the most significant bit of its first word, as in Sage): the
+# S-box layer and the linear layer L are merged into T-tables, one per group of S-boxes of up to 16
+# bits, and affine maps are evaluated with one table per 16 bits of the input (fewer bits for large
+# states, to bound the size of the tables).
+#
+# The r-round cipher is x -> x + k_0 + c_0, then r times x -> L S(x) + k_i + c_i, with independent
+# round keys k_i and fixed round constants c_i. Each S-box layer i uses the self equivalences of a
+# trail (trails[i % len(trails)], as returned by find_two_round_trails): A_0 is made of their input
+# maps, and A_i = L B_{i-1} L^-1 for i > 0, B_{i-1} being made of the output maps of the S-box
+# layer i - 1. With the related round keys k'_i = A_i k_i (linear part of A_i), the rate of round
+# index t is the probability that A_t(E_k(x)) = E_k'(A_0(x)) after t rounds: it is 1 for a chain of
+# trails with weak round constants, and lower if the maps of a layer do not match the ones of the
+# next trail, or if the round constants break the commutation.
+
+_BATCH = 1 << 16  # states per array
+_TABLE_BYTES = 1 << 26  # largest size of the tables of a function
+_worker = {}
+
+
+def _words(n):
+    return (n + 63) // 64
+
+
+def _to_words(values, n):
+    """
+    Python integers of n bits as an array of 64-bit words (one column per integer)
+    """
+    W = _words(n)
+    words = np.zeros((W, len(values)), dtype=np.uint64)
+    for k, value in enumerate(values):
+        value <<= 64*W - n
+        for w in range(W):
+            words[w, k] = (value >> (64*(W - 1 - w))) & (2**64 - 1)
+    return words
+
+
+def _field(x, start, width):
+    """
+    Bits start to start + width - 1 of the states x, as integers
+    """
+    word, offset = divmod(start, 64)
+    if offset + width <= 64:
+        return (x[word] >> np.uint64(64 - offset - width)) & np.uint64(2**width - 1)
+    low = offset + width - 64  # bits taken from the next word
+    return ((x[word] << np.uint64(low)) | (x[word + 1] >> np.uint64(64 - low))) & np.uint64(2**width - 1)
+
+
+def _field_units(n, unit):
+    # number of units (bits or S-boxes of unit bits) per field: fields of up to 16 bits, within _TABLE_BYTES
+    units = max(1, 16 // unit)
+    while units > 1 and -(-n // (units*unit)) * 2**(units*unit) * _words(n) * 8 > _TABLE_BYTES:
+        units -= 1
+    return units
+
+
+class _FieldTables:
+    """
+    Evaluates x -> f(x) + c for a linear function f which is the sum of functions of fields of x,
+    given by the images of all the values of each field (one table per word of the output)
+    """
+    def __init__(self, n, fields, tables, constant=None):
+        self.n = n
+        self.fields = fields  # (start, width) of each field
+        self.tables = tables  # tables[k][w][v] is word w of the image of value v of field k
+        self.constant = _to_words([constant or 0], n)
+
+    def __call__(self, x):
+        y = np.repeat(self.constant, x.shape[1], axis=1)
+        for (start, width), table in zip(self.fields, self.tables):
+            v = _field(x, start, width)
+            for w in range(len(y)):
+                y[w] ^= table[w].take(v)
+        return y
+
+
+def _images(M, n):
+    # images of the input bits by the matrix of bits M, as words (one column per input bit)
+    return _to_words([int("".join(map(str, column)), 2) for column in M.T], n)
+
+
+def _affine_tables(M, c, n):
+    """
+    _FieldTables of x -> M x + c, for a matrix of bits M and an integer c
+    """
+    columns = _images(M, n)
+    units = _field_units(n, 1)
+    fields = [(start, min(units, n - start)) for start in range(0, n, units)]
+    tables = []
+    for start, width in fields:
+        v = np.arange(2**width)
+        table = np.zeros((_words(n), 2**width), dtype=np.uint64)
+        for k in range(width):
+            table[:, (v >> (width - 1 - k)) & 1 == 1] ^= columns[:, start + k:start + k + 1]
+        tables.append(table)
+    return _FieldTables(n, fields, tables, c)
+
+
+def _round_tables(lut, m, nbr_sboxes, L):
+    """
+    T-tables of x -> L S(x), one per group of S-boxes of up to 16 bits
+    """
+    n = m * nbr_sboxes
+    columns = _images(L, n)
+    units = _field_units(n, m)
+    fields, tables = [], []
+    for first in range(0, nbr_sboxes, units):
+        count = min(units, nbr_sboxes - first)
+        width = m * count
+        v = np.arange(2**width)
+        table = np.zeros((_words(n), 2**width), dtype=np.uint64)
+        for k in range(count):
+            y = np.array(lut)[(v >> (m*(count - 1 - k))) & (2**m - 1)]
+            for b in range(m):
+                table[:, (y >> (m - 1 - b)) & 1 == 1] ^= columns[:, m*(first + k) + b:m*(first + k) + b + 1]
+        fields.append((m * first, width))
+        tables.append(table)
+    return _FieldTables(n, fields, tables)
+
+
+def _layer_equivalences(cipher, trail, sbox_affine_equivalences):
+    """
+    Self equivalences of all the S-boxes of a layer, given by the output maps of a trail (over the
+    superbox for AES-like ciphers, in which case it is used for every column)
+    """
+    m = cipher.S.input_size()
+    by_output = {affine_key(e.L_out, e.c_out): e for e in sbox_affine_equivalences}
+    cells = trail.L_in.nrows() // m
+    core = [by_output[affine_key(trail.L_in[k*m:(k+1)*m, k*m:(k+1)*m], trail.c_in[k*m:(k+1)*m])]
+            for k in range(cells)]
+    if not isinstance(cipher, AESLikeCipher):
+        return core
+    # S-box feeding cell i of the input of the MixColumns layer
+    sources = list(range(cipher.nbr_sboxes))
+    if cipher.sc_first:
+        if cipher.sc_permutation is None:
+            raise ValueError("ShuffleCells must be a permutation of cells")
+        sources = [cipher.sc_permutation[i*m] // m for i in range(cipher.nbr_sboxes)]
+    layer = [None] * cipher.nbr_sboxes
+    for i, source in enumerate(sources):
+        layer[source] = core[i % cells]
+    return layer
+
+
+def _concatenation(vectors):
+    return vector_to_int([bit for v in vectors for bit in v])
+
+
+def _block_diagonal(blocks, m):
+    M = np.zeros((m*len(blocks), m*len(blocks)), dtype=np.uint8)
+    for k, block in enumerate(blocks):
+        M[k*m:(k+1)*m, k*m:(k+1)*m] = block
+    return M
+
+
+def _product(*matrices):
+    # product over GF(2) (with floating point products, which are exact for these sizes)
+    result = matrices[0].astype(np.float64)
+    for M in matrices[1:]:
+        result = np.fmod(result @ M.astype(np.float64), 2)
+    return result.astype(np.uint8)
+
+
+def round_maps(cipher, trails, rounds):
+    """
+    Returns the affine maps A_0, ..., A_rounds (as pairs of a matrix of bits and an integer) of the
+    chain of trails, see the top of this file
+    """
+    if isinstance(trails, Trail):
+        trails = [trails]
+    backend = backend_of(trails[0].L_in)
+    m = cipher.S.input_size()
+    sbox_affine_equivalences = Trail.over_sbox(cipher.S, backend=backend)
+    L = matrix_bits(cipher.L)
+    L_inverse = matrix_bits(cipher.L_inverse)
+    layers = [_layer_equivalences(cipher, trails[i % len(trails)], sbox_affine_equivalences) for i in range(rounds)]
+    maps = [(_block_diagonal([matrix_bits(e.L_in) for e in layers[0]], m), _concatenation([e.c_in for e in layers[0]]))]
+    for layer in layers:
+        B = _block_diagonal([matrix_bits(e.L_out) for e in layer], m)
+        b = np.array([int(bit) for e in layer for bit in e.c_out], dtype=np.uint8)
+        maps.append((_product(L, B, L_inverse), _concatenation([_product(L, b[:, None])[:, 0]])))
+    return maps
+
+
+def _init_worker(lut, m, nbr_sboxes, L, maps, constants):
+    n = m * nbr_sboxes
+    _worker.update(n=n, round_function=_round_tables(lut, m, nbr_sboxes, L),
+                   maps=[_affine_tables(A, a, n) for A, a in maps],
+                   linear_maps=[_affine_tables(A, 0, n) for A, _ in maps],
+                   constants=_to_words(constants, n))
+
+
+def _validate_worker(task):
+    seed, nbr_keys, plaintexts_per_key = task
+    time_start = time.time()
+    rng = np.random.default_rng(seed)
+    n, maps, linear_maps, constants = _worker["n"], _worker["maps"], _worker["linear_maps"], _worker["constants"]
+    round_function = _worker["round_function"]
+    W, rounds = _words(n), len(maps) - 1
+    counts = np.zeros(rounds + 1, dtype=np.int64)
+
+    def random_states(count):
+        x = rng.integers(0, 2**64, size=(W, count), dtype=np.uint64)
+        if n % 64:
+            x[-1] &= np.uint64(2**64 - 2**(64 - n % 64))  # bits of the last word within the state
+        return x
+
+    for _ in range(nbr_keys):
+        keys = random_states(rounds + 1) ^ constants[:, :rounds + 1]
+        # related round keys (with the same round constants)
+        keys_related = [linear_maps[i](keys[:, i:i + 1] ^ constants[:, i:i + 1]) ^ constants[:, i:i + 1]
+                        for i in range(rounds + 1)]
+        for done in range(0, plaintexts_per_key, _BATCH):
+            x = random_states(min(_BATCH, plaintexts_per_key - done))
+            y = maps[0](x) ^ keys_related[0]
+            x ^= keys[:, :1]
+            counts[0] += np.count_nonzero((maps[0](x) == y).all(axis=0))
+            for i in range(1, rounds + 1):
+                x = round_function(x) ^ keys[:, i:i + 1]
+                y = round_function(y) ^ keys_related[i]
+                counts[i] += np.count_nonzero((maps[i](x) == y).all(axis=0))
+    return counts, time.time() - time_start
+
+
+def validate_trails(cipher, trails, rounds=4, nbr_keys=64, plaintexts_per_key=1 << 16, constants=None,
+                    processes=None, seed=None):
+    """
+    Measures the commutation rates of a trail or of a chain of trails of cipher (see the top of this
+    file) for the round indices 0 to rounds, over nbr_keys random keys and plaintexts_per_key random
+    plaintexts per key, with a process pool. constants lists the round constants c_0, ..., c_rounds
+    as integers (first bit of the state first), and defaults to zero. Returns one dict per round
+    index with the numbers of pairs for which the trail held and of pairs, and the rate, as well as
+    the number of pairs per second and per process.
+    """
+    m = cipher.S.input_size()
+    n = m * cipher.nbr_sboxes
+    maps = round_maps(cipher, trails, rounds)
+    constants = list(constants) if constants is not None else [0] * (rounds + 1)
+    if len(constants) < rounds + 1:
+        raise ValueError(f"{rounds + 1} round constants are needed")
+    processes = processes or os.cpu_count()
+    seed = np.random.SeedSequence(seed)
+    tasks = []
+    for k, child in enumerate(seed.spawn(processes)):
+        share = nbr_keys // processes + (k < nbr_keys % processes)
+        if share:
+            tasks.append((child, share, plaintexts_per_key))
+    with Pool(len(tasks), initializer=_init_worker,
+              initargs=([int(y) for y in cipher.S], m, cipher.nbr_sboxes, matrix_bits(cipher.L), maps, constants)) as pool:
+        results = pool.map(_validate_worker, tasks)
+    counts = sum(counts for counts, _ in results)
+    pairs = nbr_keys * plaintexts_per_key
+    return [{"round": t, "commuting_pairs": int(counts[t]), "pairs": pairs, "rate": counts[t] / pairs}
+            for t in range(rounds + 1)], pairs / sum(elapsed for _, elapsed in results)